@@ -0,0 +1,90 @@
+"""
+Génération en arrière-plan de l'analyse détaillée.
+
+L'analyse détaillée (jusqu'à 1000 jetons) n'est plus sur le chemin de
+l'estimation : elle est lancée dès que la prestation est connue, l'estimation
+est affichée aussitôt et l'analyse remplit son emplacement une fois prête.
+
+Les résultats sont conservés par question (et par version du catalogue) :
+un rerun Streamlit ou une question identique ne les régénère pas. Les échecs
+ne sont pas conservés afin d'être retentés.
+"""
+import contextvars
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+from catalog_manager import CatalogVersion, get_catalog_manager
+
+logger = logging.getLogger(__name__)
+
+DETAILED_ANALYSIS_WORKERS = int(os.getenv('DETAILED_ANALYSIS_WORKERS', '4'))
+DETAILED_ANALYSIS_CACHE_SIZE = int(os.getenv('DETAILED_ANALYSIS_CACHE_SIZE', '500'))
+DETAILED_ANALYSIS_TIMEOUT = float(os.getenv('DETAILED_ANALYSIS_TIMEOUT', '30'))
+
+
+class AnalysisPrefetcher:
+    """Tâches d'analyse partagées par les sessions, dédoublonnées par clé"""
+
+    def __init__(self, workers: int = DETAILED_ANALYSIS_WORKERS, max_entries: int = DETAILED_ANALYSIS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detailed-analysis')
+        self._futures: "OrderedDict[Hashable, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prefetch(self, key: Hashable, func: Callable[..., Any], *args: Any) -> Future:
+        """Lance la génération si elle n'est ni en cours ni déjà disponible"""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self._futures.move_to_end(key)
+                return future
+            # Le span de l'analyse se rattache à la trace de la requête qui l'a lancée
+            future = self._executor.submit(contextvars.copy_context().run, func, *args)
+            self._futures[key] = future
+            while len(self._futures) > self.max_entries:
+                self._futures.popitem(last=False)
+        future.add_done_callback(lambda done: self._forget_failure(key, done))
+        return future
+
+    def _forget_failure(self, key: Hashable, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                if self._futures.get(key) is future:
+                    del self._futures[key]
+
+    def result(self, key: Hashable, timeout: float = DETAILED_ANALYSIS_TIMEOUT) -> Any:
+        """
+        Attend le résultat d'une analyse lancée par prefetch()
+
+        Raises:
+            KeyError: aucune analyse pour cette clé
+            TimeoutError: analyse toujours en cours après `timeout` secondes
+            Exception: l'erreur levée par la génération
+        """
+        with self._lock:
+            future = self._futures[key]
+        return future.result(timeout=timeout)
+
+    def clear(self, old: Optional[CatalogVersion] = None, new: Optional[CatalogVersion] = None):
+        with self._lock:
+            self._futures.clear()
+
+
+_prefetcher: Optional[AnalysisPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> AnalysisPrefetcher:
+    """Instance unique par processus, vidée à chaque nouvelle version du catalogue"""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                prefetcher = AnalysisPrefetcher()
+                get_catalog_manager().on_swap('detailed_analysis', prefetcher.clear)
+                _prefetcher = prefetcher
+    return _prefetcher
@@ -0,0 +1,173 @@
+"""
+Export colonnaire de l'historique des estimations pour les outils BI.
+
+Lit les nouvelles lignes de l'historique SQLite (id > filigrane), les écrit en
+fichiers Parquet (ou Arrow IPC, lisible sans copie via mmap) partitionnés à la
+Hive par mois et par domaine, puis avance le filigrane. Chaque exécution
+n'ajoute donc que les lignes nouvelles.
+
+    exports/
+        _watermark.json
+        month=2026-10/domaine=droit_du_travail/part-000000001234-000000001456.parquet
+
+Les colonnes de l'historique sont toutes exportées (confiance calibrée, niveau
+de routage, empreinte de la question, issue), sauf le type de client détaillé
+et, sans --include-questions, le texte des questions. L'issue (`correct`)
+renseignée après l'export d'une ligne n'y figure pas.
+
+Les colonnes prestation, segment, urgence et niveau de routage sont encodées
+en dictionnaire ; le domaine n'est porté que par le chemin de partition, que
+les lecteurs exposent aussi en dictionnaire :
+
+    ds.dataset('exports', partitioning=ds.HivePartitioning.discover(infer_dictionary=True))
+
+Usage :
+    python analytics_export.py                      # un export incrémental
+    python analytics_export.py --every 3600         # export planifié toutes les heures
+    python analytics_export.py --format ipc         # fichiers Arrow IPC (mmap, zéro copie)
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from history_store import HISTORY_DB, connect
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv('ANALYTICS_EXPORT_DIR', 'exports')
+CHUNK_ROWS = 100000
+NO_DOMAIN = '__aucun__'
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('ts', pa.timestamp('ms', tz='UTC')),
+    ('week', pa.string()),
+    ('request_id', pa.string()),
+    ('client_segment', pa.dictionary(pa.int16(), pa.string())),
+    ('urgency', pa.dictionary(pa.int8(), pa.string())),
+    ('prestation', pa.dictionary(pa.int16(), pa.string())),
+    ('forfait', pa.int32()),
+    ('llm_confidence', pa.float32()),
+    ('retrieval_score', pa.float32()),
+    ('agreement', pa.float32()),
+    ('confidence', pa.float32()),
+    ('correct', pa.int8()),
+    ('route', pa.dictionary(pa.int8(), pa.string())),
+    ('simhash', pa.string()),
+])
+QUESTION_FIELD = pa.field('question', pa.string())
+
+
+def _watermark_path(export_dir: str) -> str:
+    return os.path.join(export_dir, '_watermark.json')
+
+
+def read_watermark(export_dir: str = EXPORT_DIR) -> int:
+    """Dernier id exporté (0 si aucun export)"""
+    try:
+        with open(_watermark_path(export_dir), encoding='utf-8') as f:
+            return int(json.load(f)['last_id'])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def _write_watermark(export_dir: str, last_id: int):
+    path = _watermark_path(export_dir)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'last_id': last_id, 'exported_at': datetime.now(timezone.utc).isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def _to_table(rows: List[Dict[str, Any]], include_questions: bool) -> pa.Table:
+    columns = {name: [row[name] for row in rows] for name in SCHEMA.names if name != 'ts'}
+    columns['ts'] = [int(row['ts'] * 1000) for row in rows]
+    arrays = [pa.array(columns[field.name], type=field.type) for field in SCHEMA]
+    schema = SCHEMA
+    if include_questions:
+        arrays.append(pa.array([row['question'] for row in rows], type=pa.string()))
+        schema = schema.append(QUESTION_FIELD)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _write_partition(table: pa.Table, directory: str, name: str, file_format: str):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    tmp_path = path + '.tmp'
+    if file_format == 'ipc':
+        # IPC non compressé : les outils BI peuvent le mapper en mémoire sans copie
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+    else:
+        pq.write_table(table, tmp_path, compression='zstd', use_dictionary=True)
+    os.replace(tmp_path, path)
+
+
+def run_export(db_path: str = HISTORY_DB, export_dir: str = EXPORT_DIR, file_format: str = 'parquet',
+               include_questions: bool = False) -> int:
+    """
+    Exporte les lignes postérieures au filigrane
+
+    Returns:
+        int: Nombre de lignes exportées
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    watermark = read_watermark(export_dir)
+    extension = 'arrow' if file_format == 'ipc' else 'parquet'
+    conn = connect(db_path)
+    conn.row_factory = lambda cursor, row: {description[0]: value for description, value in zip(cursor.description, row)}
+    exported = 0
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT * FROM estimates WHERE id > ? ORDER BY id LIMIT ?", (watermark, CHUNK_ROWS)
+            ).fetchall()
+            if not rows:
+                break
+
+            partitions: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+            for row in rows:
+                month = datetime.fromtimestamp(row['ts'], timezone.utc).strftime('%Y-%m')
+                partitions[(month, row['domaine'] or NO_DOMAIN)].append(row)
+
+            first_id, last_id = rows[0]['id'], rows[-1]['id']
+            for (month, domaine), partition_rows in partitions.items():
+                directory = os.path.join(export_dir, f"month={month}", f"domaine={domaine}")
+                name = f"part-{first_id:012d}-{last_id:012d}.{extension}"
+                _write_partition(_to_table(partition_rows, include_questions), directory, name, file_format)
+
+            # Le filigrane n'avance qu'une fois le lot entièrement écrit
+            watermark = last_id
+            _write_watermark(export_dir, watermark)
+            exported += len(rows)
+    finally:
+        conn.close()
+
+    logger.info(f"Export analytique : {exported} lignes, filigrane {watermark}")
+    return exported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export colonnaire de l'historique des estimations")
+    parser.add_argument('--db', default=HISTORY_DB)
+    parser.add_argument('--output', default=EXPORT_DIR)
+    parser.add_argument('--format', choices=('parquet', 'ipc'), default='parquet')
+    parser.add_argument('--include-questions', action='store_true', help="Exporte aussi le texte des questions")
+    parser.add_argument('--every', type=int, help="Relance l'export toutes les N secondes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        count = run_export(args.db, args.output, args.format, args.include_questions)
+        print(f"{count} lignes exportées vers {args.output}")
+        if not args.every:
+            break
+        time.sleep(args.every)
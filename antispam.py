@@ -0,0 +1,178 @@
+"""
+Protection anti-spam du formulaire de contact, sans état de session.
+
+Le calcul demandé (a + b) est dérivé d'un HMAC-SHA256 de l'identifiant de
+session et de la fenêtre de temps courante (ANTISPAM_TOKEN_TTL secondes) :
+rien n'est conservé côté serveur, l'indice de fenêtre signé tient lieu
+d'expiration et la réponse est vérifiée en temps constant. La fenêtre
+précédente reste acceptée pour un formulaire affiché juste avant la bascule.
+
+La clé ANTISPAM_SECRET doit être commune aux répliques ; à défaut, une clé
+aléatoire est tirée au démarrage (les défis en cours sont alors invalidés à
+chaque redémarrage).
+
+Les envois sont limités par adresse IP (seau à jetons : ANTISPAM_BURST envois,
+un jeton rendu toutes les ANTISPAM_REFILL secondes). Les seaux tiennent dans
+un LRU de ANTISPAM_MAX_CLIENTS entrées : un afflux de robots ne coûte ni
+mémoire ni envoi SMTP. Avec un état partagé entre répliques (shared_state,
+backend autre que memory://), la limite est tenue par le backend en fenêtre
+glissante (ANTISPAM_BURST envois par ANTISPAM_BURST x ANTISPAM_REFILL secondes),
+le seau local ne servant qu'en cas d'indisponibilité du backend.
+
+Usage :
+    python antispam.py --bench          # coût d'émission et de vérification
+"""
+import argparse
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from shared_state import StateBackend, StateBackendError, get_state_backend
+
+logger = logging.getLogger(__name__)
+
+ANTISPAM_SECRET = os.getenv('ANTISPAM_SECRET', '').encode('utf-8') or secrets.token_bytes(32)
+ANTISPAM_TOKEN_TTL = int(os.getenv('ANTISPAM_TOKEN_TTL', '600'))
+ANTISPAM_BURST = float(os.getenv('ANTISPAM_BURST', '3'))
+ANTISPAM_REFILL = float(os.getenv('ANTISPAM_REFILL', '60'))
+ANTISPAM_MAX_CLIENTS = int(os.getenv('ANTISPAM_MAX_CLIENTS', '10000'))
+
+
+def _sign(session_id: str, window: int) -> bytes:
+    return hmac.new(ANTISPAM_SECRET, f"{session_id}:{window}".encode('utf-8'), hashlib.sha256).digest()
+
+
+def _operands(signature: bytes) -> Tuple[int, int]:
+    return signature[0] % 10 + 1, signature[1] % 10 + 1
+
+
+class Challenge:
+    """Calcul à résoudre et fin de validité de la fenêtre qui l'a signé"""
+    __slots__ = ('a', 'b', 'expires')
+
+    def __init__(self, a: int, b: int, expires: float):
+        self.a = a
+        self.b = b
+        self.expires = expires
+
+    @property
+    def label(self) -> str:
+        return f"{self.a} + {self.b} = "
+
+
+def issue_challenge(session_id: str, now: Optional[float] = None) -> Challenge:
+    """Défi de la fenêtre courante : identique à chaque rerun de la fenêtre"""
+    window = int((time.time() if now is None else now) // ANTISPAM_TOKEN_TTL)
+    a, b = _operands(_sign(session_id, window))
+    return Challenge(a, b, (window + 2) * ANTISPAM_TOKEN_TTL)
+
+
+def verify_answer(session_id: str, answer: str, now: Optional[float] = None) -> Tuple[bool, str]:
+    """
+    Vérifie la réponse au défi de la fenêtre courante ou précédente, sans état
+
+    Les deux fenêtres sont toujours comparées, en temps constant.
+
+    Returns:
+        (valide, message d'erreur)
+    """
+    answer = str(answer).strip()
+    if not answer.isdigit() or len(answer) > 3:
+        return False, "Veuillez entrer un nombre valide pour le calcul."
+    current = int((time.time() if now is None else now) // ANTISPAM_TOKEN_TTL)
+    matched = False
+    for window in (current, current - 1):
+        a, b = _operands(_sign(session_id, window))
+        matched |= hmac.compare_digest(answer.encode('ascii'), str(a + b).encode('ascii'))
+    if not matched:
+        return False, "La réponse au calcul est incorrecte."
+    return True, ""
+
+
+class SubmissionLimiter:
+    """Seaux à jetons par client, bornés en nombre (LRU), ou fenêtre glissante de l'état partagé"""
+
+    def __init__(self, burst: float = ANTISPAM_BURST, refill: float = ANTISPAM_REFILL,
+                 max_clients: int = ANTISPAM_MAX_CLIENTS, backend: Optional[StateBackend] = None):
+        self.burst = burst
+        self.refill = refill
+        self.max_clients = max_clients
+        self.backend = backend
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client: str, now: Optional[float] = None) -> Tuple[bool, int]:
+        """
+        Consomme un jeton du client
+
+        Returns:
+            (accepté, secondes d'attente avant le prochain jeton)
+        """
+        now = time.time() if now is None else now
+        if self.backend is not None:
+            window = self.burst * self.refill
+            try:
+                accepted, _, oldest = self.backend.hit_window(f"contact:{client}", window, int(self.burst), now=now)
+                return accepted, 0 if accepted else int(oldest + window - now) + 1
+            except StateBackendError as e:
+                logger.warning(f"Limite d'envois partagée indisponible, limite locale : {e}")
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) / self.refill)
+            accepted = tokens >= 1
+            if accepted:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                # Le client le moins récent repart avec un seau plein
+                self._buckets.popitem(last=False)
+        return accepted, 0 if accepted else int((1 - tokens) * self.refill) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'clients': len(self._buckets), 'max_clients': self.max_clients}
+
+
+_limiter: Optional[SubmissionLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_submission_limiter() -> SubmissionLimiter:
+    """Limiteur unique par processus, adossé à l'état partagé s'il est commun aux répliques"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                backend = get_state_backend()
+                _limiter = SubmissionLimiter(backend=backend if backend.name != 'memory' else None)
+    return _limiter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anti-spam du formulaire de contact")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('-n', type=int, default=100000)
+    args = parser.parse_args()
+
+    session_ids = [secrets.token_hex(8) for _ in range(1000)]
+    start = time.perf_counter()
+    challenges = [issue_challenge(session_ids[i % 1000]) for i in range(args.n)]
+    issued = time.perf_counter() - start
+    start = time.perf_counter()
+    valid = sum(verify_answer(session_ids[i % 1000], str(challenge.a + challenge.b))[0]
+                for i, challenge in enumerate(challenges))
+    verified = time.perf_counter() - start
+    print(f"Émission : {issued / args.n * 1e6:.1f} µs/défi, vérification : {verified / args.n * 1e6:.1f} µs/défi "
+          f"({valid}/{args.n} valides)")
+
+    limiter = SubmissionLimiter(max_clients=10000)
+    start = time.perf_counter()
+    rejected = sum(not limiter.acquire(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")[0] for i in range(args.n))
+    elapsed = time.perf_counter() - start
+    print(f"Limiteur : {elapsed / args.n * 1e6:.1f} µs/envoi, {limiter.stats()['clients']} clients suivis "
+          f"pour {args.n} adresses, {rejected} refus")
@@ -1,75 +1,59 @@
 import streamlit as st
 import os
-from openai import OpenAI
 import json
 import logging
-from logging.handlers import RotatingFileHandler
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import Tuple, Dict, Any
-import importlib.util
-from collections import Counter, defaultdict
+import contextvars
+import hashlib
+from typing import Tuple, Dict, Any, List, Optional, Callable
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import threading
-import random
+from devis import compose_quote
+from catalog_manager import get_catalog_manager
+import health
+from log_pipeline import configure_logging, set_request_id, request_id_var
+from history_store import get_history_store
+from tracing import tracer, traced, set_span_attributes
+from calibration import get_calibrator
+import self_consistency
+from model_router import OPENAI_FAST_MODEL, get_router
+from analysis_prefetch import get_prefetcher
+from session_store import SessionRecord, SessionStore, get_session_store
+from shared_state import StateBackendError, get_state_backend
+from outbox import STATUS_LABELS, get_outbox, idempotency_key
+from antispam import get_submission_limiter, issue_challenge, verify_answer
+from normalization import normalize
+from prefilter import PREFILTER_MAX_CHARS, prefilter_question, record_submission
+import explanations
+from prompt_compiler import (PROMPT_COMPILER, PromptCompiler, count_tokens, get_prompt_compiler,
+                             legacy_classification_prompt, load_tokenizer_async)
 
 # Constantes pour le rate limiting global
-MAX_GLOBAL_REQUESTS = 100  # Maximum de requêtes globales
+MAX_GLOBAL_REQUESTS = int(os.getenv('MAX_GLOBAL_REQUESTS', '100'))  # Maximum de requêtes globales
 RESET_INTERVAL = 600     # 10 minutes en secondes
 
-class KeepAliveManager:
-    def __init__(self):
-        if 'last_keepalive' not in st.session_state:
-            st.session_state.last_keepalive = datetime.now()
-        if 'keepalive_count' not in st.session_state:
-            st.session_state.keepalive_count = 0
-
-    def handle_keepalive(self, auth_token: str = None) -> dict:
-        """
-        Gère les requêtes de keepalive
-        
-        Args:
-            auth_token: Token d'authentification optionnel
-        
-        Returns:
-            dict: Réponse avec statut et informations
-        """
-        expected_token = os.getenv('KEEPALIVE_TOKEN', 'ping')
-        
-        # Vérification basique du token
-        if auth_token != expected_token:
-            logging.warning(f"Tentative de keepalive avec un token invalide depuis {st.get_client_ip()}")
-            return {
-                "status": "error",
-                "message": "Token invalide",
-                "timestamp": datetime.now().isoformat()
-            }
-
-        # Mise à jour des statistiques
-        st.session_state.last_keepalive = datetime.now()
-        st.session_state.keepalive_count += 1
+# Serveur d'envoi des emails (un serveur local sans TLS pour les tests de charge)
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') == '1'
 
-        # Log de l'événement
-        logging.info(f"Keepalive reçu - Total: {st.session_state.keepalive_count}")
+# Proxys de confiance devant l'application : chacun ajoute une adresse à droite de
+# X-Forwarded-For. Par défaut 0 : l'en-tête est ignoré (il est falsifiable quand
+# l'application est exposée directement). Derrière un reverse proxy ou un
+# répartiteur de charge, indiquer leur nombre (TRUSTED_PROXIES=1 pour un seul),
+# sinon tous les clients partagent l'adresse du proxy pour l'anti-spam.
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '0'))
 
-        return {
-            "status": "success",
-            "last_keepalive": st.session_state.last_keepalive.isoformat(),
-            "count": st.session_state.keepalive_count,
-            "timestamp": datetime.now().isoformat()
-        }
-
-# Ajoutez ces lignes dans votre fichier app.py principal
-keep_alive_manager = KeepAliveManager()
+# Durée de l'animation de progression (0 pour la supprimer, 1 pour la durée normale)
+PROGRESS_TIME_SCALE = float(os.getenv('PROGRESS_TIME_SCALE', '1'))
 
-# Route pour le keepalive
+# Route pour le keepalive (compatibilité ?keepalive) : compteurs partagés par le processus,
+# les sondes externes doivent de préférence viser le serveur de santé (HEALTH_PORT)
 def handle_keepalive_endpoint():
     params = st.experimental_get_query_params()
     auth_token = params.get('token', [None])[0]
     
-    response = keep_alive_manager.handle_keepalive(auth_token)
+    response = health.handle_keepalive(auth_token)
     
     # Conversion en JSON pour l'affichage
     st.write(json.dumps(response, indent=2))
@@ -86,86 +70,54 @@ def display_analysis_summary(question: str, detailed_analysis: str):
 
 def check_global_limit() -> Tuple[bool, int]:
     """
-    Vérifie la limite globale de requêtes
-    Retourne (peut_continuer, requetes_restantes)
+    Vérifie la limite globale de requêtes (commune à toutes les sessions du processus)
+    Retourne (peut_continuer, minutes_avant_reinitialisation)
     """
-    current_time = time.time()
-
-    # Initialisation des variables globales si nécessaires
-    if 'global_request_count' not in st.session_state:
-        st.session_state.global_request_count = 0
-    if 'last_reset_time' not in st.session_state:
-        st.session_state.last_reset_time = current_time
-
-    # Vérifier si on doit réinitialiser le compteur
-    if current_time - st.session_state.last_reset_time > RESET_INTERVAL:
-        st.session_state.global_request_count = 0
-        st.session_state.last_reset_time = current_time
-
-    # Vérifier si on a atteint la limite
-    if st.session_state.global_request_count >= MAX_GLOBAL_REQUESTS:
-        time_until_reset = RESET_INTERVAL - (current_time - st.session_state.last_reset_time)
-        minutes_left = int(time_until_reset / 60)
-        return False, minutes_left
-
-    # Incrémenter le compteur
-    st.session_state.global_request_count += 1
-    return True, MAX_GLOBAL_REQUESTS - st.session_state.global_request_count
+    peut_continuer, time_until_reset = get_session_store().check_global(MAX_GLOBAL_REQUESTS, RESET_INTERVAL)
+    return peut_continuer, int(time_until_reset / 60)
 
 def get_session_id():
-    """Obtient ou crée un ID de session unique"""
+    """Obtient ou crée un ID de session unique (seule donnée conservée dans st.session_state)"""
     if 'session_id' not in st.session_state:
-        st.session_state.session_id = str(time.time())
+        st.session_state.session_id = SessionStore.new_session_id()
     return st.session_state.session_id
 
+def get_session() -> SessionRecord:
+    """Enregistrement compact de la session courante"""
+    return get_session_store().get(get_session_id())
+
 class SimpleRateLimiter:
     def __init__(self, max_requests=3, time_window_minutes=5):
         self.max_requests = max_requests
-        self.time_window = timedelta(minutes=time_window_minutes)
-        self.requests = defaultdict(list)
+        self.time_window = time_window_minutes * 60
 
-    def check_limit(self, session_id: str) -> Tuple[bool, int]:
+    def check_limit(self, session: SessionRecord) -> Tuple[bool, int]:
         """
-        Vérifie si la limite est atteinte
+        Vérifie si la limite est atteinte (fenêtre glissante tenue par l'état partagé)
         Retourne (peut_continuer, temps_attente_en_minutes)
         """
-        if 'requests' not in st.session_state:
-            st.session_state.requests = []
+        current_time = time.time()
+        try:
+            accepted, _, oldest = get_state_backend().hit_window(
+                f"rate:{session.session_id}", self.time_window, self.max_requests, current_time
+            )
+        except StateBackendError as e:
+            logger.error(f"Limite de débit non vérifiée : {e}")
+            return True, 0
 
-        current_time = datetime.now()
-        cutoff_time = current_time - self.time_window
-        
-        # Nettoyer les anciennes requêtes
-        st.session_state.requests = [
-            time for time in st.session_state.requests
-            if time > cutoff_time
-        ]
-        
-        if len(st.session_state.requests) >= self.max_requests:
+        if not accepted:
             # Calculer le temps restant avant la prochaine utilisation possible
-            if st.session_state.requests:
-                temps_attente = max(0, (st.session_state.requests[0] + self.time_window - current_time).seconds // 60)
-                return False, temps_attente
-            return False, self.time_window.seconds // 60
-            
-        # Ajouter la nouvelle requête
-        st.session_state.requests.append(current_time)
+            temps_attente = max(0, int(oldest + self.time_window - current_time) // 60)
+            return False, temps_attente
         return True, 0
 
 # Créer l'instance globale du rate limiter
 rate_limiter = SimpleRateLimiter(max_requests=3, time_window_minutes=5)
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+# Configuration du logging (lignes JSON écrites par un thread dédié, installé une fois par processus)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Ajout d'un handler pour écrire dans un fichier
-file_handler = RotatingFileHandler('app.log', maxBytes=10000, backupCount=5)
-file_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
 def timeout_handler(func, timeout_seconds=30):
     """
     Exécute une fonction avec un timeout en utilisant threading
@@ -179,7 +131,9 @@ def timeout_handler(func, timeout_seconds=30):
         except Exception as e:
             error[0] = e
     
-    thread = threading.Thread(target=worker)
+    # Le contexte (identifiant de requête) suit le travail dans le thread
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(worker,))
     thread.daemon = True
     thread.start()
     thread.join(timeout=timeout_seconds)
@@ -202,6 +156,7 @@ def execute_with_timeout(func, *args, timeout_seconds=30):
         return func(*args)
     return timeout_handler(wrapped_func, timeout_seconds)
 
+@traced()
 def log_question(question: str, client_type: str, urgency: str, estimation: dict = None):
     """
     Journalise une question avec l'estimation si disponible
@@ -216,6 +171,8 @@ Question : {question}
 Estimation : {estimation['forfait']}€ HT
 Domaine : {estimation['domaine']}
 Prestation : {estimation['prestation']}
+Confiance : {estimation['confidence']:.0%} (modèle : {estimation['llm_confidence']:.0%})
+Référence : {request_id_var.get()}
 """
     else:
         log_message = f"""
@@ -225,7 +182,14 @@ Urgence : {urgency}
 Question : {question}
 """
     
-    logger.info(log_message)
+    fields = {'client': client_type, 'urgence': urgency, 'question': question,
+              'empreinte': f"{normalize(question).simhash:016x}"}
+    if estimation:
+        fields.update(estimation)
+    logger.info("Nouvelle question posée", extra={'fields': fields})
+
+    # Historique interrogeable (écrit par lots en arrière-plan)
+    get_history_store().record(question, client_type, urgency, estimation, request_id=request_id_var.get())
     
     # Envoi de l'email avec les secrets Streamlit
     subject = "Nouvelle question posée sur Estim'IA"
@@ -239,10 +203,15 @@ st.set_page_config(
     initial_sidebar_state="collapsed"  # Cache la barre latérale
 )
 
-# Fonction pour envoyer des emails
-def send_log_email(subject, body, to_email):
-    from_email = os.getenv('EMAIL_FROM')
-    password = os.getenv('EMAIL_PASSWORD')
+@traced('smtp_send')
+def send_email(from_email: str, password: str, to_email: str, subject: str, body: str):
+    """
+    Envoie un email texte via SMTP
+    Les modules smtplib et email ne sont importés qu'au premier envoi
+    """
+    import smtplib
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
 
     msg = MIMEMultipart()
     msg['From'] = from_email
@@ -250,14 +219,30 @@ def send_log_email(subject, body, to_email):
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
 
+    health.stats.smtp_started()
     try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
+            if SMTP_STARTTLS:
+                server.starttls()
             server.login(from_email, password)
             server.send_message(msg)
-        logger.info(f"Log email sent to {to_email}")
+    finally:
+        health.stats.smtp_finished()
+
+def deliver_email(to_email: str, subject: str, body: str):
+    """Envoi effectif d'un message de la boîte d'envoi (thread de livraison)"""
+    send_email(os.getenv('EMAIL_FROM'), os.getenv('EMAIL_PASSWORD'), to_email, subject, body)
+
+# Fonction pour envoyer des emails
+def send_log_email(subject, body, to_email):
+    """Dépose l'email de journal dans la boîte d'envoi, sans attendre le serveur SMTP"""
+    request_id = request_id_var.get()
+    key = idempotency_key('log', request_id if request_id != '-' else body)
+    try:
+        reference, _ = get_outbox(deliver_email).enqueue(key, 'log', to_email, subject, body)
+        logger.info(f"Log email {reference} queued for {to_email}")
     except Exception as e:
-        logger.error(f"Failed to send log email: {str(e)}")
+        logger.error(f"Failed to queue log email: {str(e)}")
 
 # Fonction pour appliquer le CSS personnalisé
 def apply_custom_css():
@@ -305,85 +290,180 @@ def apply_custom_css():
         </style>
     """, unsafe_allow_html=True)
     
-# Configuration du client OpenAI
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY n'est pas défini dans les variables d'environnement")
+# Configuration du client OpenAI (instancié au premier appel, partagé entre les sessions)
+@st.cache_resource
+def get_openai_client():
+    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY n'est pas défini dans les variables d'environnement")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY)
 
-# Chargement des modules
-def load_py_module(file_path: str, module_name: str):
-    try:
-        spec = importlib.util.spec_from_file_location(module_name, file_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        return module
-    except Exception as e:
-        logger.error(f"Erreur lors du chargement du module {module_name}: {e}")
-        return None
+# Serveur de santé hors session Streamlit (démarré une fois par processus)
+health.start_health_server()
+
+# Encodage tiktoken chargé hors du chemin des requêtes (estimation en attendant)
+load_tokenizer_async()
 
-# Chargement des modules personnalisés
-prestations_module = load_py_module('./prestations.py', 'prestations')
-instructions_module = load_py_module('./chatbot-instructions.py', 'consignes_chatbot')
+# Catalogue courant : rechargé à chaud lorsque prestations.py change, chaque rerun lit la dernière version
+catalog = get_catalog_manager().current()
 
 # Initialisation des variables globales
-prestations = prestations_module.get_prestations() if prestations_module else {}
-instructions = instructions_module.get_chatbot_instructions() if instructions_module else ""
+prestations = catalog.prestations
+instructions = catalog.instructions
+price_tables = catalog.price_tables
 
 
+def parse_classification(content: str, compiler: Optional[PromptCompiler] = None) -> Dict[str, Any]:
+    """
+    Analyse la réponse JSON du modèle
 
-def analyze_question(question: str, client_type: str, urgency: str) -> Tuple[str, str, float, bool]:
-    options = [f"{domaine}: {', '.join(prestations_domaine['prestations'].keys())}" for domaine, prestations_domaine in prestations.items()]
-    prompt = f"""Analysez la question suivante et déterminez si elle concerne un problème juridique. Si c'est le cas, identifiez le domaine juridique et la prestation la plus pertinente.
+    Args:
+        compiler: compilateur du prompt envoyé, qui retraduit les identifiants courts
 
-Question : {question}
-Type de client : {client_type}
-Degré d'urgence : {urgency}
+    Returns:
+        dict: domaine, prestation, confiance, pertinence et candidats du devis
+    """
+    result = json.loads(content)
+    if compiler is not None:
+        result = compiler.decode(result)
+    domain = result['domaine']
+    service = result['prestation']
+
+    # La prestation principale est toujours incluse, les complémentaires sont pondérées
+    candidates = [(domain, service, 1.0)]
+    for complement in result.get('prestations_complementaires') or []:
+        if isinstance(complement, dict):
+            candidates.append((complement.get('domaine'), complement.get('prestation'), complement.get('probabilite', 0.0)))
+
+    return {
+        'domaine': domain,
+        'prestation': service,
+        'confidence': float(result['indice_confiance']),
+        'is_relevant': bool(result['est_juridique']) and domain in prestations and service in prestations[domain]['prestations'],
+        'candidates': candidates,
+    }
+
+
+def _classification_key(classification: Dict[str, Any]) -> Tuple[str, str]:
+    return classification['domaine'], classification['prestation']
 
-Options de domaines et prestations :
-{' '.join(options)}
-
-Répondez au format JSON strict suivant :
-{{
-    "est_juridique": true/false,
-    "domaine": "nom du domaine juridique",
-    "prestation": "nom de la prestation (pas le label)",
-    "explication": "Brève explication de votre analyse",
-    "indice_confiance": 0.0 à 1.0
-}}
-"""
 
+def _classify(messages: list, model: str, temperature: float, samples: int = 1,
+              compiler: Optional[PromptCompiler] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """Un appel au modèle ; `samples` complétions si le mode « n » est actif"""
+    response = get_openai_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=500,
+        n=samples
+    )
+    classifications = []
+    for choice in response.choices:
+        try:
+            classifications.append(parse_classification(choice.message.content, compiler))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Classification illisible : {e}")
+    return classifications, response.usage.total_tokens if response.usage else 0
+
+
+@traced('classify_llm')
+def classify_with_model(messages: list, model: str, compiler: Optional[PromptCompiler] = None) -> Optional[Dict[str, Any]]:
+    """
+    Classification par un modèle, départagée à la majorité si SELF_CONSISTENCY_SAMPLES > 1
+
+    La confiance retenue est la moyenne de celles des échantillons gagnants,
+    l'accord est la part des échantillons d'accord avec la réponse retenue.
+    """
+    samples = self_consistency.SELF_CONSISTENCY_SAMPLES
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": instructions},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=500
+        if samples <= 1:
+            classifications, tokens = _classify(messages, model, temperature=0.3, compiler=compiler)
+            vote = self_consistency.majority(classifications, _classification_key)
+        elif self_consistency.SELF_CONSISTENCY_MODE == 'n':
+            classifications, tokens = _classify(messages, model, self_consistency.SELF_CONSISTENCY_TEMPERATURE, samples, compiler)
+            vote = self_consistency.majority(classifications, _classification_key)
+        else:
+            token_counts = []
+
+            def sample():
+                sampled, sample_tokens = _classify(messages, model, self_consistency.SELF_CONSISTENCY_TEMPERATURE, compiler=compiler)
+                token_counts.append(sample_tokens)
+                return sampled[0] if sampled else None
+
+            vote = self_consistency.vote_parallel(sample, _classification_key, samples)
+            tokens = sum(token_counts)
+    except Exception as e:
+        logger.error(f"Erreur lors de la classification par {model} : {e}")
+        return None
+
+    set_span_attributes(model=model, tokens=tokens, samples=vote.samples,
+                        agreement=round(vote.agreement, 2), early_exit=vote.early_exit)
+    if not vote.winners:
+        return None
+    if vote.samples > 1:
+        logger.info(f"Vote {model} : {len(vote.winners)}/{vote.samples} échantillons d'accord")
+    return {
+        **vote.winners[0],
+        'confidence': sum(c['confidence'] for c in vote.winners) / len(vote.winners),
+        'agreement': vote.agreement,
+    }
+
+
+@traced()
+def analyze_question(question: str, client_type: str, urgency: str) -> Tuple[str, str, float, bool, List[Tuple[str, str, float]], float, str]:
+    """
+    Classe la question (domaine, prestation) au niveau le moins coûteux suffisant :
+    cache, index local, petit modèle, puis grand modèle si la confiance est faible
+
+    Returns:
+        (domaine, prestation, confiance, pertinence, candidats, accord, niveau)
+    """
+    # Prompt compilé (identifiants courts, budget de jetons) ou prompt d'origine si PROMPT_COMPILER=0
+    compiler = get_prompt_compiler(catalog) if PROMPT_COMPILER else None
+    if compiler is not None:
+        messages, prompt_tokens = compiler.classification_messages(question, client_type, urgency)
+    else:
+        messages = [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": legacy_classification_prompt(prestations, question, client_type, urgency)}
+        ]
+        prompt_tokens = count_tokens(messages[0]['content']) + count_tokens(messages[1]['content'])
+    set_span_attributes(prompt_tokens=prompt_tokens)
+
+    try:
+        classification = get_router().route(
+            catalog, question, client_type, urgency, lambda model: classify_with_model(messages, model, compiler)
+        )
+        if classification is None:
+            raise ValueError("aucune classification exploitable")
+
+        domain, service = classification['domaine'], classification['prestation']
+        set_span_attributes(
+            domain=domain,
+            tier=classification['tier'],
+            cache_hit=classification['tier'] == 'cache',
+            escalations=classification['escalations']
         )
-        result = json.loads(response.choices[0].message.content)
-        
-        domain = result['domaine']
-        service = result['prestation']
-        confidence = result['indice_confiance']
-        is_relevant = result['est_juridique'] and domain in prestations and service in prestations[domain]['prestations']
-        
         logger.info(f"Domaine identifié : {domain}")
         logger.info(f"Prestation identifiée : {service}")
-        
-        return domain, service, confidence, is_relevant
+        logger.info(f"Niveau de routage : {classification['tier']}")
+
+        return (domain, service, classification['confidence'], classification['is_relevant'],
+                classification['candidates'], classification['agreement'], classification['tier'])
     except Exception as e:
         logger.error(f"Erreur lors de l'analyse de la question: {e}")
-        return "", "", 0.0, False
+        return "", "", 0.0, False, [], 0.0, ""
 
 def check_response_relevance(response: str, options: list) -> bool:
     response_lower = response.lower()
     return any(option.lower().split(':')[0].strip() in response_lower for option in options)
 
+@traced()
 def calculate_estimate(domaine: str, prestation: str, urgency: str) -> Tuple[int, int, list, Dict[str, Any], str, str]:
+    set_span_attributes(domain=domaine, urgency=urgency)
     try:
         # Récupérer les prestations pour le domaine spécifié
         domaine_info = prestations.get(domaine)
@@ -432,6 +512,7 @@ def calculate_estimate(domaine: str, prestation: str, urgency: str) -> Tuple[int
         return None, None, [f"Erreur lors du calcul de l'estimation : {str(e)}"], {}, "", ""
 
 
+@traced()
 def get_detailed_analysis(question: str, client_type: str, urgency: str, domaine: str, prestation: str) -> Tuple[str, Dict[str, Any], str]:
     prompt = f"""En tant qu'assistant juridique virtuel pour View Avocats, analysez la question suivante et expliquez votre raisonnement pour le choix du domaine juridique et de la prestation en utilisant un langage clair et accessible aux non-juristes.
 
@@ -454,17 +535,18 @@ Listez les sources d'information utilisées pour cette analyse, si applicable.
 Assurez-vous que chaque partie est clairement séparée et que le JSON dans la partie 2 est valide et strict."""
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = get_openai_client().chat.completions.create(
+            model=OPENAI_FAST_MODEL,
             messages=[
-                {"role": "system", "content": instructions},
+                {"role": "system", "content": get_prompt_compiler(catalog).system_prompt if PROMPT_COMPILER else instructions},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.3,
             max_tokens=1000
         )
         content = response.choices[0].message.content.strip()
-        logger.info(f"Réponse brute de l'API : {content}")
+        set_span_attributes(domain=domaine, tokens=response.usage.total_tokens if response.usage else 0)
+        logger.info("Réponse brute de l'API", extra={'payload': content})
 
         parts = content.split('\n\n')
         
@@ -499,14 +581,29 @@ Assurez-vous que chaque partie est clairement séparée et que le JSON dans la p
 
         return analysis, elements_used, sources
     except Exception as e:
+        # Remontée à l'appelant : un échec n'est pas conservé par le préchargeur et sera retenté
         logger.exception(f"Erreur lors de l'analyse détaillée : {e}")
-        return "Une erreur s'est produite lors de l'analyse.", {
-            "domaine": {"nom": domaine, "description": "Erreur dans l'analyse"},
-            "prestation": {"nom": prestation, "description": "Erreur dans l'analyse"}
-        }, "Non disponible en raison d'une erreur."
+        raise
 
 
+def wait_detailed_analysis(analysis_key: tuple) -> Optional[Tuple[str, Dict[str, Any], str]]:
+    """
+    Résultat de l'analyse détaillée lancée en arrière-plan, None en cas d'échec
 
+    L'analyse est relancée si le préchargeur ne la détient plus (échec oublié,
+    éviction) : la clé porte les arguments de get_detailed_analysis.
+    """
+    prefetcher = get_prefetcher()
+    try:
+        prefetcher.prefetch(analysis_key, get_detailed_analysis, *analysis_key[1:])
+        return prefetcher.result(analysis_key)
+    except Exception as e:
+        logger.error(f"Analyse détaillée indisponible : {e!r}")
+        return None
+
+
+
+@traced()
 def display_analysis_progress():
     steps = {
         1: {"desc": "Examen de la situation...", "time": 3.0},
@@ -524,20 +621,23 @@ def display_analysis_progress():
         progress = step_num / len(steps)
         progress_bar.progress(progress)
         progress_text.write(f"⏳ {step_info['desc']}")
-        time.sleep(step_info['time'])  # Utilise le temps spécifique pour chaque étape
+        time.sleep(step_info['time'] * PROGRESS_TIME_SCALE)  # Utilise le temps spécifique pour chaque étape
     
     return progress_text, progress_bar
 
 
 
-def send_contact_email(name: str, email: str, phone: str, message: str) -> bool:
+def contact_key(name: str, email: str, phone: str, message: str) -> str:
+    """Clé d'idempotence d'un message de contact : même contenu le même jour = même message"""
+    return idempotency_key('contact', email, name, phone, message, datetime.utcnow().strftime('%Y-%m-%d'))
+
+def send_contact_email(name: str, email: str, phone: str, message: str) -> Optional[str]:
     """
-    Envoie un email de contact
+    Dépose un email de contact dans la boîte d'envoi
+    Retourne la référence du message (None si la boîte d'envoi est indisponible)
     """
     try:
-        from_email = os.getenv('EMAIL_FROM')
         to_email = st.secrets["EMAIL_TO"]
-        password = os.getenv('EMAIL_PASSWORD')
 
         subject = f"Nouveau message de contact - Estim'IA"
         
@@ -552,79 +652,87 @@ Message :
 {message}
 """
 
-        msg = MIMEMultipart()
-        msg['From'] = from_email
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(from_email, password)
-            server.send_message(msg)
-            
-        logger.info(f"Contact email sent from {email}")
-        return True
+        reference, created = get_outbox(deliver_email).enqueue(contact_key(name, email, phone, message), 'contact',
+                                                               to_email, subject, body)
+        if created:
+            logger.info(f"Contact email {reference} queued from {email}")
+        return reference
         
     except Exception as e:
-        logger.error(f"Failed to send contact email: {str(e)}")
-        return False
+        logger.error(f"Failed to queue contact email: {str(e)}")
+        return None
+
+def display_contact_status(container, reference: str):
+    """Affiche l'accusé de réception et l'état de livraison d'un message de contact"""
+    message = get_outbox(deliver_email).status(reference)
+    if message is None:
+        return
+    if message['status'] == 'failed':
+        container.warning(f"""
+        ⚠️ Votre message (référence {reference}) n'a pas pu être transmis.
+        Veuillez nous contacter directement par téléphone.
+        """)
+    else:
+        container.success(f"✅ Message reçu (référence {reference}, {STATUS_LABELS[message['status']]})")
+
+def get_client_ip() -> str:
+    """
+    Adresse IP du client, à défaut l'identifiant de session
+
+    Derrière TRUSTED_PROXIES proxys, l'adresse retenue est celle ajoutée par le
+    premier d'entre eux (TRUSTED_PROXIES-ième en partant de la droite de
+    X-Forwarded-For) : les entrées plus à gauche sont fournies par le client.
+    Avec TRUSTED_PROXIES=0 (défaut), l'en-tête est ignoré et l'adresse de la
+    connexion est retenue.
+    """
+    try:
+        from streamlit import runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        request = getattr(runtime.get_instance().get_client(ctx.session_id), 'request', None) if ctx else None
+        if request is not None:
+            hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+            if TRUSTED_PROXIES and hops:
+                return hops[-min(TRUSTED_PROXIES, len(hops))]
+            return request.remote_ip
+    except Exception as e:
+        logger.debug(f"Adresse du client indisponible : {e}")
+    return get_session_id()
 
 class AntiSpam:
-    def __init__(self, min_submit_delay: int = 10):
-        self.min_submit_delay = min_submit_delay
-
-    def generate_math_captcha(self) -> Tuple[int, int, int]:
-        """Génère un captcha mathématique simple"""
-        a = random.randint(1, 10)
-        b = random.randint(1, 10)
-        return a, b, a + b
-
-    def initialize_session(self):
-        """Initialise les variables de session pour l'anti-spam"""
-        if 'captcha' not in st.session_state:
-            a, b, answer = self.generate_math_captcha()
-            st.session_state.captcha = {
-                'a': a,
-                'b': b,
-                'answer': answer
-            }
-        if 'last_submit_time' not in st.session_state:
-            st.session_state.last_submit_time = 0
+    """Captcha signé sans état de session, honeypot et limite d'envois par adresse IP"""
 
-    def add_honeypot(self):
-        """Ajoute un champ honeypot caché"""
-        st.markdown("""
-            <div style="display:none">
-                <input type="text" name="website" id="website" tabindex="-1" autocomplete="off">
-            </div>
+    HONEYPOT_LABEL = "Site web"
+
+    def __init__(self):
+        self.session_id = get_session_id()
+        self.challenge = issue_challenge(self.session_id)
+
+    def add_honeypot(self) -> str:
+        """Ajoute un champ honeypot réel, masqué par CSS : seul un robot le remplit"""
+        st.markdown(f"""
+            <style>
+                div[data-testid="stTextInput"]:has(input[aria-label="{self.HONEYPOT_LABEL}"]) {{ display: none !important; }}
+            </style>
         """, unsafe_allow_html=True)
+        return st.text_input(self.HONEYPOT_LABEL, key="website", label_visibility="collapsed")
 
     def verify_submission(self, captcha_answer: str, honeypot: str = '') -> Tuple[bool, str]:
         """
         Vérifie si la soumission est légitime
         Retourne (is_valid, error_message)
         """
-        current_time = time.time()
-        
-        # Vérifier le délai minimum entre les soumissions
-        if current_time - st.session_state.last_submit_time < self.min_submit_delay:
-            return False, "Veuillez patienter quelques secondes avant de renvoyer un message."
-
         # Vérifier le honeypot
         if honeypot:
             return False, "Erreur de validation."
 
-        # Vérifier le captcha
-        try:
-            if int(captcha_answer) != st.session_state.captcha['answer']:
-                return False, "La réponse au calcul est incorrecte."
-        except ValueError:
-            return False, "Veuillez entrer un nombre valide pour le calcul."
+        # Limiter les tentatives par adresse (y compris les calculs erronés)
+        accepted, wait = get_submission_limiter().acquire(get_client_ip())
+        if not accepted:
+            return False, f"Veuillez patienter {wait} secondes avant de renvoyer un message."
 
-        # Mettre à jour le timestamp de dernière soumission
-        st.session_state.last_submit_time = current_time
-        return True, ""
+        # Vérifier le captcha
+        return verify_answer(self.session_id, captcha_answer)
 
 def display_contact_form():
     """
@@ -638,14 +746,7 @@ def display_contact_form():
     
     # Initialiser l'anti-spam
     anti_spam = AntiSpam()
-    anti_spam.initialize_session()
-    
-    # CSS pour cacher complètement le honeypot
-    st.markdown("""
-        <style>
-            #honeypot { display: none !important; }
-        </style>
-    """, unsafe_allow_html=True)
+    session = get_session()
 
     # Container pour le message de succès
     success_message = st.empty()
@@ -660,18 +761,13 @@ def display_contact_form():
             email = st.text_input("Email *")
             phone = st.text_input("Téléphone")
             # Captcha sur une ligne
-            st.text_input(f"{st.session_state.captcha['a']} + {st.session_state.captcha['b']} = ", 
+            st.text_input(anti_spam.challenge.label, 
                          key="captcha_input", 
                          label_visibility="visible",
                          max_chars=3)
             
-            # Honeypot vraiment invisible
-            st.markdown("""
-                <div id="honeypot" style="display:none;">
-                    <input type="text" name="website" value="">
-                </div>
-            """, unsafe_allow_html=True)
-            honeypot = st.session_state.get('website', '')
+            # Honeypot lié à un vrai widget, invisible pour l'utilisateur
+            honeypot = anti_spam.add_honeypot()
         
         with form_col2:
             message = st.text_area(
@@ -695,23 +791,33 @@ def display_contact_form():
             st.error("Veuillez entrer une adresse email valide")
             return
         
+        # Double clic ou renvoi du même message : accusé de réception sans nouvel envoi
+        existing = get_outbox(deliver_email).status(contact_key(name, email, phone, message)[:12])
+        if existing is not None:
+            session.last_contact = existing['reference']
+            display_contact_status(success_message, existing['reference'])
+            return
+
         # Vérifier l'anti-spam
         is_valid, error_message = anti_spam.verify_submission(captcha_answer, honeypot)
         if not is_valid:
             st.error(error_message)
             return
             
-        # Envoyer le message
-        with st.spinner("Envoi de votre message..."):
-            success = send_contact_email(name, email, phone, message)
+        # Déposer le message : acquitté immédiatement, livré en arrière-plan
+        reference = send_contact_email(name, email, phone, message)
             
-        if success:
-            success_message.success("✅ Message envoyé")
+        if reference:
+            session.last_contact = reference
+            display_contact_status(success_message, reference)
         else:
             st.error("""
             ❌ Une erreur est survenue lors de l'envoi du message. 
             Veuillez réessayer ou nous contacter directement par téléphone.
             """)
+    elif session.last_contact:
+        # Reruns : état de livraison à jour du dernier message envoyé
+        display_contact_status(success_message, session.last_contact)
 
 def get_dynamic_client_type_fields():
     """
@@ -763,25 +869,282 @@ def get_dynamic_client_type_fields():
     
     return client_info
 
-def main():
-    apply_custom_css()
+def display_trace_waterfall(spans: list):
+    """
+    Affiche la cascade des étapes d'une trace (mode DEBUG)
+    """
+    if not spans:
+        return
+    trace_start = min(span.start_ns for span in spans)
+    trace_end = max(span.end_ns or span.start_ns for span in spans)
+    total = max(trace_end - trace_start, 1)
+
+    rows = []
+    for span in sorted(spans, key=lambda span: span.start_ns):
+        offset = (span.start_ns - trace_start) / total * 100
+        width = max((span.end_ns or trace_end) - span.start_ns, 0) / total * 100
+        color = "#3c7be7" if span.status == 'OK' else "#c0392b"
+        attributes = ", ".join(f"{key}={value}" for key, value in span.attributes.items())
+        rows.append(f"""
+            <div style="display: flex; align-items: center; font-size: 0.8em; margin: 2px 0;">
+                <div style="width: 30%; overflow: hidden; white-space: nowrap;" title="{attributes}">{span.name} — {span.duration_ms:.0f} ms</div>
+                <div style="width: 70%; background: #f0f2f6; position: relative; height: 12px;">
+                    <div style="position: absolute; left: {offset:.2f}%; width: {max(width, 0.5):.2f}%; height: 100%; background: {color};"></div>
+                </div>
+            </div>
+        """)
+
+    with st.expander("Debug - Trace de la requête", expanded=False):
+        st.markdown("".join(rows), unsafe_allow_html=True)
+        for span in spans:
+            st.caption(f"{span.name} : {span.attributes}")
+
+def estimate_key(question: str, client_info: Dict[str, Any], urgency: str) -> str:
+    """Empreinte des entrées d'une estimation et de la version du catalogue"""
+    payload = json.dumps([normalize(question).canonical, client_info, urgency, catalog.fingerprint], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def run_estimation(question: str, client_info: Dict[str, Any], urgency: str,
+                   on_estimate: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Enchaîne analyse et calcul de l'estimation pour une question, puis l'affiche
+
+    `on_estimate` reçoit l'estimation dès son calcul, avant l'attente de l'analyse
+    détaillée : un rerun qui interrompt cette attente retrouve le prix déjà affiché.
+
+    Returns:
+        dict: Résultat affiché (mémorisé pour les reruns), None en cas d'échec
+    """
+    progress_text, progress_bar = display_analysis_progress()
+        
+    client_type_desc = f"{client_info['type_principal']}"
+    if client_info['type_principal'] == "Professionnel":
+        client_type_desc += f" - {client_info['sous_type']}"
+        if 'taille' in client_info:
+            client_type_desc += f" ({client_info['taille']})"
+        if 'secteur' in client_info:
+            client_type_desc += f" - Secteur {client_info['secteur']}"
+    
+    result, timeout = execute_with_timeout(
+        analyze_question,
+        question,
+        client_type_desc,
+        urgency,
+        timeout_seconds=30
+    )
+    
+    if timeout:
+        progress_text.empty()
+        progress_bar.empty()
+        st.error("Désolé, l'analyse a pris trop de temps. Veuillez réessayer ou nous contacter directement.")
+        return None
 
-    # Gestion du keepalive en premier pour éviter l'affichage inutile de l'interface
+    domaine, prestation, confidence, is_relevant, candidates, agreement, tier = result
+    
+    if not domaine or not prestation:
+        progress_text.empty()
+        progress_bar.empty()
+        st.error("Désolé, nous n'avons pas pu analyser votre demande. Veuillez réessayer avec plus de détails.")
+        return None
+
+    # L'indice auto-déclaré par le modèle est recalibré avec la proximité locale
+    # question / définition de la prestation et l'accord entre échantillons
+    llm_confidence = confidence
+    retrieval_score = catalog.retrieval_index.score(question, domaine, prestation)
+    confidence = get_calibrator().calibrate(llm_confidence, retrieval_score, agreement)
+    set_span_attributes(llm_confidence=llm_confidence, retrieval_score=round(retrieval_score, 3),
+                        confidence=confidence)
+
+    forfait, _, calcul_details, tarifs_utilises, domaine_label, prestation_label = calculate_estimate(
+        domaine, prestation, urgency
+    )
+
+    # Explication immédiate par gabarit ; l'analyse du modèle (mode llm ou enrichissement)
+    # est rédigée en arrière-plan et conservée par question : un rerun ne la régénère pas
+    template_explanation = None
+    if explanations.EXPLANATION_MODE == 'template':
+        template_explanation = explanations.get_explanations(catalog).render(domaine, prestation, client_info, urgency)
+    use_llm_analysis = template_explanation is None or explanations.EXPLANATION_ENRICH
+    analysis_key = (catalog.fingerprint, question, client_type_desc, urgency, domaine, prestation)
+    if forfait is not None and use_llm_analysis:
+        get_prefetcher().prefetch(
+            analysis_key, get_detailed_analysis, question, client_type_desc, urgency, domaine, prestation
+        )
+
+    if forfait is not None:
+        estimation = {
+            'forfait': forfait,
+            'domaine': domaine_label,
+            'prestation': prestation_label,
+            'code_domaine': domaine,
+            'code_prestation': prestation,
+            'llm_confidence': llm_confidence,
+            'retrieval_score': retrieval_score,
+            'agreement': agreement,
+            'confidence': confidence,
+            'route': tier
+        }
+        log_question(question, client_type_desc, urgency, estimation)
+    else:
+        log_question(question, client_type_desc, urgency)
+
+    progress_text.empty()
+    progress_bar.empty()
+    if forfait is None:
+        st.error("Désolé, nous n'avons pas pu analyser votre demande. Réessayez en formulant votre question autrement ou contactez-nous directement pour obtenir une estimation précise.")
+        return None
+
+    estimate = {
+        'forfait': forfait,
+        'domaine': domaine,
+        'prestation': prestation,
+        'domaine_label': domaine_label,
+        'prestation_label': prestation_label,
+        'devis': compose_quote(candidates, price_tables, urgency),
+        'confidence': confidence,
+        'is_relevant': is_relevant,
+        'template_explanation': template_explanation,
+        'analysis_key': analysis_key if use_llm_analysis else None,
+        'detailed_analysis': None if use_llm_analysis else template_explanation[0],
+        'sources': None if use_llm_analysis else template_explanation[2],
+    }
+    if on_estimate is not None:
+        on_estimate(estimate)
+    render_estimation(estimate)
+    return estimate
+
+def render_estimation(estimate: Dict[str, Any]):
+    """
+    Affiche une estimation ; l'analyse détaillée encore en cours remplit son emplacement
+    une fois prête et est ajoutée au résultat (les reruns l'affichent sans attente)
+    """
+    template_explanation = estimate['template_explanation']
+    pending_analysis = estimate['analysis_key'] is not None and estimate['detailed_analysis'] is None
+    confidence = estimate['confidence']
+    devis = estimate['devis']
+
+    with st.container():
+        analysis_slot = st.empty()
+        if template_explanation is None:
+            if pending_analysis:
+                analysis_slot.info("📋 Analyse de votre situation : rédaction en cours...")
+            else:
+                analysis_slot.info(f"""
+                📋 Analyse de votre situation :
+                
+                {estimate['detailed_analysis']}
+               
+                """)
+        else:
+            # Gabarit sur plusieurs paragraphes : pas d'indentation (interprétée en bloc de code)
+            analysis_slot.info(f"📋 Analyse de votre situation :\n\n{template_explanation[0]}")
+            enrichment_slot = st.empty()
+            if pending_analysis:
+                enrichment_slot.caption("Analyse personnalisée en cours de rédaction...")
+            elif estimate['analysis_key'] is not None:
+                enrichment_slot.info(f"🔎 Analyse personnalisée :\n\n{estimate['detailed_analysis']}")
+
+        st.markdown(f"""
+        <div style="background-color: #f0f2f6; padding: 15px; border-radius: 10px; text-align: center; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
+            <h3 style="color: #1f618d; margin: 0;">Estimation de la prestation</h3>
+            <p style="font-size: 22px; font-weight: bold; color: #417068; margin: 10px 0;">
+                <span style="color: #3c7be7;">{estimate['forfait']} €HT</span>
+            </p>
+            <small style="color: #666;">Pour {estimate['domaine_label'].lower()} • {estimate['prestation_label']}</small>
+        </div>
+        """, unsafe_allow_html=True)
+
+        if len(devis['lignes']) > 1:
+            lignes_html = "".join(
+                f"<li>{ligne['label']} : {ligne['tarif']} €HT ({ligne['probabilite']:.0%})</li>"
+                for ligne in devis['lignes']
+            )
+            st.markdown(f"""
+            <div style="background-color: #f7f9fc; padding: 10px; border-radius: 10px; margin-top: 10px;">
+                <p style="margin: 0; color: #1f618d;"><strong>Si votre dossier nécessite plusieurs prestations</strong></p>
+                <p style="margin: 5px 0; color: #555;">
+                    Fourchette : {devis['minimum']} € à {devis['maximum']} €HT • Scénario le plus probable : {devis['probable']} €HT • Coût attendu : {devis['attendu']} €HT
+                </p>
+                <ul style="margin: 0; color: #666;">{lignes_html}</ul>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        st.markdown("""
+        <div style="background-color: #fafafa; padding: 10px; border-left: 4px solid #3c7be7; border-radius: 4px;">
+            <p style="margin: 0; color: #555;">
+                📌 <strong>Note importante :</strong> Cette estimation est fournie hors taxes et à titre indicatif. Elle peut varier en fonction de la complexité de votre situation. 
+            </p>
+            <p style="margin: 5px 0 0 0; color: #666;">
+                Nous vous invitons à nous contacter pour une évaluation personnalisée qui prendra en compte tous les détails de votre cas. Si vous êtes un particulier, il est possible de payer en plusieurs fois.
+            </p>
+        </div>
+        """, unsafe_allow_html=True)
+        st.markdown("---")
+
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            st.subheader("Indice de confiance")
+            st.progress(confidence)
+            st.write(f"Confiance : {confidence:.2%}")
+        with col2:
+            if confidence < 0.5:
+                st.warning("⚠️ Attention : Notre IA a eu des difficultés à analyser votre question avec certitude. L'estimation ci-dessus peut manquer de précision.")
+            elif not estimate['is_relevant']:
+                st.info("Nous ne sommes pas sûr qu'il s'agisse d'une question d'ordre juridique. L'estimation ci-dessus est fournie à titre indicatif.")
+
+        st.markdown("### 💡 Recommandations")
+        st.success("""
+        **Consultation initiale recommandée** - Si vous souhaitez uniquement bénéficier d'une consultation pour connaître vos droits, 
+        nous vous recommandons de prendre rendez-vous pour une consultation initiale d'un montant de 200€HT. Cette première analyse de votre situation nous permettra de :
+        - Évaluer précisément la complexité de votre situation
+        - Vous fournir des conseils juridiques adaptés
+        - Élaborer une stratégie sur mesure pour votre situation
+        """)
+
+        st.markdown("---")
+
+        sources_slot = st.empty()
+
+        if pending_analysis:
+            analysis = wait_detailed_analysis(estimate['analysis_key'])
+            if analysis is None:
+                # Échec non mémorisé : le prochain rerun relance l'analyse
+                detailed_analysis = "Une erreur s'est produite lors de l'analyse."
+            else:
+                detailed_analysis, _, estimate['sources'] = analysis
+                estimate['detailed_analysis'] = detailed_analysis
+            if template_explanation is None:
+                analysis_slot.info(f"""
+                📋 Analyse de votre situation :
+                
+                {detailed_analysis}
+               
+                """)
+            else:
+                enrichment_slot.info(f"🔎 Analyse personnalisée :\n\n{detailed_analysis}")
+        sources = estimate['sources']
+        if sources and sources != explanations.NO_SOURCES:
+            with sources_slot.container():
+                with st.expander("Sources juridiques"):
+                    st.write(sources)
+
+
+def main():
+    # Gestion du keepalive en premier : ni CSS, ni client OpenAI, ni SMTP
     if "keepalive" in st.experimental_get_query_params():
         handle_keepalive_endpoint()
         return
 
-    st.title("🏛️ Estim'IA by View Avocats\nObtenez une première estimation du prix de nos services en quelques secondes grâce à l'IA")
+    apply_custom_css()
 
-    # Initialisation du KeepAliveManager si pas déjà fait
-    if 'keep_alive_manager' not in st.session_state:
-        st.session_state.keep_alive_manager = KeepAliveManager()
+    st.title("🏛️ Estim'IA by View Avocats\nObtenez une première estimation du prix de nos services en quelques secondes grâce à l'IA")
 
     # Affichage du dernier keepalive en mode debug si nécessaire
     if os.getenv('DEBUG', 'false').lower() == 'true':
+        keepalive_stats = health.stats.snapshot()
         with st.expander("Debug - Keepalive Info", expanded=False):
-            st.write(f"Dernier keepalive: {st.session_state.keep_alive_manager.last_keepalive}")
-            st.write(f"Nombre total de keepalives: {st.session_state.keep_alive_manager.keepalive_count}")
+            st.write(f"Dernier keepalive: {keepalive_stats['last_keepalive']}")
+            st.write(f"Nombre total de keepalives: {keepalive_stats['keepalive_count']}")
 
     client_info = get_dynamic_client_type_fields()
     urgency = st.selectbox("Degré d'urgence :", ("Normal", "Urgent"))
@@ -791,139 +1154,56 @@ def main():
     question = st.text_area(
         "Expliquez brièvement votre cas, notre intelligence artificielle s'occupe du reste !",
         height=80,
+        max_chars=PREFILTER_MAX_CHARS,
         placeholder=exemple_cas
     )
 
+    # Dernière estimation de la session : réaffichée telle quelle si les entrées n'ont pas changé
+    # (un rerun, par exemple une saisie dans le formulaire de contact, ne relance ni API ni limites)
+    session = get_session()
+    current_key = estimate_key(question, client_info, urgency)
+    last_estimate = session.last_estimate if session.last_estimate and session.last_estimate[0] == current_key else None
+
     if st.button("Obtenir une estimation grâce à l'intelligence artificielle"):
-        peut_continuer_global, requetes_restantes = check_global_limit()
-        if not peut_continuer_global:
-            st.error(f"""
-            ⚠️ Le nombre maximum de requêtes global a été atteint pour le moment.
-            Le système sera à nouveau disponible dans {requetes_restantes} minutes.
-            Pour une analyse urgente, vous pouvez nous contacter directement.
-            """)
+        if last_estimate is not None:
+            render_estimation(last_estimate[1])
         else:
-            peut_continuer, temps_attente = rate_limiter.check_limit(get_session_id())
-            if not peut_continuer:
-                st.warning(f"""
-                ⏳ Merci de patienter {temps_attente} minute{'s' if temps_attente > 1 else ''} avant de faire une nouvelle demande.
-                Pour une analyse urgente, vous pouvez nous contacter directement.
-                """)
-            elif question and question != exemple_cas:
-                progress_text, progress_bar = display_analysis_progress()
-                    
-                client_type_desc = f"{client_info['type_principal']}"
-                if client_info['type_principal'] == "Professionnel":
-                    client_type_desc += f" - {client_info['sous_type']}"
-                    if 'taille' in client_info:
-                        client_type_desc += f" ({client_info['taille']})"
-                    if 'secteur' in client_info:
-                        client_type_desc += f" - Secteur {client_info['secteur']}"
-                
-                result, timeout = execute_with_timeout(
-                    analyze_question,
-                    question,
-                    client_type_desc,
-                    urgency,
-                    timeout_seconds=30
-                )
-                
-                if timeout:
-                    progress_text.empty()
-                    progress_bar.empty()
-                    st.error("Désolé, l'analyse a pris trop de temps. Veuillez réessayer ou nous contacter directement.")
+            set_request_id()
+            # Filtre local avant toute limite : une saisie refusée ne consomme ni quota ni appel API
+            submission = f"{get_client_ip()}:{current_key}"
+            verdict = prefilter_question(question, get_catalog_manager().current(), placeholder=exemple_cas,
+                                         submission=submission)
+            if not verdict.accepted:
+                logger.info(f"Question refusée par le filtre local : {verdict.reason}")
+                st.warning(verdict.message)
+            else:
+                peut_continuer_global, requetes_restantes = check_global_limit()
+                if not peut_continuer_global:
+                    st.error(f"""
+                    ⚠️ Le nombre maximum de requêtes global a été atteint pour le moment.
+                    Le système sera à nouveau disponible dans {requetes_restantes} minutes.
+                    Pour une analyse urgente, vous pouvez nous contacter directement.
+                    """)
                 else:
-                    domaine, prestation, confidence, is_relevant = result
-                    
-                    if not domaine or not prestation:
-                        progress_text.empty()
-                        progress_bar.empty()
-                        st.error("Désolé, nous n'avons pas pu analyser votre demande. Veuillez réessayer avec plus de détails.")
+                    peut_continuer, temps_attente = rate_limiter.check_limit(session)
+                    if not peut_continuer:
+                        st.warning(f"""
+                        ⏳ Merci de patienter {temps_attente} minute{'s' if temps_attente > 1 else ''} avant de faire une nouvelle demande.
+                        Pour une analyse urgente, vous pouvez nous contacter directement.
+                        """)
                     else:
-                        detailed_analysis, elements_used, sources = get_detailed_analysis(
-                            question, client_type_desc, urgency, domaine, prestation
-                        )
-
-                        forfait, _, calcul_details, tarifs_utilises, domaine_label, prestation_label = calculate_estimate(
-                            domaine, prestation, urgency
-                        )
-
-                        if forfait is not None:
-                            estimation = {
-                                'forfait': forfait,
-                                'domaine': domaine_label,
-                                'prestation': prestation_label
-                            }
-                            log_question(question, client_type_desc, urgency, estimation)
-                        else:
-                            log_question(question, client_type_desc, urgency)
-
-                        if forfait is None:
-                            progress_text.empty()
-                            progress_bar.empty()
-                            st.error("Désolé, nous n'avons pas pu analyser votre demande. Réessayez en formulant votre question autrement ou contactez-nous directement pour obtenir une estimation précise.")
-                        else:
-                            with st.container():
-                                progress_text.empty()
-                                progress_bar.empty()
-                                
-                                st.info(f"""
-                                📋 Analyse de votre situation :
-                                
-                                {detailed_analysis}
-                               
-                                """)
-
-                                st.markdown(f"""
-                                <div style="background-color: #f0f2f6; padding: 15px; border-radius: 10px; text-align: center; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-                                    <h3 style="color: #1f618d; margin: 0;">Estimation de la prestation</h3>
-                                    <p style="font-size: 22px; font-weight: bold; color: #417068; margin: 10px 0;">
-                                        <span style="color: #3c7be7;">{forfait} €HT</span>
-                                    </p>
-                                    <small style="color: #666;">Pour {domaine_label.lower()} • {prestation_label}</small>
-                                </div>
-                                """, unsafe_allow_html=True)
-                                
-                                st.markdown("""
-                                <div style="background-color: #fafafa; padding: 10px; border-left: 4px solid #3c7be7; border-radius: 4px;">
-                                    <p style="margin: 0; color: #555;">
-                                        📌 <strong>Note importante :</strong> Cette estimation est fournie hors taxes et à titre indicatif. Elle peut varier en fonction de la complexité de votre situation. 
-                                    </p>
-                                    <p style="margin: 5px 0 0 0; color: #666;">
-                                        Nous vous invitons à nous contacter pour une évaluation personnalisée qui prendra en compte tous les détails de votre cas. Si vous êtes un particulier, il est possible de payer en plusieurs fois.
-                                    </p>
-                                </div>
-                                """, unsafe_allow_html=True)
-                                st.markdown("---")
-
-                                col1, col2 = st.columns([1, 2])
-                                with col1:
-                                    st.subheader("Indice de confiance")
-                                    st.progress(confidence)
-                                    st.write(f"Confiance : {confidence:.2%}")
-                                with col2:
-                                    if confidence < 0.5:
-                                        st.warning("⚠️ Attention : Notre IA a eu des difficultés à analyser votre question avec certitude. L'estimation ci-dessus peut manquer de précision.")
-                                    elif not is_relevant:
-                                        st.info("Nous ne sommes pas sûr qu'il s'agisse d'une question d'ordre juridique. L'estimation ci-dessus est fournie à titre indicatif.")
-
-                                st.markdown("### 💡 Recommandations")
-                                st.success("""
-                                **Consultation initiale recommandée** - Si vous souhaitez uniquement bénéficier d'une consultation pour connaître vos droits, 
-                                nous vous recommandons de prendre rendez-vous pour une consultation initiale d'un montant de 200€HT. Cette première analyse de votre situation nous permettra de :
-                                - Évaluer précisément la complexité de votre situation
-                                - Vous fournir des conseils juridiques adaptés
-                                - Élaborer une stratégie sur mesure pour votre situation
-                                """)
-
-                                st.markdown("---")
-
-                                if sources and sources != "Aucune source spécifique mentionnée.":
-                                    with st.expander("Sources juridiques"):
-                                        st.write(sources)
-
-            else:
-                st.warning("Veuillez décrire votre cas avant de demander une estimation. N'utilisez pas l'exemple fourni tel quel.")
+                        def remember_estimate(estimate: Dict[str, Any]):
+                            # L'analyse détaillée complète ensuite ce même dictionnaire
+                            session.last_estimate = (current_key, estimate)
+                            record_submission(submission)
+
+                        with tracer.span('estimation', urgency=urgency) as root_span:
+                            run_estimation(question, client_info, urgency, on_estimate=remember_estimate)
+
+                        if os.getenv('DEBUG', 'false').lower() == 'true':
+                            display_trace_waterfall(tracer.get_trace(root_span.trace_id))
+    elif last_estimate is not None:
+        render_estimation(last_estimate[1])
     
     st.markdown("---")
     display_contact_form()
@@ -935,9 +1215,9 @@ def main():
     """
     
     if os.getenv('DEBUG', 'false').lower() == 'true':
-        last_keepalive = getattr(st.session_state.get('keep_alive_manager', None), 'last_keepalive', None)
+        last_keepalive = health.stats.last_keepalive
         if last_keepalive:
-            footer_content += f"<br>Dernier keepalive: {last_keepalive.strftime('%Y-%m-%d %H:%M:%S')}"
+            footer_content += f"<br>Dernier keepalive: {datetime.fromtimestamp(last_keepalive).strftime('%Y-%m-%d %H:%M:%S')}"
     
     footer_content += "</div>"
     st.markdown(footer_content, unsafe_allow_html=True)
@@ -0,0 +1,312 @@
+"""
+Calibration de l'indice de confiance.
+
+L'indice_confiance renvoyé par le modèle n'est pas une probabilité : il est
+combiné ici à deux signaux locaux pour estimer la probabilité que la prestation
+proposée soit la bonne :
+
+    - llm_confidence  : indice auto-déclaré par le modèle ;
+    - retrieval_score : similarité TF-IDF entre la question et la définition
+                        de la prestation retenue (retrieval.DefinitionIndex) ;
+    - agreement       : part des échantillons du modèle d'accord sur la prestation.
+
+Le modèle (régression logistique à la Platt sur ces trois signaux, suivie en
+option d'une régression isotonique) est ajusté hors ligne à partir des
+estimations de l'historique dont l'issue a été renseignée (colonne `correct`).
+Il est ensuite tabulé sur une grille : à l'exécution, la calibration se réduit
+à une lecture de table, sans numpy.
+
+Sans fichier de calibration, l'indice du modèle est utilisé tel quel, plafonné
+par l'accord entre échantillons.
+
+Usage :
+    python calibration.py fit                        # depuis l'historique SQLite
+    python calibration.py fit --input issues.jsonl   # ou un export JSONL
+    python calibration.py fit --method isotonic
+    python calibration.py report                     # fiabilité avant / après
+    python history_store.py --label REQUEST_ID 1     # renseigne une issue
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_FILE = os.getenv('CALIBRATION_FILE', 'calibration.json')
+CALIBRATION_FORMAT = 1
+FEATURES = ('llm_confidence', 'retrieval_score', 'agreement')
+# Pas de la grille par signal : 21 x 21 x 11 cellules
+GRID = {'llm_confidence': 20, 'retrieval_score': 20, 'agreement': 10}
+MIN_SAMPLES = 50
+_EPSILON = 1e-4
+
+
+def _clip(value: float) -> float:
+    return min(max(float(value), 0.0), 1.0)
+
+
+def _design(samples: Sequence[Dict[str, Any]]):
+    """Matrice des signaux : logit de la confiance, similarité, accord, biais"""
+    import numpy as np
+    conf = np.clip([s['llm_confidence'] for s in samples], _EPSILON, 1 - _EPSILON)
+    return np.column_stack([
+        np.log(conf / (1 - conf)),
+        [s['retrieval_score'] for s in samples],
+        [s['agreement'] for s in samples],
+        np.ones(len(samples)),
+    ])
+
+
+def fit_platt(samples: Sequence[Dict[str, Any]], iterations: int = 50, l2: float = 1e-2) -> List[float]:
+    """
+    Régression logistique par Newton-Raphson (légère régularisation L2)
+
+    Returns:
+        Coefficients (logit de la confiance, similarité, accord, biais)
+    """
+    import numpy as np
+    X = _design(samples)
+    y = np.array([float(s['correct']) for s in samples])
+    weights = np.zeros(X.shape[1])
+    penalty = l2 * np.eye(X.shape[1])
+    penalty[-1, -1] = 0.0
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-X @ weights))
+        gradient = X.T @ (p - y) + penalty @ weights
+        hessian = (X * (p * (1 - p))[:, None]).T @ X + penalty
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.max(np.abs(step)) < 1e-8:
+            break
+    return [float(w) for w in weights]
+
+
+def fit_isotonic(scores: Sequence[float], outcomes: Sequence[float]) -> Tuple[List[float], List[float]]:
+    """
+    Régression isotonique (pool adjacent violators)
+
+    Returns:
+        (seuils croissants, probabilité calibrée de chaque palier)
+    """
+    order = sorted(range(len(scores)), key=lambda i: scores[i])
+    blocks: List[List[float]] = []  # [somme des issues, effectif, score max]
+    for i in order:
+        blocks.append([float(outcomes[i]), 1.0, float(scores[i])])
+        while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] >= blocks[-1][0] / blocks[-1][1]:
+            total, count, high = blocks.pop()
+            blocks[-1][0] += total
+            blocks[-1][1] += count
+            blocks[-1][2] = high
+    return [block[2] for block in blocks], [block[0] / block[1] for block in blocks]
+
+
+def _isotonic_value(thresholds: List[float], values: List[float], score: float) -> float:
+    for threshold, value in zip(thresholds, values):
+        if score <= threshold:
+            return value
+    return values[-1]
+
+
+def build_table(weights: List[float], isotonic: Optional[Tuple[List[float], List[float]]] = None) -> List[float]:
+    """Tabule le modèle sur la grille (ordre confiance, similarité, accord)"""
+    import numpy as np
+    axes = [np.linspace(0.0, 1.0, GRID[name] + 1) for name in FEATURES]
+    conf, retrieval, agreement = np.meshgrid(*axes, indexing='ij')
+    grid_samples = [
+        {'llm_confidence': c, 'retrieval_score': r, 'agreement': a}
+        for c, r, a in zip(conf.ravel(), retrieval.ravel(), agreement.ravel())
+    ]
+    probabilities = 1.0 / (1.0 + np.exp(-_design(grid_samples) @ np.array(weights)))
+    if isotonic:
+        probabilities = [_isotonic_value(*isotonic, float(p)) for p in probabilities]
+    return [round(float(p), 4) for p in probabilities]
+
+
+class Calibrator:
+    """Table de calibration : lecture en temps constant"""
+
+    def __init__(self, table: Optional[List[float]] = None, meta: Optional[Dict[str, Any]] = None):
+        self.table = table
+        self.meta = meta or {}
+        self._strides = (
+            (GRID['retrieval_score'] + 1) * (GRID['agreement'] + 1),
+            GRID['agreement'] + 1,
+            1,
+        )
+
+    @property
+    def fitted(self) -> bool:
+        return self.table is not None
+
+    def calibrate(self, llm_confidence: float, retrieval_score: float = 0.0, agreement: float = 1.0) -> float:
+        """Probabilité calibrée que la prestation proposée soit la bonne"""
+        if self.table is None:
+            # Sans calibration ajustée, le désaccord entre échantillons plafonne l'indice
+            return min(_clip(llm_confidence), _clip(agreement))
+        index = 0
+        for name, value, stride in zip(FEATURES, (llm_confidence, retrieval_score, agreement), self._strides):
+            index += round(_clip(value) * GRID[name]) * stride
+        return self.table[index]
+
+    @classmethod
+    def load(cls, path: str = CALIBRATION_FILE) -> 'Calibrator':
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError) as e:
+            logger.error(f"Fichier de calibration illisible ({path}) : {e}")
+            return cls()
+        expected = math.prod(GRID[name] + 1 for name in FEATURES)
+        if data.get('format') != CALIBRATION_FORMAT or data.get('grid') != GRID or len(data.get('table', [])) != expected:
+            logger.error(f"Fichier de calibration incompatible ({path}), indice du modèle utilisé tel quel")
+            return cls()
+        return cls(data['table'], {key: value for key, value in data.items() if key != 'table'})
+
+
+def save_calibration(path: str, table: List[float], meta: Dict[str, Any]):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'format': CALIBRATION_FORMAT, 'grid': GRID, **meta, 'table': table}, f)
+    os.replace(tmp_path, path)
+
+
+_calibrator = Calibrator()
+_calibrator_mtime: Optional[float] = None
+_calibrator_lock = threading.Lock()
+
+
+def get_calibrator(path: str = CALIBRATION_FILE) -> Calibrator:
+    """Calibrateur du processus, rechargé quand le fichier est remplacé"""
+    global _calibrator, _calibrator_mtime
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _calibrator_mtime:
+        with _calibrator_lock:
+            if mtime != _calibrator_mtime:
+                _calibrator = Calibrator.load(path)
+                _calibrator_mtime = mtime
+                if _calibrator.fitted:
+                    logger.info(f"Calibration chargée ({_calibrator.meta.get('samples')} issues, {_calibrator.meta.get('method')})")
+    return _calibrator
+
+
+def load_samples(input_path: Optional[str] = None, db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Issues renseignées, depuis un fichier JSONL ou l'historique"""
+    if input_path:
+        with open(input_path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        from history_store import HISTORY_DB, connect
+        conn = connect(db_path or HISTORY_DB)
+        try:
+            cursor = conn.execute(
+                "SELECT llm_confidence, retrieval_score, agreement, correct FROM estimates "
+                "WHERE correct IS NOT NULL AND llm_confidence IS NOT NULL"
+            )
+            rows = [dict(zip(('llm_confidence', 'retrieval_score', 'agreement', 'correct'), row)) for row in cursor]
+        finally:
+            conn.close()
+    samples = []
+    for row in rows:
+        if row.get('correct') is None or row.get('llm_confidence') is None:
+            continue
+        samples.append({
+            'llm_confidence': _clip(row['llm_confidence']),
+            'retrieval_score': _clip(row.get('retrieval_score') or 0.0),
+            'agreement': _clip(row['agreement'] if row.get('agreement') is not None else 1.0),
+            'correct': 1.0 if row['correct'] else 0.0,
+        })
+    return samples
+
+
+def fit(samples: List[Dict[str, Any]], method: str = 'platt') -> Tuple[List[float], Dict[str, Any]]:
+    """Ajuste le modèle et le tabule"""
+    weights = fit_platt(samples)
+    isotonic = None
+    if method == 'isotonic':
+        import numpy as np
+        scores = 1.0 / (1.0 + np.exp(-_design(samples) @ np.array(weights)))
+        isotonic = fit_isotonic(scores.tolist(), [s['correct'] for s in samples])
+    meta = {
+        'method': method,
+        'samples': len(samples),
+        'weights': dict(zip(FEATURES + ('bias',), weights)),
+        'fitted_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return build_table(weights, isotonic), meta
+
+
+def reliability(samples: List[Dict[str, Any]], predict, bins: int = 10) -> Tuple[float, float, List[Tuple[float, float, int]]]:
+    """
+    Erreur de calibration attendue (ECE), score de Brier et diagramme de fiabilité
+
+    Returns:
+        (ece, brier, liste de (confiance moyenne, taux de réussite, effectif) par tranche)
+    """
+    buckets: List[List[Tuple[float, float]]] = [[] for _ in range(bins)]
+    brier = 0.0
+    for sample in samples:
+        p = predict(sample)
+        brier += (p - sample['correct']) ** 2
+        buckets[min(int(p * bins), bins - 1)].append((p, sample['correct']))
+    diagram, ece = [], 0.0
+    for bucket in buckets:
+        if not bucket:
+            continue
+        mean_p = sum(p for p, _ in bucket) / len(bucket)
+        rate = sum(y for _, y in bucket) / len(bucket)
+        ece += len(bucket) / len(samples) * abs(mean_p - rate)
+        diagram.append((mean_p, rate, len(bucket)))
+    return ece, brier / len(samples), diagram
+
+
+def _print_report(samples: List[Dict[str, Any]], calibrator: Calibrator):
+    for label, predict in (
+        ("Indice du modèle", lambda s: s['llm_confidence']),
+        ("Indice calibré", lambda s: calibrator.calibrate(s['llm_confidence'], s['retrieval_score'], s['agreement'])),
+    ):
+        ece, brier, diagram = reliability(samples, predict)
+        print(f"{label} : ECE {ece:.3f}, Brier {brier:.3f}")
+        for mean_p, rate, count in diagram:
+            print(f"    confiance {mean_p:.2f}  réussite {rate:.2f}  ({count})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibration de l'indice de confiance")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('fit', "Ajuste et enregistre la table de calibration"),
+                            ('report', "Diagramme de fiabilité avant / après calibration")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('--input', help="Fichier JSONL d'issues (par défaut : historique SQLite)")
+        sub.add_argument('--db', help="Base d'historique")
+        sub.add_argument('--output', default=CALIBRATION_FILE)
+        if name == 'fit':
+            sub.add_argument('--method', choices=('platt', 'isotonic'), default='platt')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    samples = load_samples(args.input, args.db)
+    if args.command == 'fit':
+        if len(samples) < MIN_SAMPLES:
+            print(f"{len(samples)} issues renseignées, au moins {MIN_SAMPLES} sont nécessaires")
+            sys.exit(1)
+        table, meta = fit(samples, args.method)
+        save_calibration(args.output, table, meta)
+        print(f"Calibration {args.method} ajustée sur {len(samples)} issues -> {args.output}")
+        print("Coefficients : " + ", ".join(f"{name} {value:+.3f}" for name, value in meta['weights'].items()))
+        _print_report(samples, Calibrator(table))
+    else:
+        if not samples:
+            print("Aucune issue renseignée")
+            sys.exit(1)
+        _print_report(samples, Calibrator.load(args.output))
@@ -0,0 +1,204 @@
+"""
+Gestion du catalogue avec rechargement à chaud.
+
+Un thread surveille les sources (prestations.py, chatbot-instructions.py) par
+scrutation de leur mtime. À chaque modification, le catalogue est recompilé en
+arrière-plan, validé (clés uniques, tarifs positifs, libellés et définitions
+non vides) puis publié atomiquement sous un nouveau numéro de version. Une
+source invalide est ignorée : la version en cours reste servie.
+
+Les caches dépendant du catalogue s'abonnent via on_swap() et sont invalidés
+lors de la publication d'une nouvelle empreinte.
+"""
+import ast
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import catalog_snapshot
+from devis import PriceTables, build_price_tables
+from retrieval import DefinitionIndex
+
+logger = logging.getLogger(__name__)
+
+CATALOG_POLL_INTERVAL = float(os.getenv('CATALOG_POLL_INTERVAL', '2'))
+
+
+class CatalogValidationError(ValueError):
+    """Catalogue refusé par la validation"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__(f"{len(errors)} erreur(s) dans le catalogue : " + "; ".join(errors[:5]))
+        self.errors = errors
+
+
+class CatalogVersion:
+    """Version immuable du catalogue et de ses index dérivés"""
+    __slots__ = ('version', 'fingerprint', 'prestations', 'instructions', 'facteur_urgence', 'price_tables',
+                 'retrieval_index', 'loaded_at')
+
+    def __init__(self, version: int, data: Dict[str, Any]):
+        self.version = version
+        self.fingerprint: str = data['fingerprint']
+        self.prestations: Dict[str, Any] = data['prestations']
+        self.instructions: str = data['instructions']
+        self.facteur_urgence: float = data.get('facteur_urgence', 1.5)
+        self.price_tables: PriceTables = build_price_tables(self.prestations)
+        self.retrieval_index = DefinitionIndex(self.prestations)
+        self.loaded_at = time.time()
+
+
+def find_duplicate_keys(source_path: str) -> List[str]:
+    """
+    Détecte les clés dupliquées dans les littéraux de dictionnaire d'une source
+
+    Python écrase silencieusement une clé répétée : seule l'analyse de la
+    source permet de repérer une prestation masquée par une autre.
+    """
+    with open(source_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), source_path)
+    errors = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Dict):
+            continue
+        seen = set()
+        for key in node.keys:
+            if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                if key.value in seen:
+                    errors.append(f"Clé dupliquée '{key.value}' (ligne {key.lineno})")
+                seen.add(key.value)
+    return errors
+
+
+def validate_catalog(prestations: Dict[str, Any], source_path: Optional[str] = None) -> List[str]:
+    """
+    Valide la structure du catalogue
+
+    Returns:
+        Liste des erreurs (vide si le catalogue est valide)
+    """
+    errors = find_duplicate_keys(source_path) if source_path else []
+    if not prestations:
+        errors.append("Catalogue vide")
+    for domaine, domaine_info in prestations.items():
+        if not isinstance(domaine_info, dict) or not str(domaine_info.get('label', '')).strip():
+            errors.append(f"Domaine '{domaine}' sans label")
+            continue
+        prestations_domaine = domaine_info.get('prestations')
+        if not prestations_domaine:
+            errors.append(f"Domaine '{domaine}' sans prestation")
+            continue
+        for key, info in prestations_domaine.items():
+            tarif = info.get('tarif')
+            if isinstance(tarif, bool) or not isinstance(tarif, (int, float)) or tarif <= 0:
+                errors.append(f"Tarif invalide pour '{domaine}.{key}' : {tarif!r}")
+            for field in ('label', 'definition'):
+                if not str(info.get(field, '')).strip():
+                    errors.append(f"Champ '{field}' vide pour '{domaine}.{key}'")
+    return errors
+
+
+class CatalogManager:
+    """Sert la version courante du catalogue et la remplace à chaud"""
+
+    def __init__(self, poll_interval: float = CATALOG_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._listeners: Dict[str, Callable[[CatalogVersion, CatalogVersion], None]] = {}
+        self._stamp = catalog_snapshot._source_stamp()
+        self._current = CatalogVersion(1, self._initial_data())
+        self._watcher: Optional[threading.Thread] = None
+
+    def _initial_data(self) -> Dict[str, Any]:
+        data = catalog_snapshot.read_snapshot()
+        if data is not None:
+            return data
+        try:
+            return self._compile_validated()
+        except CatalogValidationError as e:
+            logger.error(f"Catalogue invalide au démarrage : {e}")
+            # Mieux vaut le dernier instantané connu, à défaut les sources telles quelles
+            return (catalog_snapshot.read_snapshot(check_sources=False)
+                    or catalog_snapshot.load_catalog())
+
+    @staticmethod
+    def _compile_validated() -> Dict[str, Any]:
+        data = catalog_snapshot.compile_sources()
+        if data is None:
+            raise CatalogValidationError(["Source du catalogue non exécutable"])
+        errors = validate_catalog(data['prestations'], catalog_snapshot.SOURCES['prestations'])
+        if not str(data['instructions']).strip():
+            errors.append("Consignes du chatbot vides")
+        if errors:
+            raise CatalogValidationError(errors)
+        return catalog_snapshot.write_snapshot(data)
+
+    def current(self) -> CatalogVersion:
+        """Version courante (simple lecture de référence, sans verrou)"""
+        return self._current
+
+    def on_swap(self, name: str, callback: Callable[[CatalogVersion, CatalogVersion], None]):
+        """Abonne un cache à l'invalidation (remplace un abonnement de même nom)"""
+        with self._lock:
+            self._listeners[name] = callback
+
+    def reload(self) -> bool:
+        """
+        Recompile, valide et publie le catalogue si son contenu a changé
+
+        Returns:
+            bool: True si une nouvelle version a été publiée
+        """
+        try:
+            data = self._compile_validated()
+        except CatalogValidationError as e:
+            logger.error(f"Rechargement du catalogue refusé, version {self._current.version} conservée : {e}")
+            return False
+
+        with self._lock:
+            old = self._current
+            if data['fingerprint'] == old.fingerprint:
+                return False
+            new = CatalogVersion(old.version + 1, data)
+            self._current = new
+            listeners = list(self._listeners.items())
+
+        logger.info(f"Catalogue v{new.version} publié (empreinte {new.fingerprint[:12]})")
+        for name, callback in listeners:
+            try:
+                callback(old, new)
+            except Exception as e:
+                logger.error(f"Invalidation '{name}' en échec : {e}")
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            stamp = catalog_snapshot._source_stamp()
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self.reload()
+
+    def start(self):
+        """Lance la surveillance des sources (une seule fois)"""
+        with self._lock:
+            if self._watcher is None and self.poll_interval > 0:
+                self._watcher = threading.Thread(target=self._watch, name='catalog-watcher', daemon=True)
+                self._watcher.start()
+
+
+_manager: Optional[CatalogManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_catalog_manager() -> CatalogManager:
+    """Gestionnaire unique par processus, surveillance démarrée"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = CatalogManager()
+                _manager.start()
+    return _manager
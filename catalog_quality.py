@@ -0,0 +1,272 @@
+"""
+Analyse de qualité du catalogue de prestations.
+
+    - similarité TF-IDF de toutes les définitions (matrice cosinus vectorisée)
+      et signalement des paires confusables au-delà d'un seuil ;
+    - validation de structure (celle du gestionnaire de catalogue) ;
+    - fautes de frappe probables, casse incohérente des clés et libellés ;
+    - différentiel entre deux versions du catalogue (clés ajoutées/supprimées,
+      tarifs, libellés et définitions modifiés).
+
+Usage :
+    python catalog_quality.py check [--threshold 0.6] [--json]
+    python catalog_quality.py diff ancien.py nouveau.py
+    python catalog_quality.py diff --git HEAD~1          # compare à une révision git
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+import catalog_snapshot
+from catalog_manager import validate_catalog
+from normalization import fold
+from retrieval import DefinitionIndex
+
+DEFAULT_THRESHOLD = 0.6
+
+def iter_prestations(prestations: Dict[str, Any]):
+    for domaine, domaine_info in prestations.items():
+        for key, info in domaine_info.get('prestations', {}).items():
+            yield domaine, key, info
+
+
+def similarity_matrix(prestations: Dict[str, Any]) -> Tuple[List[Tuple[str, str]], np.ndarray]:
+    """
+    Matrice cosinus TF-IDF des textes (label + définition) de toutes les prestations
+
+    Returns:
+        (liste des (domaine, prestation), matrice n x n)
+    """
+    index = DefinitionIndex(prestations)
+    return index.entries, index.similarity_matrix()
+
+
+def confusable_pairs(prestations: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """Paires de prestations dont les textes sont trop proches, par similarité décroissante"""
+    entries, matrix = similarity_matrix(prestations)
+    rows, cols = np.nonzero(np.triu(matrix, k=1) >= threshold)
+    pairs = [
+        {'a': '.'.join(entries[i]), 'b': '.'.join(entries[j]), 'similarite': round(float(matrix[i, j]), 3),
+         'meme_domaine': entries[i][0] == entries[j][0]}
+        for i, j in zip(rows, cols)
+    ]
+    return sorted(pairs, key=lambda pair: pair['similarite'], reverse=True)
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Distance de Levenshtein, abandonnée dès que `limit` est dépassée"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _is_inflection(a: str, b: str) -> bool:
+    """Deux mots ne différant que par leur terminaison (associatif / association)"""
+    prefix = len(os.path.commonprefix([a, b]))
+    return prefix >= 5 and prefix >= max(len(a), len(b)) - 5
+
+
+def probable_typos(prestations: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Mots rares proches d'un mot fréquent du catalogue (doomaine -> domaine),
+    et majuscules isolées au milieu d'un mot (peRtinence)
+    """
+    words: Counter = Counter()
+    locations: Dict[str, str] = {}
+    findings = []
+    for domaine, key, info in iter_prestations(prestations):
+        for field in ('label', 'definition'):
+            for raw in re.findall(r"\w+", str(info.get(field, ''))):
+                word = fold(raw)
+                words[word] += 1
+                locations.setdefault(word, f"{domaine}.{key}.{field}")
+                if re.search(r"[a-zà-ÿ][A-ZÀ-Ý]", raw) and not raw.isupper():
+                    findings.append({'mot': raw, 'suggestion': raw.lower(), 'emplacement': f"{domaine}.{key}.{field}"})
+
+    frequent = [word for word, count in words.items() if count >= 2 and len(word) > 3]
+    by_prefix: Dict[str, List[str]] = {}
+    for word in frequent:
+        by_prefix.setdefault(word[:2], []).append(word)
+
+    for word, count in words.items():
+        if count > 1 or len(word) < 5:
+            continue
+        limit = 2 if len(word) >= 8 else 1
+        candidates = [
+            other for other in by_prefix.get(word[:2], [])
+            if other != word and _edit_distance(word, other, limit) <= limit
+            # Variantes flexionnelles (pluriel, féminin, suffixe) : pas une faute
+            and not _is_inflection(word, other)
+        ]
+        if candidates:
+            best = max(candidates, key=lambda other: words[other])
+            findings.append({'mot': word, 'suggestion': best, 'emplacement': locations[word]})
+    return findings
+
+
+def casing_issues(prestations: Dict[str, Any]) -> List[str]:
+    """Clés hors snake_case ASCII minuscule et libellés sans majuscule initiale"""
+    issues = []
+    for domaine, domaine_info in prestations.items():
+        if not re.fullmatch(r"[a-z0-9_]+", domaine):
+            issues.append(f"Clé de domaine non normalisée : '{domaine}'")
+        label = str(domaine_info.get('label', ''))
+        if label[:1].islower():
+            issues.append(f"Libellé de domaine sans majuscule : '{label}'")
+        for key, info in domaine_info.get('prestations', {}).items():
+            if not re.fullmatch(r"[a-z0-9_]+", key):
+                issues.append(f"Clé de prestation non normalisée : '{domaine}.{key}'")
+            label = str(info.get('label', ''))
+            if label[:1].islower():
+                issues.append(f"Libellé de prestation sans majuscule : '{domaine}.{key}' ('{label}')")
+    return issues
+
+
+def diff_catalogs(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Différentiel entre deux versions du catalogue"""
+    old_entries = {(domaine, key): info for domaine, key, info in iter_prestations(old)}
+    new_entries = {(domaine, key): info for domaine, key, info in iter_prestations(new)}
+    changes = {
+        'domaines_ajoutes': sorted(set(new) - set(old)),
+        'domaines_supprimes': sorted(set(old) - set(new)),
+        'prestations_ajoutees': sorted('.'.join(entry) for entry in new_entries.keys() - old_entries.keys()),
+        'prestations_supprimees': sorted('.'.join(entry) for entry in old_entries.keys() - new_entries.keys()),
+        'tarifs_modifies': [],
+        'libelles_modifies': [],
+        'definitions_modifiees': [],
+    }
+    for entry in sorted(old_entries.keys() & new_entries.keys()):
+        before, after = old_entries[entry], new_entries[entry]
+        name = '.'.join(entry)
+        if before.get('tarif') != after.get('tarif'):
+            changes['tarifs_modifies'].append({'prestation': name, 'avant': before.get('tarif'), 'apres': after.get('tarif')})
+        if before.get('label') != after.get('label'):
+            changes['libelles_modifies'].append({'prestation': name, 'avant': before.get('label'), 'apres': after.get('label')})
+        if before.get('definition') != after.get('definition'):
+            changes['definitions_modifiees'].append(name)
+    return changes
+
+
+def load_prestations(path: str) -> Dict[str, Any]:
+    """Charge un catalogue depuis une source .py ou un instantané .json"""
+    if path.endswith('.json'):
+        data = catalog_snapshot.read_snapshot(path, check_sources=False)
+        if data is None:
+            raise ValueError(f"Instantané illisible : {path}")
+        return data['prestations']
+    module = catalog_snapshot.load_py_module(path, 'prestations_diff')
+    if module is None:
+        raise ValueError(f"Source illisible : {path}")
+    return module.get_prestations()
+
+
+def load_prestations_from_git(revision: str) -> Dict[str, Any]:
+    source = subprocess.run(
+        ['git', 'show', f"{revision}:prestations.py"],
+        cwd=catalog_snapshot.BASE_DIR, capture_output=True, check=True
+    ).stdout
+    with tempfile.NamedTemporaryFile('wb', suffix='.py', delete=False) as f:
+        f.write(source)
+    try:
+        return load_prestations(f.name)
+    finally:
+        os.remove(f.name)
+
+
+def check_report(prestations: Dict[str, Any], threshold: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    report = {
+        'prestations': sum(1 for _ in iter_prestations(prestations)),
+        'erreurs_structure': validate_catalog(prestations, catalog_snapshot.SOURCES['prestations']),
+        'paires_confusables': confusable_pairs(prestations, threshold),
+        'fautes_probables': probable_typos(prestations),
+        'casse': casing_issues(prestations),
+    }
+    report['duree_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return report
+
+
+def _print_check(report: Dict[str, Any], threshold: float):
+    print(f"{report['prestations']} prestations analysées en {report['duree_ms']} ms")
+    print(f"\nErreurs de structure ({len(report['erreurs_structure'])})")
+    for error in report['erreurs_structure']:
+        print(f"  - {error}")
+    print(f"\nPaires confusables, similarité >= {threshold} ({len(report['paires_confusables'])})")
+    for pair in report['paires_confusables']:
+        scope = "même domaine" if pair['meme_domaine'] else "domaines différents"
+        print(f"  {pair['similarite']:.2f}  {pair['a']}  <->  {pair['b']}  ({scope})")
+    print(f"\nFautes probables ({len(report['fautes_probables'])})")
+    for typo in report['fautes_probables']:
+        print(f"  {typo['mot']} -> {typo['suggestion']}  ({typo['emplacement']})")
+    print(f"\nCasse ({len(report['casse'])})")
+    for issue in report['casse']:
+        print(f"  - {issue}")
+
+
+def _print_diff(changes: Dict[str, Any]):
+    for label, key in (("Domaines ajoutés", 'domaines_ajoutes'), ("Domaines supprimés", 'domaines_supprimes'),
+                       ("Prestations ajoutées", 'prestations_ajoutees'), ("Prestations supprimées", 'prestations_supprimees'),
+                       ("Définitions modifiées", 'definitions_modifiees')):
+        if changes[key]:
+            print(f"{label} ({len(changes[key])}) :")
+            for item in changes[key]:
+                print(f"  {item}")
+    for label, key, unit in (("Tarifs modifiés", 'tarifs_modifies', " €"), ("Libellés modifiés", 'libelles_modifies', "")):
+        if changes[key]:
+            print(f"{label} ({len(changes[key])}) :")
+            for change in changes[key]:
+                print(f"  {change['prestation']} : {change['avant']}{unit} -> {change['apres']}{unit}")
+    if not any(changes.values()):
+        print("Aucune différence")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Qualité et différentiel du catalogue de prestations")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check', help="Analyse le catalogue courant")
+    check_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    check_parser.add_argument('--json', action='store_true')
+    diff_parser = subparsers.add_parser('diff', help="Compare deux versions du catalogue")
+    diff_parser.add_argument('paths', nargs='*', help="ancien [nouveau] (.py ou instantané .json)")
+    diff_parser.add_argument('--git', help="Révision git de référence pour prestations.py")
+    diff_parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        report = check_report(catalog_snapshot.load_catalog()['prestations'], args.threshold)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2))
+        else:
+            _print_check(report, args.threshold)
+        sys.exit(1 if report['erreurs_structure'] else 0)
+
+    if args.git:
+        old, new = load_prestations_from_git(args.git), load_prestations(args.paths[0] if args.paths else catalog_snapshot.SOURCES['prestations'])
+    elif len(args.paths) == 2:
+        old, new = load_prestations(args.paths[0]), load_prestations(args.paths[1])
+    elif len(args.paths) == 1:
+        old, new = load_prestations(args.paths[0]), catalog_snapshot.load_catalog()['prestations']
+    else:
+        parser.error("diff attend deux chemins, un chemin, ou --git REV")
+    changes = diff_catalogs(old, new)
+    if args.json:
+        print(json.dumps(changes, ensure_ascii=False, indent=2))
+    else:
+        _print_diff(changes)
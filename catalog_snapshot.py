@@ -0,0 +1,260 @@
+"""
+Instantané précompilé du catalogue de prestations et des consignes du chatbot.
+
+Plutôt que de ré-exécuter prestations.py et chatbot-instructions.py à chaque
+démarrage (et à chaque rerun Streamlit), leur contenu est sérialisé une fois
+dans un fichier JSON versionné, protégé par une somme de contrôle, puis relu
+via mmap. L'instantané est régénéré automatiquement dès qu'une source change.
+
+Format du fichier :
+    ligne 1 : en-tête JSON (version du format, empreinte des sources, checksum)
+    reste   : charge utile JSON (prestations, consignes, facteur d'urgence)
+
+Usage :
+    python catalog_snapshot.py --rebuild   # force la régénération
+    python catalog_snapshot.py --bench     # compare exec vs instantané
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', os.path.join(BASE_DIR, '.cache', 'catalog_snapshot.json'))
+SOURCES = {
+    'prestations': os.path.join(BASE_DIR, 'prestations.py'),
+    'instructions': os.path.join(BASE_DIR, 'chatbot-instructions.py'),
+}
+
+_lock = threading.Lock()
+_memo: Dict[str, Any] = {'stamp': None, 'data': None}
+
+
+def load_py_module(file_path: str, module_name: str):
+    """Exécute un fichier Python (le nom peut contenir un tiret) et retourne le module"""
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, file_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except Exception as e:
+        logger.error(f"Erreur lors du chargement du module {module_name}: {e}")
+        return None
+
+
+def _sha256_file(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _source_stamp() -> tuple:
+    """Empreinte rapide (mtime, taille) des sources, sans lecture du contenu"""
+    stamp = []
+    for name, path in sorted(SOURCES.items()):
+        try:
+            st = os.stat(path)
+            stamp.append((name, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append((name, None, None))
+    return tuple(stamp)
+
+
+def _sources_fresh(header: Dict[str, Any]) -> bool:
+    """Vérifie que l'instantané correspond aux sources actuelles"""
+    if header.get('format') != SNAPSHOT_FORMAT:
+        return False
+    recorded = header.get('sources', {})
+    for name, path in SOURCES.items():
+        info = recorded.get(name)
+        if not info:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Source absente : l'instantané reste la meilleure information disponible
+            continue
+        if st.st_mtime_ns == info.get('mtime_ns') and st.st_size == info.get('size'):
+            continue
+        # mtime modifié (checkout, copie...) : on tranche sur le contenu
+        if _sha256_file(path) != info.get('sha256'):
+            return False
+    return True
+
+
+def compile_sources() -> Optional[Dict[str, Any]]:
+    """
+    Exécute les sources et retourne la charge utile, sans rien écrire
+
+    Returns:
+        dict: Prestations, consignes et facteur d'urgence, ou None si une source est invalide
+    """
+    prestations_module = load_py_module(SOURCES['prestations'], 'prestations')
+    instructions_module = load_py_module(SOURCES['instructions'], 'consignes_chatbot')
+    if prestations_module is None or instructions_module is None:
+        return None
+
+    return {
+        'prestations': prestations_module.get_prestations(),
+        'instructions': instructions_module.get_chatbot_instructions(),
+        'facteur_urgence': getattr(prestations_module, 'get_facteur_urgence', lambda: 1.5)(),
+    }
+
+
+def write_snapshot(data: Dict[str, Any], path: str = SNAPSHOT_PATH) -> Dict[str, Any]:
+    """
+    Écrit la charge utile dans un nouvel instantané de façon atomique
+
+    Returns:
+        dict: La charge utile complétée de son empreinte
+    """
+    data = {key: value for key, value in data.items() if key != 'fingerprint'}
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    checksum = hashlib.sha256(payload).hexdigest()
+
+    sources = {}
+    for name, source_path in SOURCES.items():
+        st = os.stat(source_path)
+        sources[name] = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha256': _sha256_file(source_path),
+        }
+    header = json.dumps({'format': SNAPSHOT_FORMAT, 'sources': sources, 'checksum': checksum}).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header + b'\n' + payload)
+    os.replace(tmp_path, path)
+
+    data['fingerprint'] = checksum
+    logger.info(f"Instantané du catalogue régénéré ({len(payload)} octets)")
+    return data
+
+
+def build_snapshot(path: str = SNAPSHOT_PATH) -> Optional[Dict[str, Any]]:
+    """
+    Exécute les sources et écrit un nouvel instantané de façon atomique
+
+    Returns:
+        dict: La charge utile écrite, ou None si les sources sont invalides
+    """
+    data = compile_sources()
+    if data is None:
+        return None
+    return write_snapshot(data, path)
+
+
+def read_snapshot(path: str = SNAPSHOT_PATH, check_sources: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Lit un instantané via mmap et vérifie sa somme de contrôle
+
+    Returns:
+        dict: La charge utile, ou None si l'instantané est absent, corrompu ou périmé
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = mm.find(b'\n')
+            if offset < 0:
+                return None
+            header = json.loads(mm[:offset])
+            if check_sources and not _sources_fresh(header):
+                return None
+            view = memoryview(mm)[offset + 1:]
+            try:
+                if hashlib.sha256(view).hexdigest() != header.get('checksum'):
+                    logger.warning("Instantané du catalogue corrompu, régénération")
+                    return None
+                data = json.loads(bytes(view))
+            finally:
+                view.release()
+    except (OSError, ValueError):
+        return None
+    data['fingerprint'] = header['checksum']
+    return data
+
+
+def load_catalog() -> Dict[str, Any]:
+    """
+    Retourne le catalogue (prestations, consignes, empreinte)
+
+    Le résultat est mémorisé par processus : les appels suivants ne coûtent
+    qu'un stat() des sources tant qu'elles ne changent pas.
+    """
+    stamp = _source_stamp()
+    data = _memo['data']
+    if data is not None and _memo['stamp'] == stamp:
+        return data
+
+    with _lock:
+        if _memo['data'] is not None and _memo['stamp'] == stamp:
+            return _memo['data']
+        data = read_snapshot() or build_snapshot()
+        if data is None:
+            # Sources invalides : on se rabat sur le dernier instantané connu
+            data = read_snapshot(check_sources=False) or {
+                'prestations': {}, 'instructions': "", 'facteur_urgence': 1.5, 'fingerprint': ""
+            }
+        _memo['stamp'] = stamp
+        _memo['data'] = data
+        return data
+
+
+def _exec_source(path: str) -> Dict[str, Any]:
+    """Compile et exécute une source sans cache bytecode (démarrage à froid)"""
+    namespace: Dict[str, Any] = {}
+    with open(path, 'rb') as f:
+        exec(compile(f.read(), path, 'exec'), namespace)
+    return namespace
+
+
+def _bench(iterations: int) -> None:
+    def timed(func) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - start) * 1000 / iterations
+
+    def exec_cold():
+        _exec_source(SOURCES['prestations'])['get_prestations']()
+        _exec_source(SOURCES['instructions'])['get_chatbot_instructions']()
+
+    def exec_cached():
+        load_py_module(SOURCES['prestations'], 'prestations').get_prestations()
+        load_py_module(SOURCES['instructions'], 'consignes_chatbot').get_chatbot_instructions()
+
+    build_snapshot()
+    results = [
+        ("exec des sources (sans .pyc)", timed(exec_cold)),
+        ("exec des sources (avec .pyc)", timed(exec_cached)),
+        ("lecture de l'instantané", timed(read_snapshot)),
+        ("load_catalog mémorisé", timed(load_catalog)),
+    ]
+    reference = results[0][1]
+    for label, ms in results:
+        print(f"{label:<30}: {ms:8.3f} ms ({reference / ms:6.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Instantané précompilé du catalogue")
+    parser.add_argument('--rebuild', action='store_true', help="Force la régénération de l'instantané")
+    parser.add_argument('--bench', type=int, nargs='?', const=50, help="Compare exec et instantané sur N itérations")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.rebuild:
+        build_snapshot()
+    if args.bench:
+        _bench(args.bench)
+    if not args.rebuild and not args.bench:
+        catalog = load_catalog()
+        print(f"{len(catalog['prestations'])} domaines, empreinte {catalog['fingerprint'][:12]}")
@@ -0,0 +1,117 @@
+"""
+Composition de devis multi-prestations.
+
+Un dossier réel combine souvent plusieurs prestations (consultation initiale,
+mise en demeure, assignation...). Ce module calcule, à partir d'un ensemble
+classé de prestations candidates et de leurs probabilités, le coût attendu
+ainsi qu'une fourchette (minimum / plus probable / maximum).
+"""
+from typing import Dict, List, Tuple, Any
+
+FACTEUR_URGENCE = 1.5  # Identique au facteur appliqué dans calculate_estimate
+MAX_CANDIDATS = 6      # 2^6 combinaisons au plus : reste sous la milliseconde
+
+# Table de prix : domaine -> prestation -> (tarif, label)
+PriceTables = Dict[str, Dict[str, Tuple[int, str]]]
+
+
+def build_price_tables(prestations: Dict[str, Any]) -> PriceTables:
+    """
+    Précalcule les tables de prix par domaine à partir du catalogue
+    """
+    tables = {}
+    for domaine, domaine_info in prestations.items():
+        tables[domaine] = {
+            key: (info.get('tarif') or 0, info.get('label', key))
+            for key, info in domaine_info.get('prestations', {}).items()
+        }
+    return tables
+
+
+def _rank_candidates(candidates: List[Tuple[str, str, float]], price_tables: PriceTables) -> List[Tuple[str, str, float]]:
+    """Filtre les candidats inconnus, dédoublonne et trie par probabilité décroissante"""
+    best = {}
+    for domaine, prestation, probabilite in candidates:
+        if prestation not in price_tables.get(domaine, {}):
+            continue
+        try:
+            probabilite = min(max(float(probabilite), 0.0), 1.0)
+        except (TypeError, ValueError):
+            continue
+        key = (domaine, prestation)
+        if probabilite > best.get(key, -1.0):
+            best[key] = probabilite
+    ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+    return [(domaine, prestation, p) for (domaine, prestation), p in ranked[:MAX_CANDIDATS] if p > 0]
+
+
+def compose_quote(candidates: List[Tuple[str, str, float]], price_tables: PriceTables, urgency: str) -> Dict[str, Any]:
+    """
+    Compose un devis à partir de prestations candidates
+
+    Chaque candidat est inclus indépendamment avec sa probabilité. Toutes les
+    combinaisons non vides sont énumérées pour obtenir le coût attendu, le coût
+    de la combinaison la plus probable et les bornes de la fourchette.
+
+    Args:
+        candidates: Liste de (domaine, prestation, probabilité)
+        price_tables: Tables de prix issues de build_price_tables
+        urgency: Degré d'urgence ("Normal" ou "Urgent")
+
+    Returns:
+        dict: lignes du devis, coût attendu, minimum, plus probable et maximum
+    """
+    ranked = _rank_candidates(candidates, price_tables)
+    facteur = FACTEUR_URGENCE if urgency == "Urgent" else 1.0
+
+    lignes = []
+    for domaine, prestation, probabilite in ranked:
+        tarif, label = price_tables[domaine][prestation]
+        lignes.append({
+            'domaine': domaine,
+            'prestation': prestation,
+            'label': label,
+            'tarif': round(tarif * facteur),
+            'probabilite': probabilite
+        })
+
+    if not lignes:
+        return {'lignes': [], 'attendu': 0, 'minimum': 0, 'probable': 0, 'maximum': 0}
+
+    tarifs = [ligne['tarif'] for ligne in lignes]
+    probas = [ligne['probabilite'] for ligne in lignes]
+
+    total_proba = 0.0
+    esperance = 0.0
+    minimum = None
+    meilleure_proba = -1.0
+    probable = 0
+    for mask in range(1, 1 << len(lignes)):
+        proba = 1.0
+        cout = 0
+        for i, (tarif, p) in enumerate(zip(tarifs, probas)):
+            if mask >> i & 1:
+                proba *= p
+                cout += tarif
+            else:
+                proba *= 1.0 - p
+        if proba <= 0.0:
+            continue
+        total_proba += proba
+        esperance += proba * cout
+        if minimum is None or cout < minimum:
+            minimum = cout
+        if proba > meilleure_proba:
+            meilleure_proba = proba
+            probable = cout
+
+    # Conditionnement sur « au moins une prestation est nécessaire »
+    attendu = round(esperance / total_proba) if total_proba else 0
+
+    return {
+        'lignes': lignes,
+        'attendu': attendu,
+        'minimum': minimum or 0,
+        'probable': probable,
+        'maximum': sum(tarifs)
+    }
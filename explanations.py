@@ -0,0 +1,171 @@
+"""
+Explications par gabarits, sans appel au modèle.
+
+Pour chaque prestation et chaque profil de client, un gabarit est compilé une
+fois par version du catalogue à partir du libellé et de la définition de la
+prestation. À la requête, seuls la précision du profil (taille, secteur) et
+l'urgence restent à insérer : l'explication est immédiate.
+
+Modes (EXPLANATION_MODE) :
+    - template (défaut) : explication par gabarit affichée aussitôt ; l'analyse
+      personnalisée du modèle et ses sources juridiques sont rédigées en
+      arrière-plan et ajoutées une fois prêtes (EXPLANATION_ENRICH=0 s'en passe :
+      aucune analyse du modèle, aucune source) ;
+    - llm : analyse détaillée entièrement rédigée par le modèle.
+
+Aperçu d'un gabarit :
+    python explanations.py droit_du_travail conseil_licenciement --profil entreprise --urgent
+"""
+import argparse
+import os
+import threading
+from string import Template
+from typing import Any, Dict, Optional, Tuple
+
+from catalog_manager import CatalogVersion
+
+EXPLANATION_MODE = os.getenv('EXPLANATION_MODE', 'template')
+EXPLANATION_ENRICH = os.getenv('EXPLANATION_ENRICH', '1') == '1'
+
+NO_SOURCES = "Aucune source spécifique mentionnée."
+
+# Profil de client : phrase d'accompagnement ($precision : taille, secteur)
+PROFILES = {
+    'particulier': "En tant que particulier, vous êtes accompagné personnellement à chaque étape, "
+                   "avec des explications claires sur vos droits et les démarches à suivre.",
+    'entreprise': "Pour votre entreprise$precision, l'intervention est adaptée à votre organisation "
+                  "et à vos enjeux opérationnels, afin de sécuriser votre activité.",
+    'profession_liberale': "Pour votre activité libérale$precision, l'intervention tient compte des règles "
+                           "propres à votre profession et de vos contraintes d'exercice.",
+    'association': "Pour votre association, l'intervention tient compte de votre gouvernance, "
+                   "de vos statuts et des obligations propres au secteur associatif.",
+    'public': "Pour votre structure publique, l'intervention tient compte des règles "
+              "spécifiques aux personnes publiques et à la commande publique.",
+}
+
+URGENCY = {
+    'Urgent': "Compte tenu de l'urgence signalée, votre dossier peut être traité en priorité ; "
+              "un facteur d'urgence s'applique au forfait.",
+    'Normal': "Votre dossier sera traité dans les délais habituels du cabinet.",
+}
+
+_BODY = ("Votre situation relève du domaine « {domaine} ». La prestation la plus adaptée est "
+         "« {prestation} » : {definition}\n\n{profil} $urgence\n\n"
+         "Une première consultation permettra de confirmer ce choix au vu des éléments de votre dossier.")
+
+
+def client_profile(client_info: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Profil de gabarit et précision à insérer
+
+    Returns:
+        (profil, précision), par exemple ('entreprise', ' (PME, secteur Services)')
+    """
+    if client_info.get('type_principal') != "Professionnel":
+        return 'particulier', ''
+    sous_type = client_info.get('sous_type')
+    profile = {
+        "Entreprise": 'entreprise',
+        "Profession libérale": 'profession_liberale',
+        "Association": 'association',
+    }.get(sous_type, 'public')
+    details = []
+    if client_info.get('taille'):
+        details.append(client_info['taille'].split(' (')[0])
+    if client_info.get('secteur'):
+        details.append(f"secteur {client_info['secteur']}")
+    return profile, f" ({', '.join(details)})" if details else ''
+
+
+def _sentence(text: str) -> str:
+    text = text.strip()
+    if not text:
+        return text
+    text = text[0].lower() + text[1:]
+    return text if text.endswith('.') else text + '.'
+
+
+class ExplanationEngine:
+    """Gabarits compilés pour toutes les prestations d'une version du catalogue"""
+
+    def __init__(self, catalog: CatalogVersion):
+        self.fingerprint = catalog.fingerprint
+        self.templates: Dict[Tuple[str, str, str], Template] = {}
+        self.elements: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for domaine, domaine_info in catalog.prestations.items():
+            for key, info in domaine_info.get('prestations', {}).items():
+                # Les textes du catalogue sont échappés : seuls $precision et $urgence restent variables
+                static = {
+                    'domaine': domaine_info['label'].replace('$', '$$'),
+                    'prestation': info['label'].replace('$', '$$'),
+                    'definition': _sentence(info['definition']).replace('$', '$$'),
+                }
+                for profile, profile_text in PROFILES.items():
+                    self.templates[(domaine, key, profile)] = Template(_BODY.format(profil=profile_text, **static))
+                self.elements[(domaine, key)] = {
+                    "domaine": {"nom": domaine_info['label'], "description": domaine_info['label']},
+                    "prestation": {"nom": info['label'], "description": info['definition']},
+                }
+
+    def render(self, domaine: str, prestation: str, client_info: Dict[str, Any],
+               urgency: str) -> Optional[Tuple[str, Dict[str, Any], str]]:
+        """
+        Explication par gabarit, au format de get_detailed_analysis
+
+        Returns:
+            (analyse, éléments utilisés, sources), ou None si la prestation est inconnue
+        """
+        profile, precision = client_profile(client_info)
+        template = self.templates.get((domaine, prestation, profile))
+        if template is None:
+            return None
+        text = template.substitute(precision=precision, urgence=URGENCY.get(urgency, URGENCY['Normal']))
+        return text, self.elements[(domaine, prestation)], NO_SOURCES
+
+
+_engine: Optional[ExplanationEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_explanations(catalog: CatalogVersion) -> ExplanationEngine:
+    """Gabarits de la version du catalogue, recompilés quand son empreinte change"""
+    global _engine
+    engine = _engine
+    if engine is None or engine.fingerprint != catalog.fingerprint:
+        with _engine_lock:
+            if _engine is None or _engine.fingerprint != catalog.fingerprint:
+                _engine = ExplanationEngine(catalog)
+            engine = _engine
+    return engine
+
+
+if __name__ == "__main__":
+    import time
+    from catalog_manager import CatalogManager
+
+    parser = argparse.ArgumentParser(description="Aperçu d'une explication par gabarit")
+    parser.add_argument('domaine')
+    parser.add_argument('prestation')
+    parser.add_argument('--profil', choices=sorted(PROFILES), default='particulier')
+    parser.add_argument('--urgent', action='store_true')
+    args = parser.parse_args()
+
+    catalog = CatalogManager(poll_interval=0).current()
+    start = time.perf_counter()
+    engine = get_explanations(catalog)
+    compiled_ms = (time.perf_counter() - start) * 1000
+    client_info = {
+        'particulier': {'type_principal': "Particulier"},
+        'entreprise': {'type_principal': "Professionnel", 'sous_type': "Entreprise",
+                       'taille': "PME (10 à 250 salariés)", 'secteur': "Services"},
+        'profession_liberale': {'type_principal': "Professionnel", 'sous_type': "Profession libérale"},
+        'association': {'type_principal': "Professionnel", 'sous_type': "Association"},
+        'public': {'type_principal': "Professionnel", 'sous_type': "Collectivité"},
+    }[args.profil]
+    start = time.perf_counter()
+    explanation = engine.render(args.domaine, args.prestation, client_info, "Urgent" if args.urgent else "Normal")
+    render_us = (time.perf_counter() - start) * 1e6
+    if explanation is None:
+        raise SystemExit(f"Prestation inconnue : {args.domaine}.{args.prestation}")
+    print(explanation[0])
+    print(f"\n{len(engine.templates)} gabarits compilés en {compiled_ms:.1f} ms, rendu en {render_us:.0f} µs")
@@ -0,0 +1,265 @@
+"""
+Point de santé / keepalive léger, servi hors de Streamlit.
+
+Un petit serveur HTTP tourne dans un thread démon du processus et répond sans
+créer de session Streamlit ni rendre la page :
+
+    GET /health                  -> vivacité + compteurs du processus
+    GET /ready                   -> état de préparation (catalogue, OpenAI, SMTP)
+    GET /keepalive?token=...     -> enregistre un keepalive
+
+Le serveur écoute sur HEALTH_HOST (0.0.0.0 par défaut) pour rester joignable
+par les sondes externes (orchestrateur, répartiteur de charge) ;
+HEALTH_HOST=127.0.0.1 le limite à la machine. Le détail de /health et /ready (empreinte du
+catalogue, statistiques de routage, files, refus du filtre) n'est renvoyé
+qu'aux clients locaux : une sonde distante ne reçoit que le statut et le code
+HTTP.
+
+Les compteurs vivent au niveau du module (donc du processus) : contrairement
+à st.session_state, ils ne sont pas dupliqués par session et survivent aux
+reruns du script. Le nombre de keepalives est tenu par l'état partagé
+(shared_state), commun aux répliques.
+"""
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8502'))  # 0 pour désactiver
+HEALTH_HOST = os.getenv('HEALTH_HOST', '0.0.0.0')  # 127.0.0.1 pour les seules sondes locales
+OPENAI_PROBE_TTL = 300  # secondes entre deux sondes OpenAI
+
+
+class ProcessStats:
+    """Compteurs partagés par toutes les sessions du processus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.keepalive_count = 0
+        self.last_keepalive: Optional[float] = None
+        self.health_requests = 0
+        self.smtp_inflight = 0
+
+    def record_keepalive(self) -> Dict[str, Any]:
+        """Compte le keepalive dans l'état partagé (total de toutes les répliques), localement à défaut"""
+        from shared_state import StateBackendError, get_state_backend
+        now = time.time()
+        try:
+            count, _ = get_state_backend().batch().incr('keepalive:count').set('keepalive:last', now).execute()
+        except StateBackendError as e:
+            logger.warning(f"Keepalive compté localement : {e}")
+            count = self.keepalive_count + 1
+        with self._lock:
+            self.keepalive_count = count
+            self.last_keepalive = now
+            return {'count': self.keepalive_count, 'last_keepalive': self.last_keepalive}
+
+    def record_health_request(self):
+        with self._lock:
+            self.health_requests += 1
+
+    def smtp_started(self):
+        with self._lock:
+            self.smtp_inflight += 1
+
+    def smtp_finished(self):
+        with self._lock:
+            self.smtp_inflight -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'keepalive_count': self.keepalive_count,
+            'last_keepalive': datetime.fromtimestamp(self.last_keepalive).isoformat() if self.last_keepalive else None,
+            'health_requests': self.health_requests,
+        }
+
+
+class CachedProbe:
+    """
+    Sonde mise en cache : le résultat est rafraîchi en arrière-plan au plus
+    une fois par `ttl` secondes, l'appelant n'attend jamais la sonde.
+    """
+
+    def __init__(self, probe: Callable[[], bool], ttl: float):
+        self.probe = probe
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._result: Optional[bool] = None
+        self._checked_at = 0.0
+        self._running = False
+
+    def _refresh(self):
+        try:
+            result = bool(self.probe())
+        except Exception as e:
+            logger.warning(f"Sonde {getattr(self.probe, '__name__', 'inconnue')} en échec : {e}")
+            result = False
+        with self._lock:
+            self._result = result
+            self._checked_at = time.time()
+            self._running = False
+
+    def __call__(self) -> Dict[str, Any]:
+        with self._lock:
+            stale = time.time() - self._checked_at > self.ttl
+            if stale and not self._running:
+                self._running = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+            return {
+                'ok': self._result,
+                'checked_at': datetime.fromtimestamp(self._checked_at).isoformat() if self._checked_at else None,
+            }
+
+
+def probe_openai() -> bool:
+    """Vérifie que l'API OpenAI répond, sans importer le SDK"""
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        return False
+    base_url = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+    request = urllib.request.Request(f"{base_url}/models", headers={'Authorization': f"Bearer {api_key}"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status == 200
+
+
+def check_catalog() -> Dict[str, Any]:
+    """Vérifie que le catalogue est chargé et indique sa version"""
+    from catalog_manager import get_catalog_manager
+    catalog = get_catalog_manager().current()
+    return {'ok': bool(catalog.prestations), 'version': catalog.version, 'fingerprint': catalog.fingerprint[:12]}
+
+
+stats = ProcessStats()
+_checks: Dict[str, Callable[[], Any]] = {
+    'catalog': check_catalog,
+    'openai': CachedProbe(probe_openai, OPENAI_PROBE_TTL),
+    'smtp_queue_depth': lambda: stats.smtp_inflight,
+}
+
+
+def register_check(name: str, check: Callable[[], Any]):
+    """Ajoute ou remplace un indicateur de préparation (doit être non bloquant)"""
+    _checks[name] = check
+
+
+def handle_keepalive(auth_token: Optional[str]) -> Dict[str, Any]:
+    """
+    Gère les requêtes de keepalive
+
+    Args:
+        auth_token: Token d'authentification optionnel
+
+    Returns:
+        dict: Réponse avec statut et informations
+    """
+    expected_token = os.getenv('KEEPALIVE_TOKEN', 'ping')
+    if auth_token != expected_token:
+        logger.warning("Tentative de keepalive avec un token invalide")
+        return {
+            "status": "error",
+            "message": "Token invalide",
+            "timestamp": datetime.now().isoformat()
+        }
+
+    result = stats.record_keepalive()
+    logger.info(f"Keepalive reçu - Total: {result['count']}")
+    return {
+        "status": "success",
+        "last_keepalive": datetime.fromtimestamp(result['last_keepalive']).isoformat(),
+        "count": result['count'],
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def readiness_report() -> Dict[str, Any]:
+    """Agrège les indicateurs de préparation enregistrés"""
+    details = {}
+    for name, check in list(_checks.items()):
+        try:
+            details[name] = check()
+        except Exception as e:
+            details[name] = {'ok': False, 'error': str(e)}
+    ready = all(
+        value.get('ok') is not False if isinstance(value, dict) else value is not False
+        for value in details.values()
+    )
+    return {'status': 'ready' if ready else 'degraded', 'checks': details, **stats.snapshot()}
+
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        stats.record_health_request()
+        if url.path == '/health':
+            status, body = 200, {'status': 'ok', **stats.snapshot()}
+        elif url.path == '/ready':
+            body = readiness_report()
+            status = 200 if body['status'] == 'ready' else 503
+        elif url.path == '/keepalive':
+            token = parse_qs(url.query).get('token', [None])[0]
+            body = handle_keepalive(token)
+            status = 200 if body['status'] == 'success' else 403
+        else:
+            status, body = 404, {'status': 'error', 'message': 'Route inconnue'}
+        if url.path in ('/health', '/ready') and not self._is_local():
+            body = {'status': body['status']}
+
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _is_local(self) -> bool:
+        try:
+            return ipaddress.ip_address(self.client_address[0]).is_loopback
+        except ValueError:
+            return False
+
+    def log_message(self, format, *args):
+        # Pas de log par ping : le keepalive est journalisé par handle_keepalive
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+def start_health_server(port: int = HEALTH_PORT, host: str = HEALTH_HOST) -> Optional[ThreadingHTTPServer]:
+    """Démarre le serveur de santé une seule fois par processus"""
+    global _server, _server_failed
+    if not port or _server_failed:
+        return _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _HealthHandler)
+        except OSError as e:
+            # Port déjà pris (autre réplique sur l'hôte) : on ne retente pas à chaque rerun
+            _server_failed = True
+            logger.warning(f"Serveur de santé non démarré sur le port {port} : {e}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name='health-server', daemon=True).start()
+        logger.info(f"Serveur de santé démarré sur {host}:{port}")
+        return _server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if start_health_server():
+        threading.Event().wait()
@@ -0,0 +1,344 @@
+"""
+Historique persistant des questions et estimations (SQLite en mode WAL).
+
+Chaque appel à log_question dépose un enregistrement dans une file ; un thread
+d'écriture unique les insère par lots (une transaction par lot). La table
+`estimates` est en ajout seul et indexée sur la date, le domaine, la prestation
+et le segment client. Un agrégat hebdomadaire par domaine est tenu à jour dans
+la même transaction, ce qui rend la requête « estimations par domaine et par
+semaine » indépendante du volume d'historique.
+
+Usage :
+    python history_store.py --weekly                # agrégat hebdomadaire
+    python history_store.py --bench 1000000         # insertion + requêtes synthétiques
+    python history_store.py --label REQUEST_ID 1    # issue d'une estimation (calibration)
+"""
+import argparse
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from normalization import normalize
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB = os.getenv('HISTORY_DB', 'estimates.sqlite3')
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0  # secondes maximum avant écriture d'un lot incomplet
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS estimates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    week TEXT NOT NULL,
+    request_id TEXT,
+    client_segment TEXT,
+    client_type TEXT,
+    urgency TEXT,
+    domaine TEXT,
+    prestation TEXT,
+    forfait INTEGER,
+    question TEXT,
+    llm_confidence REAL,
+    retrieval_score REAL,
+    agreement REAL,
+    confidence REAL,
+    correct INTEGER,
+    route TEXT,
+    simhash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_estimates_ts ON estimates(ts);
+CREATE INDEX IF NOT EXISTS idx_estimates_domaine ON estimates(domaine, ts);
+CREATE INDEX IF NOT EXISTS idx_estimates_prestation ON estimates(prestation, ts);
+CREATE INDEX IF NOT EXISTS idx_estimates_segment ON estimates(client_segment, ts);
+CREATE INDEX IF NOT EXISTS idx_estimates_request ON estimates(request_id);
+
+CREATE TABLE IF NOT EXISTS weekly_domain_stats (
+    week TEXT NOT NULL,
+    domaine TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total_forfait INTEGER NOT NULL,
+    PRIMARY KEY (week, domaine)
+) WITHOUT ROWID;
+"""
+
+# Colonnes ajoutées après la création initiale de la table (migrées au démarrage)
+_MIGRATIONS = {
+    'llm_confidence': 'REAL',
+    'retrieval_score': 'REAL',
+    'agreement': 'REAL',
+    'confidence': 'REAL',
+    'correct': 'INTEGER',
+    'route': 'TEXT',
+    'simhash': 'TEXT',
+}
+
+_INSERT = """
+INSERT INTO estimates (ts, week, request_id, client_segment, client_type, urgency, domaine, prestation, forfait, question,
+                       llm_confidence, retrieval_score, agreement, confidence, route, simhash)
+VALUES (:ts, :week, :request_id, :client_segment, :client_type, :urgency, :domaine, :prestation, :forfait, :question,
+        :llm_confidence, :retrieval_score, :agreement, :confidence, :route, :simhash)
+"""
+
+_UPSERT_WEEKLY = """
+INSERT INTO weekly_domain_stats (week, domaine, count, total_forfait) VALUES (?, ?, ?, ?)
+ON CONFLICT(week, domaine) DO UPDATE SET
+    count = count + excluded.count,
+    total_forfait = total_forfait + excluded.total_forfait
+"""
+
+
+def iso_week(ts: float) -> str:
+    """Semaine ISO au format AAAA-Wss"""
+    year, week, _ = datetime.fromtimestamp(ts, timezone.utc).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def client_segment(client_type: str) -> str:
+    """Réduit la description client à son segment : « Professionnel - Entreprise »"""
+    parts = [re.sub(r"\s*\(.*\)", "", part).strip() for part in client_type.split(" - ")]
+    return " - ".join(part for part in parts[:2] if part)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def migrate(conn: sqlite3.Connection):
+    """Ajoute aux bases existantes les colonnes apparues depuis leur création"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(estimates)")}
+    for column, column_type in _MIGRATIONS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE estimates ADD COLUMN {column} {column_type}")
+    conn.executescript(SCHEMA)
+
+
+class HistoryStore:
+    """Historique en ajout seul, alimenté par un thread d'écriture par lots"""
+
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        conn = connect(path)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'estimates'").fetchone():
+            migrate(conn)
+        else:
+            conn.executescript(SCHEMA)
+        conn.close()
+        self._queue: queue.Queue = queue.Queue(maxsize=100000)
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+        self._local = threading.local()
+
+    def record(self, question: str, client_type: str, urgency: str, estimation: Optional[Dict[str, Any]] = None,
+               request_id: str = '-', ts: Optional[float] = None):
+        """Dépose un enregistrement sans bloquer l'appelant"""
+        ts = ts or time.time()
+        estimation = estimation or {}
+        row = {
+            'ts': ts,
+            'week': iso_week(ts),
+            'request_id': request_id,
+            'client_segment': client_segment(client_type),
+            'client_type': client_type,
+            'urgency': urgency,
+            'domaine': estimation.get('code_domaine'),
+            'prestation': estimation.get('code_prestation'),
+            'forfait': estimation.get('forfait'),
+            'question': question,
+            # Empreinte de la question normalisée : regroupe les reformulations proches
+            'simhash': f"{normalize(question).simhash:016x}",
+            'llm_confidence': estimation.get('llm_confidence'),
+            'retrieval_score': estimation.get('retrieval_score'),
+            'agreement': estimation.get('agreement'),
+            'confidence': estimation.get('confidence'),
+            'route': estimation.get('route'),
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            logger.error("File de l'historique pleine, enregistrement perdu")
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(conn, batch)
+            except sqlite3.Error as e:
+                logger.error(f"Échec d'écriture de {len(batch)} enregistrements d'historique : {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: List[Dict[str, Any]]):
+        weekly: Dict[Tuple[str, str], List[int]] = {}
+        for row in batch:
+            stats = weekly.setdefault((row['week'], row['domaine'] or ''), [0, 0])
+            stats[0] += 1
+            stats[1] += row['forfait'] or 0
+        with conn:
+            conn.executemany(_INSERT, batch)
+            conn.executemany(_UPSERT_WEEKLY, [(week, domaine, count, total) for (week, domaine), (count, total) in weekly.items()])
+
+    def set_outcome(self, request_id: str, correct: bool) -> int:
+        """
+        Renseigne l'issue d'une estimation (prestation confirmée ou non par le cabinet),
+        utilisée pour ajuster la calibration de l'indice de confiance
+
+        Returns:
+            int: Nombre de lignes mises à jour
+        """
+        conn = self._reader()
+        with conn:
+            return conn.execute(
+                "UPDATE estimates SET correct = ? WHERE request_id = ?", (1 if correct else 0, request_id)
+            ).rowcount
+
+    def flush(self):
+        """Attend l'écriture de tous les enregistrements en file"""
+        self._queue.join()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def estimates_per_domain_per_week(self, since: Optional[float] = None, until: Optional[float] = None) -> List[Tuple[str, str, int, int]]:
+        """
+        Nombre d'estimations et forfait cumulé par semaine et par domaine
+
+        Returns:
+            Liste de (semaine, domaine, nombre, forfait_total)
+        """
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("week >= ?")
+            params.append(iso_week(since))
+        if until is not None:
+            clauses.append("week <= ?")
+            params.append(iso_week(until))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._reader().execute(
+            f"SELECT week, domaine, count, total_forfait FROM weekly_domain_stats {where} ORDER BY week, domaine",
+            params
+        ).fetchall()
+
+    def query(self, domaine: Optional[str] = None, prestation: Optional[str] = None, segment: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Dernières estimations filtrées (chaque filtre s'appuie sur un index)"""
+        clauses, params = [], []
+        for column, value in (('domaine', domaine), ('prestation', prestation), ('client_segment', segment)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self._reader().execute(f"SELECT * FROM estimates {where} ORDER BY ts DESC LIMIT ?", params + [limit])
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Instance unique par processus (le script Streamlit est ré-exécuté à chaque rerun)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore()
+    return _store
+
+
+def _bench(rows: int, path: str):
+    import random
+    if os.path.exists(path):
+        os.remove(path)
+    store = HistoryStore(path)
+    domaines = [f"domaine_{i}" for i in range(20)]
+    now = time.time()
+
+    # Chargement en masse par lots directs, puis passage par la file pour le chemin réel
+    start = time.perf_counter()
+    conn = connect(path)
+    batch = []
+    for i in range(rows):
+        domaine = random.choice(domaines)
+        ts = now - random.random() * 365 * 86400
+        batch.append({
+            'ts': ts, 'week': iso_week(ts), 'request_id': '-', 'client_segment': "Professionnel - Entreprise",
+            'client_type': "Professionnel - Entreprise (TPE) - Secteur Tech", 'urgency': "Normal",
+            'domaine': domaine, 'prestation': f"{domaine}_p{i % 8}", 'forfait': 800, 'question': "question de test",
+            'llm_confidence': None, 'retrieval_score': None, 'agreement': None, 'confidence': None, 'route': None,
+            'simhash': f"{normalize('question de test').simhash:016x}",
+        })
+        if len(batch) == 10000:
+            HistoryStore._write_batch(conn, batch)
+            batch = []
+    if batch:
+        HistoryStore._write_batch(conn, batch)
+    conn.close()
+    print(f"chargement de {rows} lignes : {time.perf_counter() - start:.1f} s")
+
+    start = time.perf_counter()
+    for i in range(5000):
+        store.record("question de test", "Particulier", "Urgent", {'code_domaine': 'domaine_1', 'forfait': 200})
+    enqueued = time.perf_counter() - start
+    store.flush()
+    print(f"5000 record() : {enqueued * 1000:.1f} ms côté appelant, {(time.perf_counter() - start) * 1000:.1f} ms jusqu'à l'écriture")
+
+    for label, func in (
+        ("par domaine et par semaine", lambda: store.estimates_per_domain_per_week()),
+        ("par domaine sur 4 semaines", lambda: store.estimates_per_domain_per_week(since=now - 28 * 86400)),
+        ("100 dernières d'un domaine", lambda: store.query(domaine='domaine_3')),
+    ):
+        start = time.perf_counter()
+        result = func()
+        print(f"{label:<30}: {(time.perf_counter() - start) * 1000:7.2f} ms ({len(result)} lignes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Historique des estimations")
+    parser.add_argument('--weekly', action='store_true', help="Affiche l'agrégat hebdomadaire par domaine")
+    parser.add_argument('--bench', type=int, help="Insère N lignes synthétiques et chronomètre les requêtes")
+    parser.add_argument('--label', nargs=2, metavar=('REQUEST_ID', '0|1'),
+                        help="Renseigne l'issue d'une estimation (1 : prestation correcte)")
+    parser.add_argument('--db', default='bench-estimates.sqlite3')
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args.bench, args.db)
+    elif args.label:
+        updated = get_history_store().set_outcome(args.label[0], args.label[1] == '1')
+        print(f"{updated} estimation(s) mise(s) à jour")
+    elif args.weekly:
+        for week, domaine, count, total in get_history_store().estimates_per_domain_per_week():
+            print(f"{week}  {domaine:<40} {count:>6}  {total:>10} €")
@@ -0,0 +1,423 @@
+"""
+Index de mots-clés juridiques du catalogue (automate d'Aho-Corasick).
+
+Les motifs sont des suites de radicaux (normalization : mots repliés, tronqués)
+tirées de synonymes choisis à la main, des labels et définitions du catalogue
+et d'un lexique juridique général. L'automate est parcouru mot à mot : toutes
+les occurrences de tous les motifs sont trouvées en un seul passage linéaire
+sur la question, en quelques microsecondes, sans appel réseau.
+
+Chaque motif désigne des domaines et prestations avec un poids ; les indices
+obtenus servent au filtre local (prefilter), à l'ordre des domaines du prompt
+compilé (prompt_compiler) et au classement hors ligne quand aucun modèle ne
+répond (model_router).
+
+L'index est reconstruit quand l'empreinte du catalogue change.
+
+Usage :
+    python keyword_index.py "Mon employeur veut me licencier"   # termes et indices
+    python keyword_index.py --bench                              # débit et justesse sur le corpus
+"""
+import argparse
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from normalization import fold, normalize, stem, words
+
+logger = logging.getLogger(__name__)
+
+
+# Lexique juridique général, en plus des termes du catalogue
+LEGAL_TERMS = """
+avocat avocate droit droits juridique juridiquement loi lois legal illegal tribunal tribunaux juge justice jugement
+proces procedure plainte litige contentieux contrat contrats clause avenant bail baux loyer locataire proprietaire
+bailleur licenciement licencier employeur salarie salaire prudhommes heritage succession testament notaire divorce
+divorcer pension garde mariage pacs separation societe statuts associe gerant dirigeant faillite liquidation
+redressement creance dette huissier recouvrement marque brevet contrefacon rgpd donnees amende infraction delit
+penal police prejudice dommages interets indemnite indemnisation assurance sinistre responsabilite
+expulsion voisin voisinage servitude propriete copropriete syndic permis urbanisme administration prefecture
+titre sejour visa nationalite recours appel cassation sanction discipline harcelement discrimination
+rupture conventionnelle demission preavis facture impaye escroquerie fraude vol diffamation accident
+patron sas sarl sci eurl deces decede heritier caution garantie credit pret banque medical
+""".split()
+
+# Mots trop généraux pour signaler à eux seuls une question juridique
+GENERIC_WORDS = frozenset("""
+analyse approfondie aspects etablissement elaboration entreprise ensemble specifique situation services service
+conseil conseils premier rendez actions entreprendre definir evaluer accompagnement gestion mise place suivi
+""".split())
+
+# Synonymes choisis à la main : domaine -> {prestation ('' = domaine seul) -> expressions séparées par des virgules}
+SYNONYMS: Dict[str, Dict[str, str]] = {
+    'droit_du_travail': {
+        '': "employeur, salarie, patron, heures supplementaires, arret maladie, code du travail, prud hommes, prudhommes",
+        'conseil_licenciement': "licenciement, licencier, licencie, faute grave, entretien prealable",
+        'negociation_rupture_conventionnelle': "rupture conventionnelle, commun accord, quitter mon entreprise",
+        'representation_en_justice': "conseil des prud hommes, prudhommes, prud hommes",
+        'redaction_contrat_travail': "contrat de travail, cdi, cdd, embaucher, embauche",
+        'Plan_sauvegarde_emploi': "plan social, licenciement economique, pse",
+        'règlement_intérieur': "reglement interieur",
+        'redaction_accord_collectif': "accord collectif, accord d entreprise, teletravail",
+    },
+    'droit_de_la_famille': {
+        '': "conjoint, epouse, famille, enfants, ex femme, ex mari",
+        'procedure_divorce_contentieux': "divorce, divorcer, separation",
+        'procedure_divorce_amiable': "divorce amiable, divorce a l amiable, consentement mutuel",
+        'pension_alimentaire': "pension alimentaire",
+        'garde_enfants': "garde des enfants, garde de mes enfants, garde alternee, residence alternee, droit de visite",
+        'succession': "succession, heritage, heritier, heriter, testament, deces, decede",
+        'consultation_succession': "notaire, partage",
+        'adoption': "adoption, adopter",
+        'redaction_contrat_mariage': "contrat de mariage",
+        'procedure_changement_regime_matrimonial': "regime matrimonial",
+        'protection_majeur_vulnerable': "tutelle, curatelle, personne agee",
+        'contestation_paternite': "paternite",
+        'mediation_familiale': "mediation familiale",
+    },
+    'droit_penal': {
+        '': "plainte, police, gendarmerie, infraction, delit, casier judiciaire, tribunal correctionnel",
+        'defense_penale': "poursuivi, accuse, conduite en etat d ivresse, alcool au volant, comparution",
+        'constitution_partie_civile': "victime, porter plainte, partie civile, agression, escroquerie, vol",
+        'recours_detention_provisoire': "detention provisoire, prison, incarcere",
+        'assistance_garde_vue': "garde a vue",
+        'conseil_enquete_preliminaire': "enquete preliminaire, audition libre, convoque par la police",
+    },
+    'procédures_collectives': {
+        '': "faillite, cessation des paiements, mandataire judiciaire, difficultes financieres",
+        'liquidation': "liquidation, liquidation judiciaire",
+        'procédure_sauvegarde': "procedure de sauvegarde",
+        'procédure_redressement': "redressement judiciaire",
+        'déclaration_créance': "declaration de creance, declarer ma creance",
+    },
+    'droit_immobilier_commercial': {
+        '': "bail commercial, local commercial, baux commerciaux",
+        'redaction_bail_commercial': "bail commercial, bail 3 6 9",
+        'redaction_demande_revision_loyer': "revision du loyer",
+        'procedure_fixation_indemnite_eviction': "indemnite d eviction",
+        'redaction_demande_renouvellement': "renouvellement du bail",
+        'procedure_recouvrement_impayes': "loyers impayes",
+    },
+    "droit_de_l'immobilier": {
+        '': "proprietaire, locataire, logement, appartement, maison, terrain",
+        'trouble_anormal_voisinage': "voisin, voisinage, bruit, nuisances, empiete",
+        'litige_location_immobilière': "caution, depot de garantie, loyer, etat des lieux",
+        'expulsion_location_immobilière': "expulser, expulsion, squat, squatteur",
+        'droit_copropriété': "copropriete, syndic, charges de copropriete",
+        'litiges_vente_immobilière': "vice cache, compromis de vente, achat immobilier",
+        'création_société_civile_immobilière': "sci, societe civile immobiliere",
+        'droit_de_la_propriété': "bornage, servitude, droit de passage",
+    },
+    'droit_de_la_construction': {
+        '': "travaux, chantier, entrepreneur, artisan, construction",
+        'gestion_litiges_construction': "malfacons, malfacon, retard de chantier",
+        'contentieux_assurance_construction': "garantie decennale, decennale, dommages ouvrage",
+        'assistance_reception_travaux': "reception des travaux",
+        'conseil_permis_construire': "permis de construire",
+        'conseil_contrats_sous_traitance': "sous traitant, sous traitance",
+    },
+    'droit_des_affaires': {
+        '': "fonds de commerce, commercant, fournisseur",
+        'acquisition_fonds_commerce': "acheter un fonds de commerce, rachat de fonds de commerce",
+        'location_gérance': "location gerance",
+        'cession_entreprise': "vendre mon entreprise, ceder mon entreprise",
+        'contentieux_commercial': "litige commercial, facture impayee, factures impayees, impaye",
+        'contrats_commerciaux': "contrat commercial",
+    },
+    'droit_des_societes': {
+        '': "associe, associes, actionnaire, actionnaires, gerant, capital social",
+        'creation_societe': "creer une societe, sas, sasu, sarl, eurl, immatriculation",
+        'modification_statuts': "modifier les statuts, transfert de siege",
+        'pacte_actionnaires': "pacte d actionnaires, pacte d associes, lever des fonds, levee de fonds, investisseurs",
+        'contentieux_societaire': "conflit entre associes, abus de majorite",
+        'transmission_entreprise': "transmettre mon entreprise",
+    },
+    'droit_de_la_propriete_intellectuelle': {
+        '': "propriete intellectuelle, inpi",
+        'depot_marque': "marque, deposer une marque, logo, nom commercial",
+        'depot_brevet': "brevet, invention, breveter",
+        'protection_droit_auteur': "droit d auteur, droits d auteur, plagiat",
+        'contentieux_contrefacon': "contrefacon, sans autorisation",
+    },
+    'droit_de_la_consommation': {
+        '': "consommateur, vendeur, remboursement, rembourser",
+        'litige_consommation': "produit defectueux, arnaque, voiture d occasion, panne",
+        'contentieux_garanties': "garantie legale, garantie de conformite",
+        'conseil_vente_distance': "vente en ligne, droit de retractation, retractation",
+        'redaction_cgv': "cgv, conditions generales de vente",
+        'action_groupe': "action de groupe",
+    },
+    'droit_de_la_sante': {
+        '': "medecin, hopital, clinique, patient, soins",
+        'responsabilite_medicale': "erreur medicale, faute medicale, chirurgien, infection nosocomiale",
+        'contentieux_securite_sociale': "securite sociale, cpam, accident du travail, invalidite",
+        'contentieux_handicap': "handicap, mdph",
+        'droit_patients': "dossier medical",
+    },
+    'droit_nouvelles_technologies': {
+        '': "internet, site web, logiciel, informatique, application",
+        'protection_donnees_personnelles': "donnees personnelles, cnil",
+        'contentieux_internet': "avis negatif, harcelement en ligne, piratage, reseaux sociaux",
+        'contrats_informatiques': "contrat informatique, prestataire informatique",
+        'conformite_sites_web': "mentions legales, cookies",
+        'reglementation_ia': "intelligence artificielle",
+        'cybersecurite': "cyberattaque, fuite de donnees",
+    },
+    'droit_bancaire_financier': {
+        '': "banque, credit, pret, compte bancaire",
+        'contentieux_bancaire': "frais bancaires, frais abusifs, credit refuse, fraude bancaire",
+        'reglementation_assurance': "assureur, refus d indemnisation",
+        'lutte_blanchiment': "blanchiment",
+        'conseil_fintechs': "fintech, crypto, cryptomonnaie",
+    },
+    'droit_associations_fondations': {
+        '': "association, loi 1901, benevole, fondation",
+        'creation_association': "creer une association",
+        'conseil_dons_legs': "legs, mecenat",
+    },
+    'droit_de_la_distribution': {
+        '': "distributeur, reseau de distribution",
+        'franchise': "franchise, franchiseur, franchise",
+        'agence_commerciale': "agent commercial",
+        'rupture_relations_commerciales': "rupture brutale, relations commerciales etablies",
+    },
+    'droit_administratif': {
+        '': "mairie, prefecture, administration, commune",
+        'contentieux_etrangers': "titre de sejour, visa, oqtf, naturalisation",
+        'urbanisme_amenagement': "plan local d urbanisme, plu, urbanisme",
+        'contentieux_fiscal': "impots, redressement fiscal, controle fiscal, urssaf",
+        'fonction_publique': "fonctionnaire, fonction publique",
+        'conseil_marches_publics': "marche public, appel d offres",
+        'contentieux_administratif': "tribunal administratif",
+    },
+    'compliance': {
+        '': "conformite, compliance",
+        'programme_anticorruption': "anticorruption, corruption, sapin 2",
+        'mise_en_place_rgpd': "mise en conformite rgpd",
+        'dispositif_alerte': "lanceur d alerte",
+    },
+    'droit_civil_contrats': {
+        'redaction_conditions_generales': "conditions generales",
+        'redaction_contrat_simple': "rediger un contrat",
+    },
+}
+
+# Poids d'une occurrence selon l'origine du terme
+WEIGHT_SYNONYM_PRESTATION = 3.0
+WEIGHT_SYNONYM_DOMAIN = 2.0
+WEIGHT_LABEL = 1.0
+WEIGHT_DEFINITION = 0.5
+
+
+def stems(text: str) -> List[str]:
+    return [stem(word) for word in words(text)]
+
+
+class AhoCorasick:
+    """
+    Automate d'Aho-Corasick sur des suites de radicaux
+
+    Chaque motif est associé à une valeur ; `search` renvoie (début, fin, valeur)
+    pour chaque occurrence, chevauchements compris.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[Sequence[str], Any]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.outputs: List[List[Tuple[int, Any]]] = [[]]
+        for pattern, value in patterns:
+            state = 0
+            for symbol in pattern:
+                next_state = self.goto[state].get(symbol)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][symbol] = next_state
+                    self.goto.append({})
+                    self.outputs.append([])
+                state = next_state
+            if pattern:
+                self.outputs[state].append((len(pattern), value))
+
+        # Liens d'échec en largeur ; les sorties des suffixes sont fusionnées
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and symbol not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(symbol, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+    def search(self, symbols: Sequence[str]) -> List[Tuple[int, int, Any]]:
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        matches = []
+        state = 0
+        for position, symbol in enumerate(symbols):
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            for length, value in outputs[state]:
+                matches.append((position + 1 - length, position + 1, value))
+        return matches
+
+
+class Hints:
+    """Termes reconnus et indices pondérés par domaine et par prestation, du plus fort au plus faible"""
+    __slots__ = ('terms', 'domains', 'prestations')
+
+    def __init__(self, terms: List[str], domains: List[Tuple[str, float]], prestations: List[Tuple[str, str, float]]):
+        self.terms = terms
+        self.domains = domains
+        self.prestations = prestations
+
+    def domain_scores(self) -> Dict[str, float]:
+        return dict(self.domains)
+
+
+Target = Tuple[str, str, float]  # (domaine, prestation ou '', poids)
+
+
+class KeywordIndex:
+    """
+    Automate des termes juridiques d'une version du catalogue
+
+    Chaque motif porte ses cibles pondérées : synonymes choisis à la main
+    (SYNONYMS), termes des labels et des définitions. Le poids d'un terme du
+    catalogue est réparti entre les prestations qui l'emploient : un mot présent
+    partout (« contrat ») ne désigne presque rien, un mot rare désigne sa
+    prestation.
+    """
+
+    def __init__(self, prestations: Dict[str, Any], fingerprint: str = ''):
+        self.fingerprint = fingerprint
+        terms: Dict[Tuple[str, ...], str] = {(stem(fold(word)),): word for word in LEGAL_TERMS}
+        # Motif -> (domaine, prestation) -> poids ; un même radical venu de plusieurs sources garde le plus fort
+        targets: Dict[Tuple[str, ...], Dict[Tuple[str, str], float]] = {}
+
+        def add(phrase: str, target: Target):
+            pattern = tuple(stems(phrase))
+            if pattern:
+                terms.setdefault(pattern, phrase)
+                weights = targets.setdefault(pattern, {})
+                weights[target[:2]] = max(weights.get(target[:2], 0.0), target[2])
+
+        # Termes du catalogue, poids réparti entre les prestations qui les emploient
+        occurrences: Dict[Tuple[str, float], List[Tuple[str, str]]] = {}
+        for domaine, domaine_info in prestations.items():
+            for word in set(words(domaine_info.get('label', ''))):
+                if len(word) >= 5 and word not in GENERIC_WORDS:
+                    occurrences.setdefault((word, WEIGHT_LABEL), []).append((domaine, ''))
+            for key, info in domaine_info.get('prestations', {}).items():
+                for weight, text in ((WEIGHT_LABEL, info.get('label', '')), (WEIGHT_DEFINITION, info.get('definition', ''))):
+                    for word in set(words(text)):
+                        if len(word) >= 5 and word not in GENERIC_WORDS:
+                            occurrences.setdefault((word, weight), []).append((domaine, key))
+        for (word, weight), entries in occurrences.items():
+            for domaine, key in entries:
+                add(word, (domaine, key, weight / len(entries)))
+
+        for domaine, synonyms in SYNONYMS.items():
+            for key, phrases in synonyms.items():
+                if domaine not in prestations or (key and key not in prestations[domaine].get('prestations', {})):
+                    logger.warning(f"Synonymes ignorés, absents du catalogue : {domaine}.{key}")
+                    continue
+                weight = WEIGHT_SYNONYM_PRESTATION if key else WEIGHT_SYNONYM_DOMAIN
+                for phrase in phrases.split(','):
+                    add(phrase.strip(), (domaine, key, weight))
+
+        # Expressions de plusieurs mots du lexique (« garde a vue », « mise en demeure »)
+        for phrase in ("garde a vue", "mise en demeure", "rupture conventionnelle", "dommages interets"):
+            terms.setdefault(tuple(stems(phrase)), phrase)
+        self.automaton = AhoCorasick(
+            (pattern, (term, tuple((domaine, key, weight) for (domaine, key), weight in targets.get(pattern, {}).items())))
+            for pattern, term in terms.items()
+        )
+
+    def legal_terms(self, text: str) -> List[str]:
+        """Termes juridiques reconnus dans le texte, dans l'ordre d'apparition"""
+        return self.match(normalize(text).stems)
+
+    def match(self, question_stems: Sequence[str]) -> List[str]:
+        """Termes juridiques reconnus dans une suite de radicaux déjà calculée"""
+        return [term for _, _, (term, _) in self.automaton.search(question_stems)]
+
+    def hints(self, text: str) -> Hints:
+        """Indices de domaine et de prestation, en un seul passage sur la question"""
+        return self.hints_from_stems(normalize(text).stems)
+
+    def hints_from_stems(self, question_stems: Sequence[str]) -> Hints:
+        found: List[str] = []
+        domains: Dict[str, float] = {}
+        services: Dict[Tuple[str, str], float] = {}
+        for _, _, (term, targets) in self.automaton.search(question_stems):
+            found.append(term)
+            for domaine, key, weight in targets:
+                domains[domaine] = domains.get(domaine, 0.0) + weight
+                if key:
+                    services[(domaine, key)] = services.get((domaine, key), 0.0) + weight
+        return Hints(
+            found,
+            sorted(domains.items(), key=lambda item: item[1], reverse=True),
+            sorted(((domaine, key, score) for (domaine, key), score in services.items()), key=lambda item: item[2], reverse=True),
+        )
+
+
+_index: Optional[KeywordIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_keyword_index(catalog) -> KeywordIndex:
+    """Index de la version du catalogue, reconstruit quand son empreinte change"""
+    global _index
+    index = _index
+    if index is None or index.fingerprint != catalog.fingerprint:
+        with _index_lock:
+            if _index is None or _index.fingerprint != catalog.fingerprint:
+                _index = KeywordIndex(catalog.prestations, catalog.fingerprint)
+            index = _index
+    return index
+
+
+if __name__ == "__main__":
+    import json
+
+    from catalog_manager import get_catalog_manager
+
+    parser = argparse.ArgumentParser(description="Index de mots-clés juridiques du catalogue")
+    parser.add_argument('question', nargs='?')
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--corpus', default='classification_corpus.jsonl')
+    args = parser.parse_args()
+
+    index = get_keyword_index(get_catalog_manager().current())
+    if args.question:
+        hints = index.hints(args.question)
+        print(f"Termes : {hints.terms}")
+        print("Domaines : " + ", ".join(f"{domaine} {score:.2f}" for domaine, score in hints.domains[:3]))
+        print("Prestations : " + ", ".join(f"{domaine}.{key} {score:.2f}" for domaine, key, score in hints.prestations[:3]))
+    if args.bench:
+        with open(args.corpus, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for row in rows:
+                index.hints(row['question'])
+        elapsed = time.perf_counter() - start
+        domain_hits = prestation_hits = shortlisted = 0
+        for row in rows:
+            hints = index.hints(row['question'])
+            domain_hits += bool(hints.domains) and hints.domains[0][0] == row['domaine']
+            prestation_hits += bool(hints.prestations) and hints.prestations[0][:2] == (row['domaine'], row['prestation'])
+            shortlisted += row['domaine'] in [domaine for domaine, _ in hints.domains[:3]]
+        print(f"{len(index.automaton)} états, {elapsed / (rounds * len(rows)) * 1e6:.1f} µs/question ; "
+              f"domaine en tête {domain_hits}/{len(rows)}, dans les 3 premiers {shortlisted}/{len(rows)}, "
+              f"prestation en tête {prestation_hits}/{len(rows)}")
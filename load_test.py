@@ -0,0 +1,511 @@
+"""
+Test de charge de bout en bout : utilisateurs Streamlit simulés.
+
+app.py est lancé par `streamlit run` en mode headless, dans un répertoire de
+travail temporaire (secrets, journaux et historique de test). Chaque
+utilisateur virtuel ouvre une session comme un navigateur, par le websocket
+de Streamlit : premier rendu de la page, puis rerun avec l'urgence, une
+question du corpus annoté et le clic sur le bouton d'estimation. OpenAI et
+SMTP sont remplacés par des serveurs locaux à latence réglable.
+
+AppTest n'est pas utilisable ici : il crée et détruit le runtime Streamlit
+global à chaque exécution, deux sessions ne peuvent pas tourner en même temps
+dans un processus.
+
+Par défaut le routeur ne garde que les niveaux modèle (--tiers fast,strong) :
+le corpus rejoue 48 questions, qui seraient vite servies par le cache partagé
+et l'index local, et la mesure porterait sur des succès de cache plutôt que sur
+les threads de timeout_handler en attente du modèle. --vary-questions rend en
+outre chaque question unique (suffixe de dossier) pour tous les autres caches.
+
+Les arrivées suivent un processus de Poisson au débit --rate (ou croissant
+jusqu'à --ramp-to) ; la latence est mesurée depuis l'arrivée. Toutes les
+--interval secondes : débit, latences p50/p95/p99, sessions en cours,
+threads et RSS du serveur, taux d'erreur. Le point de saturation est le
+premier intervalle où le p95 dépasse --slo ou le taux d'erreur dépasse
+--max-error-rate.
+
+Usage :
+    python load_test.py --rate 0.5 --duration 120
+    python load_test.py --rate 0.2 --ramp-to 5 --duration 300 --progress-scale 0 --csv charge.csv
+    python load_test.py --rate 2 --duration 40 --tiers cache,local,fast,strong   # avec les caches
+"""
+import argparse
+import asyncio
+import base64
+import csv
+import json
+import logging
+import os
+import random
+import re
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+SUCCESS_MARKER = "Consultation initiale recommandée"
+REJECTED_MARKERS = ("Merci de patienter", "nombre maximum de requêtes")
+URGENCY_LABEL = "Degré d'urgence"
+VARIANT_RE = re.compile(r" \(dossier \d+\)$")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    API chat.completions locale
+
+    La classification renvoie la prestation attendue par le corpus (identifiant
+    court du prompt compilé, ou clés du prompt d'origine) ; l'analyse détaillée
+    un texte fixe. Chaque réponse attend `latency` secondes (±50 %).
+    """
+    daemon_threads = True
+
+    def __init__(self, corpus: List[Dict[str, Any]], latency: float, port: int = 0):
+        super().__init__(('127.0.0.1', port), _OpenAIHandler)
+        self.expected = {row['question']: (row['domaine'], row['prestation']) for row in corpus}
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def answer(self, messages: List[Dict[str, str]]) -> str:
+        prompt = messages[-1]['content']
+        question = re.search(r"^Question : (.*)$", prompt, re.MULTILINE)
+        if question is None or 'JSON' not in prompt:
+            return ("Votre situation a été analysée au regard des informations fournies.\n\n"
+                    '{"domaine": {"nom": "domaine", "description": "description"}, '
+                    '"prestation": {"nom": "prestation", "description": "description"}}\n\n'
+                    "Aucune source spécifique mentionnée.")
+        domaine, prestation = self.expected.get(VARIANT_RE.sub('', question.group(1).strip()), ('', ''))
+        if 'identifiant' in prompt:
+            # Prompt compilé : identifiant lu sur la ligne du domaine attendu, sinon le premier proposé
+            line = re.search(rf"^{re.escape(domaine)}: (.*)$", prompt, re.MULTILINE) if domaine else None
+            short_id = re.search(rf"(\d+) {re.escape(prestation)}(?:,|$)", line.group(1)) if line else None
+            short_id = short_id or re.search(r"^[^:\n]+: (\d+) ", prompt, re.MULTILINE)
+            result = {"est_juridique": True, "prestation": short_id.group(1), "indice_confiance": 0.85,
+                      "prestations_complementaires": []}
+        else:
+            result = {"est_juridique": True, "domaine": domaine, "prestation": prestation, "explication": "",
+                      "indice_confiance": 0.85, "prestations_complementaires": []}
+        return json.dumps(result)
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+
+    def do_GET(self):
+        self._send(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        with self.server._lock:
+            self.server.calls += 1
+        content = self.server.answer(body.get('messages', [{'content': ''}]))
+        choices = [{"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                   for i in range(body.get('n') or 1)]
+        self._send(200, {"id": "chatcmpl-charge", "object": "chat.completion", "created": int(time.time()),
+                         "model": body.get('model', ''), "choices": choices,
+                         "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+
+    def _send(self, status: int, body: Dict[str, Any]):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Serveur SMTP local sans TLS : accepte toute authentification, compte les messages"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency: float, port: int = 0):
+        super().__init__(('127.0.0.1', port), _SMTPHandler)
+        self.latency = latency
+        self.messages = 0
+        self._lock = threading.Lock()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    server: FakeSMTPServer
+
+    def _reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        self._reply("220 localhost ESMTP charge")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif command.startswith('AUTH LOGIN'):
+                for prompt in ("334 " + base64.b64encode(b"Username:").decode(), "334 " + base64.b64encode(b"Password:").decode()):
+                    self._reply(prompt)
+                    self.rfile.readline()
+                self._reply("235 Authentication successful")
+            elif command.startswith('AUTH'):
+                self._reply("235 Authentication successful")
+            elif command == 'DATA':
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                time.sleep(self.server.latency)
+                with self.server._lock:
+                    self.server.messages += 1
+                self._reply("250 OK")
+            elif command == 'QUIT':
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("250 OK")
+
+
+class StreamlitServer:
+    """`streamlit run app.py` headless, dans un répertoire de travail temporaire"""
+
+    def __init__(self, port: int, env: Dict[str, str], log_level: str):
+        self.port = port
+        self.workdir = tempfile.mkdtemp(prefix='estimia-charge-')
+        os.makedirs(os.path.join(self.workdir, '.streamlit'))
+        with open(os.path.join(self.workdir, '.streamlit', 'secrets.toml'), 'w', encoding='utf-8') as f:
+            f.write('EMAIL_TO = "charge@example.com"\n')
+        self.env = {**os.environ, **env}
+        self.log_level = log_level
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def start(self, timeout: float = 60):
+        command = [sys.executable, '-m', 'streamlit', 'run', APP_PATH, '--server.headless', 'true',
+                   '--server.port', str(self.port), '--server.fileWatcherType', 'none',
+                   '--browser.gatherUsageStats', 'false', '--logger.level', self.log_level.lower()]
+        log = open(os.path.join(self.workdir, 'streamlit.log'), 'wb')
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"streamlit s'est arrêté, voir {self.workdir}/streamlit.log")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"streamlit ne répond pas sur le port {self.port}")
+
+    def process_status(self) -> Tuple[int, float]:
+        """(threads, RSS en Mo) du processus serveur"""
+        threads, rss = 0, 0.0
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        threads = int(line.split()[1])
+                    elif line.startswith('VmRSS:'):
+                        rss = int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return threads, rss
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _Page:
+    """Ce qu'une exécution du script a rendu : widgets et messages"""
+
+    def __init__(self):
+        self.widgets: Dict[str, Any] = {}
+        self.alerts: List[Tuple[int, str]] = []
+        self.exceptions: List[str] = []
+
+    def collect(self, element):
+        kind = element.WhichOneof('type')
+        if kind in ('text_area', 'selectbox', 'button'):
+            widget = getattr(element, kind)
+            self.widgets.setdefault(kind, []).append(widget)
+        elif kind == 'alert':
+            self.alerts.append((element.alert.format, element.alert.body))
+        elif kind == 'exception':
+            self.exceptions.append(f"{element.exception.type}: {element.exception.message}")
+
+
+async def _run_script(connection, widget_states=None) -> _Page:
+    """Demande une exécution du script et lit les deltas jusqu'à sa fin"""
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+    message = BackMsg()
+    message.rerun_script.query_string = ''
+    if widget_states is not None:
+        message.rerun_script.widget_states.CopyFrom(widget_states)
+    await connection.write_message(message.SerializeToString(), binary=True)
+
+    page = _Page()
+    while True:
+        data = await connection.read_message()
+        if data is None:
+            raise ConnectionError("websocket fermé par le serveur")
+        forward = ForwardMsg.FromString(data)
+        kind = forward.WhichOneof('type')
+        if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+            page.collect(forward.delta.new_element)
+        elif kind == 'script_finished':
+            return page
+
+
+async def virtual_user(url: str, row: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Une visite : page chargée, urgence choisie, question saisie, estimation demandée
+
+    Returns:
+        (issue, détail) ; issue parmi ok, rejected, error
+    """
+    from streamlit.proto.Alert_pb2 import Alert
+    from streamlit.proto.WidgetStates_pb2 import WidgetStates
+    from tornado.websocket import websocket_connect
+
+    connection = await websocket_connect(url, subprotocols=['streamlit'], max_message_size=64 * 1024 * 1024)
+    try:
+        page = await _run_script(connection)
+        if page.exceptions:
+            return 'error', page.exceptions[0][:200]
+        states = WidgetStates()
+        state = states.widgets.add()
+        state.id = page.widgets['text_area'][0].id
+        state.string_value = row['question']
+        for selectbox in page.widgets.get('selectbox', []):
+            if selectbox.label.startswith(URGENCY_LABEL):
+                state = states.widgets.add()
+                state.id = selectbox.id
+                state.int_value = list(selectbox.options).index(row.get('urgency', 'Normal'))
+        state = states.widgets.add()
+        state.id = page.widgets['button'][0].id
+        state.trigger_value = True
+        page = await _run_script(connection, states)
+    finally:
+        connection.close()
+
+    if page.exceptions:
+        return 'error', page.exceptions[0][:200]
+    if any(kind == Alert.SUCCESS and SUCCESS_MARKER in body for kind, body in page.alerts):
+        return 'ok', ''
+    messages = [body for kind, body in page.alerts if kind in (Alert.WARNING, Alert.ERROR)]
+    if any(marker in message for message in messages for marker in REJECTED_MARKERS):
+        return 'rejected', ''
+    return 'error', (messages[0].strip()[:200] if messages else "aucune estimation affichée")
+
+
+class LoadTest:
+    """Arrivées de Poisson, sessions concurrentes et relevés par intervalle"""
+
+    def __init__(self, server: StreamlitServer, corpus: List[Dict[str, Any]], rate: float, ramp_to: Optional[float],
+                 duration: float, interval: float, timeout: float, slo: float, max_error_rate: float,
+                 vary_questions: bool = False):
+        self.server = server
+        self.corpus = corpus
+        self.vary_questions = vary_questions
+        self.rate, self.ramp_to, self.duration = rate, ramp_to, duration
+        self.interval, self.timeout = interval, timeout
+        self.slo, self.max_error_rate = slo, max_error_rate
+        self.completed: List[Tuple[float, float, str]] = []  # (arrivée, fin, issue)
+        self.in_flight = 0
+        self.errors: Dict[str, int] = {}
+        self.rows: List[Dict[str, Any]] = []
+
+    def rate_at(self, elapsed: float) -> float:
+        if self.ramp_to is None:
+            return self.rate
+        return self.rate + (self.ramp_to - self.rate) * min(elapsed / self.duration, 1.0)
+
+    async def _visit(self, row: Dict[str, Any], arrival: float):
+        self.in_flight += 1
+        try:
+            outcome, detail = await asyncio.wait_for(virtual_user(self.server.url, row), self.timeout)
+        except asyncio.TimeoutError:
+            outcome, detail = 'error', f"visite de plus de {self.timeout:.0f} s"
+        except Exception as e:
+            outcome, detail = 'error', f"{type(e).__name__}: {e}"
+        self.in_flight -= 1
+        self.completed.append((arrival, time.monotonic(), outcome))
+        if detail:
+            self.errors[detail] = self.errors.get(detail, 0) + 1
+
+    def _sample(self, start: float, since: int) -> Dict[str, Any]:
+        now = time.monotonic()
+        window = self.completed[since:]
+        latencies = [done - arrival for arrival, done, outcome in window if outcome == 'ok']
+        failures = sum(outcome == 'error' for _, _, outcome in window)
+        threads, rss = self.server.process_status()
+        row = {
+            't_s': round(now - start),
+            'rate': round(self.rate_at(now - start), 2),
+            'in_flight': self.in_flight,
+            'done': len(window),
+            'throughput': round(len(window) / self.interval, 2),
+            'ok': sum(outcome == 'ok' for _, _, outcome in window),
+            'rejected': sum(outcome == 'rejected' for _, _, outcome in window),
+            'error_rate': round(failures / len(window), 3) if window else 0.0,
+            'p50_s': round(percentile(latencies, 0.50), 2),
+            'p95_s': round(percentile(latencies, 0.95), 2),
+            'p99_s': round(percentile(latencies, 0.99), 2),
+            'threads': threads,
+            'rss_mb': round(rss),
+        }
+        self.rows.append(row)
+        print(f"{row['t_s']:>5} {row['rate']:>6} {row['in_flight']:>6} {row['throughput']:>6} {row['ok']:>4} "
+              f"{row['rejected']:>4} {row['error_rate']:>5.0%} {row['p50_s']:>6} {row['p95_s']:>6} "
+              f"{row['p99_s']:>6} {row['threads']:>7} {row['rss_mb']:>7}", flush=True)
+        return row
+
+    async def _sampler(self, start: float):
+        seen = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            self._sample(start, seen)
+            seen = len(self.completed)
+
+    async def run(self) -> List[Dict[str, Any]]:
+        print(f"{'t(s)':>5} {'arr/s':>6} {'cours':>6} {'fin/s':>6} {'ok':>4} {'rej':>4} {'err%':>5} "
+              f"{'p50':>6} {'p95':>6} {'p99':>6} {'threads':>7} {'RSS Mo':>7}")
+        start = time.monotonic()
+        sampler = asyncio.ensure_future(self._sampler(start))
+        visits = []
+        next_arrival = start
+        while next_arrival - start < self.duration:
+            await asyncio.sleep(max(0.0, next_arrival - time.monotonic()))
+            row = random.choice(self.corpus)
+            if self.vary_questions:
+                row = {**row, 'question': f"{row['question']} (dossier {len(visits) + 1})"}
+            visits.append(asyncio.ensure_future(self._visit(row, next_arrival)))
+            next_arrival += random.expovariate(max(self.rate_at(next_arrival - start), 1e-6))
+        # Fin des arrivées : les visites en cours se terminent (ou expirent)
+        await asyncio.gather(*visits)
+        sampler.cancel()
+        if len(self.completed) > sum(row['done'] for row in self.rows):
+            self._sample(start, sum(row['done'] for row in self.rows))
+        return self.rows
+
+    def summary(self, elapsed: float):
+        latencies = [done - arrival for arrival, done, outcome in self.completed if outcome == 'ok']
+        outcomes: Dict[str, int] = {}
+        for _, _, outcome in self.completed:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        print(f"\n{len(self.completed)} visites en {elapsed:.0f} s ({len(self.completed) / elapsed:.2f}/s) : {outcomes}")
+        print(f"Latence des estimations : p50 {percentile(latencies, 0.5):.2f} s, "
+              f"p95 {percentile(latencies, 0.95):.2f} s, p99 {percentile(latencies, 0.99):.2f} s")
+        print(f"Serveur : {max((row['threads'] for row in self.rows), default=0)} threads au plus, "
+              f"RSS max {max((row['rss_mb'] for row in self.rows), default=0)} Mo")
+        for detail, count in sorted(self.errors.items(), key=lambda item: -item[1])[:5]:
+            print(f"  {count} x {detail}")
+        saturated = next((row for row in self.rows
+                          if row['done'] and (row['p95_s'] > self.slo or row['error_rate'] > self.max_error_rate)), None)
+        if saturated:
+            print(f"Saturation à t={saturated['t_s']} s, {saturated['rate']} arrivées/s "
+                  f"(p95 {saturated['p95_s']} s, erreurs {saturated['error_rate']:.0%}, {saturated['threads']} threads)")
+        else:
+            print(f"Pas de saturation (p95 <= {self.slo} s, erreurs <= {self.max_error_rate:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de app.py avec des utilisateurs simulés")
+    parser.add_argument('--rate', type=float, default=0.5, help="Arrivées par seconde")
+    parser.add_argument('--ramp-to', type=float, help="Débit d'arrivée atteint en fin de test (rampe linéaire)")
+    parser.add_argument('--duration', type=float, default=60, help="Durée des arrivées (s)")
+    parser.add_argument('--interval', type=float, default=5, help="Période des relevés (s)")
+    parser.add_argument('--corpus', default='classification_corpus.jsonl')
+    parser.add_argument('--tiers', default='fast,strong',
+                        help="Niveaux du routeur (ROUTER_TIERS) ; cache,local,fast,strong pour mesurer avec les caches")
+    parser.add_argument('--vary-questions', action='store_true', help="Question unique à chaque visite")
+    parser.add_argument('--port', type=int, default=8599, help="Port du serveur Streamlit testé")
+    parser.add_argument('--llm-latency', type=float, default=0.8, help="Latence moyenne de l'API simulée (s)")
+    parser.add_argument('--smtp-latency', type=float, default=0.3, help="Durée d'un envoi SMTP simulé (s)")
+    parser.add_argument('--progress-scale', type=float, default=1.0, help="Échelle de l'animation de progression")
+    parser.add_argument('--timeout', type=float, default=120, help="Délai maximal d'une visite (s)")
+    parser.add_argument('--slo', type=float, default=30, help="p95 au-delà duquel l'instance est saturée (s)")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--csv', help="Relevés par intervalle au format CSV")
+    parser.add_argument('--log-level', default='WARNING', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    openai_server = FakeOpenAIServer(corpus, args.llm_latency)
+    smtp_server = FakeSMTPServer(args.smtp_latency)
+    for fake in (openai_server, smtp_server):
+        threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    server = StreamlitServer(args.port, {
+        'OPENAI_API_KEY': 'sk-charge',
+        'OPENAI_BASE_URL': openai_server.url,
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(smtp_server.server_address[1]),
+        'SMTP_STARTTLS': '0',
+        'EMAIL_FROM': 'estimia@example.com',
+        'EMAIL_PASSWORD': 'charge',
+        'PROGRESS_TIME_SCALE': str(args.progress_scale),
+        'MAX_GLOBAL_REQUESTS': str(10 ** 9),
+        'ROUTER_TIERS': args.tiers,
+        # Toutes les sessions viennent de 127.0.0.1 et rejouent le corpus : pas de refus pour doublon
+        'PREFILTER_DUP_MAX': '0',
+        'HEALTH_PORT': os.getenv('HEALTH_PORT', '0'),
+    }, args.log_level)
+    ramp = f" -> {args.ramp_to}" if args.ramp_to is not None else ""
+    print(f"Charge : {args.rate}{ramp} arrivées/s pendant {args.duration:.0f} s, API {args.llm_latency} s, "
+          f"SMTP {args.smtp_latency} s, animation x{args.progress_scale} (serveur dans {server.workdir})")
+    server.start()
+    try:
+        test = LoadTest(server, corpus, args.rate, args.ramp_to, args.duration, args.interval, args.timeout,
+                        args.slo, args.max_error_rate, args.vary_questions)
+        start = time.monotonic()
+        rows = asyncio.run(test.run())
+        test.summary(time.monotonic() - start)
+        print(f"Appels API : {openai_server.calls} ({openai_server.calls / max(len(test.completed), 1):.2f} par visite, "
+              f"niveaux {args.tiers}), emails : {smtp_server.messages}")
+    finally:
+        server.stop()
+
+    if args.csv and rows:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Journalisation structurée et non bloquante.
+
+Les appels logger.* ne font que déposer l'enregistrement dans une file
+(QueueHandler) ; un QueueListener dédié formate les lignes JSON, les écrit sur
+disque et gère la rotation/compression hors du thread de la requête.
+
+Chaque ligne JSON porte l'identifiant de la requête en cours (contextvar
+positionné par set_request_id) et les champs passés via extra={'fields': {...}}.
+Les charges verbeuses (extra={'payload': ...}) sont échantillonnées et tronquées.
+
+Variables d'environnement :
+    LOG_FILE                 fichier de log (app.log)
+    LOG_MAX_BYTES            taille avant rotation (10 Mo)
+    LOG_ROTATE_SECONDS       âge maximal d'un fichier avant rotation (86400, 0 = désactivé)
+    LOG_BACKUP_COUNT         nombre de fichiers conservés (10)
+    LOG_COMPRESS             compression gzip des fichiers tournés (true)
+    LOG_PAYLOAD_SAMPLE_RATE  proportion de charges verbeuses conservées (0.05)
+    LOG_PAYLOAD_MAX_CHARS    longueur maximale d'une charge journalisée (2000)
+"""
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar('request_id', default='-')
+
+# Attributs standard d'un LogRecord, exclus du JSON
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def set_request_id(request_id: Optional[str] = None) -> str:
+    """Positionne l'identifiant de la requête courante et le retourne"""
+    request_id = request_id or uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    return request_id
+
+
+class RequestIdFilter(logging.Filter):
+    """Capture l'identifiant de requête sur le thread appelant"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class PayloadSampler(logging.Filter):
+    """Échantillonne et tronque les enregistrements porteurs d'une charge verbeuse"""
+
+    def __init__(self, rate: float, max_chars: int):
+        super().__init__()
+        self.rate = rate
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        payload = getattr(record, 'payload', None)
+        if payload is None:
+            return True
+        if random.random() >= self.rate:
+            return False
+        payload = str(payload)
+        if len(payload) > self.max_chars:
+            payload = payload[:self.max_chars] + f"... [{len(payload) - self.max_chars} caractères tronqués]"
+        record.payload = payload
+        record.sampled = self.rate
+        return True
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formate un enregistrement en une ligne JSON compacte"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key == 'fields' and isinstance(value, dict):
+                entry.update(value)
+            elif key not in _RESERVED and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler qui ne formate pas le message sur le thread appelant :
+    seules la fusion des arguments et la trace d'exception sont figées.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """Rotation à la taille ou à l'âge du fichier, avec compression optionnelle"""
+
+    def __init__(self, filename: str, max_bytes: int, rotate_seconds: int, backup_count: int, compress: bool):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.rotate_seconds = rotate_seconds
+        self.next_rollover = time.time() + rotate_seconds
+        if compress:
+            self.namer = lambda name: name + '.gz'
+            self.rotator = _gzip_rotator
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rotate_seconds and time.time() >= self.next_rollover and os.path.exists(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.next_rollover = time.time() + self.rotate_seconds
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Installe le pipeline de journalisation sur le logger racine
+
+    Idempotent : le script Streamlit est ré-exécuté à chaque rerun, le
+    pipeline n'est installé qu'une fois par processus.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = SizeAndTimeRotatingFileHandler(
+        os.getenv('LOG_FILE', 'app.log'),
+        max_bytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+        rotate_seconds=int(os.getenv('LOG_ROTATE_SECONDS', '86400')),
+        backup_count=int(os.getenv('LOG_BACKUP_COUNT', '10')),
+        compress=os.getenv('LOG_COMPRESS', 'true').lower() == 'true'
+    )
+    file_handler.setFormatter(JsonLineFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(PayloadSampler(
+        rate=float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.05')),
+        max_chars=int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000'))
+    ))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Vide la file et arrête le thread d'écriture"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
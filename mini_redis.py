@@ -0,0 +1,276 @@
+"""
+Serveur minimal parlant le protocole Redis (RESP), pour les essais locaux.
+
+Il couvre les commandes utilisées par shared_state.RedisBackend (chaînes,
+compteurs, ensembles triés, expirations, MULTI/EXEC) sans persistance : de quoi
+faire tourner plusieurs répliques de l'application contre un état commun sans
+installer Redis.
+
+Usage :
+    python mini_redis.py --port 6390
+    STATE_BACKEND_URL=redis://127.0.0.1:6390 streamlit run app.py
+"""
+import argparse
+import bisect
+import logging
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared_state import RedisReplyError, read_reply
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_reply(value: Any) -> bytes:
+    if isinstance(value, RedisReplyError):
+        return b'-%s\r\n' % str(value).encode('utf-8')
+    if isinstance(value, _Status):
+        return b'+%s\r\n' % value.text.encode('utf-8')
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool):
+        return b':%d\r\n' % int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_encode_reply(item) for item in value)
+    data = value if isinstance(value, bytes) else str(value).encode('utf-8')
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+class _Status:
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+OK = _Status('OK')
+QUEUED = _Status('QUEUED')
+
+
+def _score(raw: bytes) -> float:
+    text = raw.decode('utf-8').lower()
+    return {'-inf': float('-inf'), '+inf': float('inf'), 'inf': float('inf')}.get(text) or float(text)
+
+
+def _format_score(score: float) -> str:
+    return str(int(score)) if score == int(score) else repr(score)
+
+
+class ZSet:
+    """Ensemble trié : membres ordonnés par (score, membre)"""
+    __slots__ = ('scores', 'order')
+
+    def __init__(self):
+        self.scores: Dict[bytes, float] = {}
+        self.order: List[Tuple[float, bytes]] = []
+
+    def add(self, score: float, member: bytes) -> int:
+        previous = self.scores.get(member)
+        if previous is not None:
+            self.order.remove((previous, member))
+        self.scores[member] = score
+        bisect.insort(self.order, (score, member))
+        return int(previous is None)
+
+    def remove(self, member: bytes) -> int:
+        score = self.scores.pop(member, None)
+        if score is None:
+            return 0
+        self.order.remove((score, member))
+        return 1
+
+    def remove_range(self, low: float, high: float) -> int:
+        start = bisect.bisect_left(self.order, (low, b''))
+        end = start
+        while end < len(self.order) and self.order[end][0] <= high:
+            end += 1
+        for _, member in self.order[start:end]:
+            del self.scores[member]
+        del self.order[start:end]
+        return end - start
+
+
+class MiniRedis:
+    """Données et exécution des commandes, protégées par un verrou unique"""
+
+    def __init__(self):
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key: bytes) -> Any:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return self.data.get(key)
+
+    def _zset(self, key: bytes, create: bool = False) -> Optional[ZSet]:
+        value = self._live(key)
+        if value is None and create:
+            value = self.data[key] = ZSet()
+        if value is not None and not isinstance(value, ZSet):
+            raise RedisReplyError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def execute(self, args: List[bytes]) -> Any:
+        with self.lock:
+            try:
+                return self._execute(args[0].upper().decode('utf-8'), args[1:])
+            except RedisReplyError as e:
+                return e
+            except (ValueError, IndexError) as e:
+                return RedisReplyError(f"ERR {e}")
+
+    def _execute(self, command: str, args: List[bytes]) -> Any:
+        if command == 'PING':
+            return _Status('PONG')
+        if command in ('AUTH', 'SELECT'):
+            return OK
+        if command == 'GET':
+            value = self._live(args[0])
+            if isinstance(value, ZSet):
+                raise RedisReplyError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            return value
+        if command == 'MGET':
+            return [value if isinstance(value, bytes) else None for value in map(self._live, args)]
+        if command == 'SET':
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            if b'NX' in options and self._live(key) is not None:
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            for unit, factor in ((b'PX', 0.001), (b'EX', 1.0)):
+                if unit in options:
+                    self.expires[key] = time.time() + int(args[2 + options.index(unit) + 1]) * factor
+            return OK
+        if command in ('INCR', 'INCRBY'):
+            key = args[0]
+            value = int(self._live(key) or 0) + (int(args[1]) if command == 'INCRBY' else 1)
+            self.data[key] = str(value).encode('utf-8')
+            return value
+        if command == 'DEL':
+            removed = 0
+            for key in args:
+                removed += self._live(key) is not None
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return removed
+        if command == 'PEXPIRE':
+            if self._live(args[0]) is None:
+                return 0
+            self.expires[args[0]] = time.time() + int(args[1]) / 1000
+            return 1
+        if command == 'PTTL':
+            if self._live(args[0]) is None:
+                return -2
+            expires = self.expires.get(args[0])
+            return -1 if expires is None else int((expires - time.time()) * 1000)
+        if command == 'ZADD':
+            zset = self._zset(args[0], create=True)
+            return sum(zset.add(_score(args[i]), args[i + 1]) for i in range(1, len(args), 2))
+        if command == 'ZREM':
+            zset = self._zset(args[0])
+            return sum(zset.remove(member) for member in args[1:]) if zset else 0
+        if command == 'ZCARD':
+            zset = self._zset(args[0])
+            return len(zset.order) if zset else 0
+        if command == 'ZREMRANGEBYSCORE':
+            zset = self._zset(args[0])
+            return zset.remove_range(_score(args[1]), _score(args[2])) if zset else 0
+        if command == 'ZRANGE':
+            zset = self._zset(args[0])
+            if not zset:
+                return []
+            start, stop = int(args[1]), int(args[2])
+            items = zset.order[start:None if stop == -1 else stop + 1]
+            if len(args) > 3 and args[3].upper() == b'WITHSCORES':
+                return [value for score, member in items for value in (member, _format_score(score))]
+            return [member for _, member in items]
+        if command == 'DBSIZE':
+            return sum(self._live(key) is not None for key in list(self.data))
+        if command == 'FLUSHALL':
+            self.data.clear()
+            self.expires.clear()
+            return OK
+        raise RedisReplyError(f"ERR unknown command '{command}'")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Réponses d'un pipeline envoyées sans attendre l'accusé de réception de la précédente
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        store: MiniRedis = self.server.store
+        queued: Optional[List[List[bytes]]] = None
+        while True:
+            try:
+                args = read_reply(self.rfile)
+            except Exception:
+                return
+            if not isinstance(args, list) or not args:
+                return
+            command = args[0].upper()
+            if command == b'MULTI':
+                queued, reply = [], OK
+            elif command == b'EXEC':
+                if queued is None:
+                    reply = RedisReplyError("ERR EXEC without MULTI")
+                else:
+                    # Transaction : exécutée sans entrelacement avec les autres connexions
+                    with store.lock:
+                        reply = []
+                        for queued_args in queued:
+                            try:
+                                reply.append(store._execute(queued_args[0].upper().decode('utf-8'), queued_args[1:]))
+                            except RedisReplyError as e:
+                                reply.append(e)
+                            except (ValueError, IndexError) as e:
+                                reply.append(RedisReplyError(f"ERR {e}"))
+                    queued = None
+            elif command == b'DISCARD':
+                queued, reply = None, OK
+            elif queued is not None:
+                queued.append(args)
+                reply = QUEUED
+            else:
+                reply = store.execute(args)
+            self.wfile.write(_encode_reply(reply))
+
+
+class MiniRedisServer(socketserver.ThreadingTCPServer):
+    """Serveur RESP dans un thread, une connexion par thread client"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6390):
+        super().__init__((host, port), _Handler)
+        self.store = MiniRedis()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> 'MiniRedisServer':
+        threading.Thread(target=self.serve_forever, name='mini-redis', daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur minimal au protocole Redis")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MiniRedisServer(args.host, args.port)
+    logger.info(f"Serveur RESP à l'écoute sur {server.url}")
+    server.serve_forever()
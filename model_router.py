@@ -0,0 +1,273 @@
+"""
+Routage de la classification vers le niveau le moins coûteux suffisant.
+
+Les niveaux sont essayés dans l'ordre (ROUTER_TIERS) :
+
+    - cache  : classification déjà obtenue pour la même question, le même
+               client et la même urgence, par n'importe quelle réplique
+               (invalidé à chaque nouvelle version du catalogue) ;
+    - local  : index TF-IDF des définitions, retenu seulement si la meilleure
+               prestation se détache nettement (score et écart minimaux) ;
+    - fast   : petit modèle (OPENAI_FAST_MODEL) ;
+    - strong : grand modèle (OPENAI_STRONG_MODEL), sollicité seulement si le
+               résultat précédent est hors catalogue ou d'une confiance
+               calibrée inférieure à ROUTER_ESCALATE_BELOW.
+
+Si aucun niveau ne donne de classification (API injoignable, réponses
+illisibles), la question est classée hors ligne par les indices de mots-clés
+(keyword_index), avec une confiance plafonnée, pourvu que le domaine en tête
+atteigne ROUTER_OFFLINE_MIN_SCORE (ROUTER_OFFLINE=0 désactive ce repli).
+
+Les décisions (niveau retenu, escalades) et le temps gagné par rapport au
+grand modèle sont comptés par domaine et exposés par le serveur de santé.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import health
+from calibration import get_calibrator
+from catalog_manager import CatalogVersion, get_catalog_manager
+from keyword_index import get_keyword_index
+from normalization import normalize
+from shared_state import StateBackendError, get_state_backend
+
+logger = logging.getLogger(__name__)
+
+OPENAI_FAST_MODEL = os.getenv('OPENAI_FAST_MODEL', 'gpt-4o-mini')
+OPENAI_STRONG_MODEL = os.getenv('OPENAI_STRONG_MODEL', 'gpt-4o')
+ROUTER_TIERS = tuple(tier.strip() for tier in os.getenv('ROUTER_TIERS', 'cache,local,fast,strong').split(',') if tier.strip())
+ROUTER_LOCAL_MIN_SCORE = float(os.getenv('ROUTER_LOCAL_MIN_SCORE', '0.6'))
+ROUTER_LOCAL_MIN_MARGIN = float(os.getenv('ROUTER_LOCAL_MIN_MARGIN', '0.2'))
+ROUTER_ESCALATE_BELOW = float(os.getenv('ROUTER_ESCALATE_BELOW', '0.5'))
+ROUTER_CACHE_TTL = float(os.getenv('ROUTER_CACHE_TTL', '86400'))
+ROUTER_OFFLINE = os.getenv('ROUTER_OFFLINE', '1') == '1'
+ROUTER_OFFLINE_MIN_SCORE = float(os.getenv('ROUTER_OFFLINE_MIN_SCORE', '2.0'))
+ROUTER_OFFLINE_MAX_CONFIDENCE = float(os.getenv('ROUTER_OFFLINE_MAX_CONFIDENCE', '0.5'))
+# Latence de référence du grand modèle tant qu'aucun appel n'a été mesuré
+STRONG_LATENCY_PRIOR_MS = 4000.0
+
+Classification = Dict[str, Any]
+
+
+def cache_key(question: str, client_type: str, urgency: str) -> Tuple[str, str, str]:
+    return normalize(question).canonical, client_type, urgency
+
+
+class ClassificationCache:
+    """
+    Classifications acceptées, tenues par l'état partagé (communes aux répliques)
+
+    Les clés incluent l'empreinte du catalogue : une nouvelle version rend les
+    entrées précédentes inaccessibles, elles expirent ensuite d'elles-mêmes.
+    Un backend injoignable se comporte comme un cache vide.
+    """
+
+    def __init__(self, ttl: float = ROUTER_CACHE_TTL, namespace: str = 'classification'):
+        self.ttl = ttl
+        self.namespace = namespace
+
+    def _key(self, key: Tuple[str, ...]) -> str:
+        return f"{self.namespace}:{hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()[:32]}"
+
+    def get(self, key: Tuple[str, ...]) -> Optional[Classification]:
+        try:
+            classification = get_state_backend().get(self._key(key))
+        except StateBackendError as e:
+            logger.warning(f"Cache de classification indisponible : {e}")
+            return None
+        if classification is not None:
+            # Les candidats reviennent en listes après sérialisation JSON
+            classification['candidates'] = [tuple(candidate) for candidate in classification.get('candidates', [])]
+        return classification
+
+    def put(self, key: Tuple[str, ...], classification: Classification):
+        try:
+            get_state_backend().set(self._key(key), classification, ttl=self.ttl)
+        except StateBackendError as e:
+            logger.warning(f"Cache de classification indisponible : {e}")
+
+
+class RoutingStats:
+    """Décisions de routage et temps gagné, par domaine"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers: Dict[str, Counter] = defaultdict(Counter)
+        self._escalations: Counter = Counter()
+        self._saved_ms: Counter = Counter()
+        self._latency_ms: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])  # niveau -> [appels, cumul]
+
+    def strong_latency_ms(self) -> float:
+        calls, total = self._latency_ms.get('strong', (0, 0.0))
+        return total / calls if calls else STRONG_LATENCY_PRIOR_MS
+
+    def record(self, domaine: str, tier: str, latency_ms: float, escalations: int):
+        with self._lock:
+            self._tiers[domaine][tier] += 1
+            self._escalations[domaine] += escalations
+            latency = self._latency_ms[tier]
+            latency[0] += 1
+            latency[1] += latency_ms
+            if tier != 'strong':
+                self._saved_ms[domaine] += max(self.strong_latency_ms() - latency_ms, 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'domains': {
+                    domaine: {
+                        'tiers': dict(tiers),
+                        'escalations': self._escalations[domaine],
+                        'saved_ms': round(self._saved_ms[domaine]),
+                    }
+                    for domaine, tiers in self._tiers.items()
+                },
+                'mean_latency_ms': {tier: round(total / calls, 1) for tier, (calls, total) in self._latency_ms.items() if calls},
+            }
+
+
+class ModelRouter:
+    """Essaie les niveaux du moins coûteux au plus coûteux"""
+
+    def __init__(self, tiers: Tuple[str, ...] = ROUTER_TIERS):
+        self.tiers = tiers
+        self.cache = ClassificationCache()
+        self.stats = RoutingStats()
+
+    def on_catalog_swap(self, old: CatalogVersion, new: CatalogVersion):
+        # Les clés portent l'empreinte du catalogue : rien à vider, seulement à signaler
+        logger.info(f"Cache de classification renouvelé (catalogue v{new.version})")
+
+    @staticmethod
+    def in_catalog(catalog: CatalogVersion, classification: Classification) -> bool:
+        domaine_info = catalog.prestations.get(classification.get('domaine'))
+        return bool(domaine_info) and classification.get('prestation') in domaine_info.get('prestations', {})
+
+    @staticmethod
+    def local_classification(catalog: CatalogVersion, question: str) -> Optional[Classification]:
+        """
+        Prestation la plus proche, si elle se détache nettement de la suivante
+
+        La similarité tient lieu d'indice de confiance pour la calibration.
+        """
+        top = catalog.retrieval_index.top(question, 2)
+        if not top:
+            return None
+        domaine, prestation, score = top[0]
+        margin = score - (top[1][2] if len(top) > 1 else 0.0)
+        if score < ROUTER_LOCAL_MIN_SCORE or margin < ROUTER_LOCAL_MIN_MARGIN:
+            return None
+        return {
+            'domaine': domaine, 'prestation': prestation, 'confidence': score, 'is_relevant': True,
+            'candidates': [(domaine, prestation, 1.0)], 'agreement': 1.0,
+        }
+
+    @staticmethod
+    def offline_classification(catalog: CatalogVersion, question: str) -> Optional[Classification]:
+        """
+        Classement sans modèle : domaine en tête des indices de mots-clés, puis sa
+        prestation la mieux désignée (indices et similarité des définitions)
+        """
+        hints = get_keyword_index(catalog).hints(question)
+        if not hints.domains or hints.domains[0][1] < ROUTER_OFFLINE_MIN_SCORE:
+            return None
+        domaine, score = hints.domains[0]
+        ranking = {key: score for hinted, key, score in hints.prestations if hinted == domaine}
+        index = catalog.retrieval_index
+        for (entry_domaine, key), similarity in zip(index.entries, index.scores(question)):
+            if entry_domaine == domaine:
+                ranking[key] = ranking.get(key, 0.0) + float(similarity)
+        prestation = max(ranking, key=ranking.get)
+        share = score / sum(domain_score for _, domain_score in hints.domains)
+        return {
+            'domaine': domaine, 'prestation': prestation, 'confidence': ROUTER_OFFLINE_MAX_CONFIDENCE * share,
+            'is_relevant': True, 'candidates': [(domaine, prestation, 1.0)], 'agreement': share,
+        }
+
+    def accept(self, catalog: CatalogVersion, question: str, classification: Classification) -> bool:
+        """Résultat dans le catalogue et de confiance calibrée suffisante"""
+        if not self.in_catalog(catalog, classification):
+            return False
+        retrieval_score = catalog.retrieval_index.score(question, classification['domaine'], classification['prestation'])
+        confidence = get_calibrator().calibrate(classification['confidence'], retrieval_score, classification['agreement'])
+        return confidence >= ROUTER_ESCALATE_BELOW
+
+    def route(self, catalog: CatalogVersion, question: str, client_type: str, urgency: str,
+              classify: Callable[[str], Optional[Classification]]) -> Optional[Classification]:
+        """
+        Classe la question au premier niveau suffisant
+
+        Args:
+            classify: appel au modèle dont le nom est passé en argument
+
+        Returns:
+            Classification complétée du niveau retenu ('tier') et du nombre d'escalades
+            ('escalations'), ou None
+        """
+        start = time.perf_counter()
+        key = (catalog.fingerprint, *cache_key(question, client_type, urgency))
+        fallback: Optional[Classification] = None
+        escalations = 0
+        # Seule une réponse de modèle acceptée (ou du dernier niveau) est mise en cache :
+        # un repli rejeté servi depuis le cache ne serait plus jamais escaladé
+        cacheable = False
+
+        for tier in self.tiers:
+            if tier == 'cache':
+                classification = self.cache.get(key)
+                accepted = classification is not None
+            elif tier == 'local':
+                classification = self.local_classification(catalog, question)
+                accepted = classification is not None
+            elif tier in ('fast', 'strong'):
+                classification = classify(OPENAI_FAST_MODEL if tier == 'fast' else OPENAI_STRONG_MODEL)
+                accepted = classification is not None and (tier == self.tiers[-1] or self.accept(catalog, question, classification))
+                if classification is not None and not accepted:
+                    escalations += 1
+                    logger.info(f"Escalade après le niveau {tier} : {classification['domaine']}.{classification['prestation']}")
+            else:
+                logger.error(f"Niveau de routage inconnu : {tier}")
+                continue
+
+            if classification is not None and (fallback is None or self.in_catalog(catalog, classification)):
+                fallback = {**classification, 'tier': tier}
+            if accepted:
+                cacheable = tier in ('fast', 'strong') and fallback is not None and fallback['tier'] == tier
+                break
+
+        if fallback is None and ROUTER_OFFLINE:
+            classification = self.offline_classification(catalog, question)
+            if classification is not None:
+                logger.warning(f"Aucun modèle disponible, classement hors ligne : "
+                               f"{classification['domaine']}.{classification['prestation']}")
+                fallback = {**classification, 'tier': 'offline'}
+        if fallback is None:
+            return None
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.stats.record(fallback['domaine'] or '', fallback['tier'], latency_ms, escalations)
+        if cacheable and self.in_catalog(catalog, fallback):
+            self.cache.put(key, fallback)
+        return {**fallback, 'escalations': escalations}
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Routeur unique par processus, son cache est abonné aux changements de catalogue"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                router = ModelRouter()
+                get_catalog_manager().on_swap('classification_cache', router.on_catalog_swap)
+                health.register_check('routing', router.stats.snapshot)
+                _router = router
+    return _router
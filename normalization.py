@@ -0,0 +1,175 @@
+"""
+Forme canonique des questions, commune au cache, au classement et au journal.
+
+Une question est normalisée une seule fois par requête : `normalize` garde en
+mémoire les NORMALIZATION_CACHE_SIZE dernières questions, chaque consommateur
+(filtre local, index de mots-clés, index TF-IDF, cache de classification,
+historique) relit le même résultat au lieu de refaire son propre découpage.
+
+Étapes :
+    - repliement : minuscules, accents retirés (table de traduction pour
+      l'alphabet latin, décomposition Unicode pour le reste), ligatures œ/æ ;
+    - mots : suites de lettres et de chiffres ;
+    - radicaux : racinisation légère (pluriel retiré, mot tronqué à
+      STEM_LENGTH lettres) : licencier, licencié, licenciement -> licenci ;
+    - mots pleins : sans mots-outils français ni mots de moins de 3 lettres ;
+    - empreinte simhash (64 bits) des radicaux des mots pleins : deux questions
+      presque identiques (exemple recopié puis retouché) ont des empreintes
+      distantes de quelques bits seulement.
+
+Usage :
+    python normalization.py "Mon employeur veut me licencier"   # forme normalisée
+    python normalization.py --bench                              # questions/s (seuil 10 000)
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+NORMALIZATION_CACHE_SIZE = int(os.getenv('NORMALIZATION_CACHE_SIZE', '1024'))
+# Distance de Hamming maximale entre empreintes de deux questions « presque identiques »
+NEAR_DUPLICATE_BITS = int(os.getenv('NEAR_DUPLICATE_BITS', '10'))
+STEM_LENGTH = 7
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+au aux avec ce ces dans de des du elle en et eux il je la le les leur lui ma mais me meme mes moi mon ne nos notre
+nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos votre vous est sont etre
+cette cet afin ainsi lors dont tout tous toute toutes entre sans sous leurs ou plus peut
+""".split())
+
+
+def _fold_table() -> Dict[int, str]:
+    """Lettres latines accentuées (minuscules) -> lettres de base, ligatures développées"""
+    table = {}
+    for code in range(0xC0, 0x250):
+        char = chr(code).lower()
+        if len(char) != 1:
+            continue
+        base = ''.join(part for part in unicodedata.normalize('NFKD', char) if not unicodedata.combining(part))
+        if base != char:
+            table[ord(char)] = base
+    table.update({ord('œ'): 'oe', ord('æ'): 'ae'})
+    return table
+
+
+_FOLD_TABLE = _fold_table()
+
+
+def fold(text: str) -> str:
+    """Minuscules sans accents"""
+    folded = text.lower().translate(_FOLD_TABLE)
+    if folded.isascii():
+        return folded
+    # Autres écritures, formes de compatibilité, accents déjà décomposés
+    folded = unicodedata.normalize('NFKD', folded)
+    return ''.join(char for char in folded if not unicodedata.combining(char))
+
+
+def stem(word: str) -> str:
+    """Radical léger d'un mot replié : pluriel retiré, tronqué à STEM_LENGTH lettres"""
+    if len(word) > 4 and word[-1] in 'sx':
+        word = word[:-1]
+    return word[:STEM_LENGTH]
+
+
+def words(text: str) -> List[str]:
+    return _WORD_RE.findall(fold(text))
+
+
+def content_words(folded_words: Sequence[str]) -> List[str]:
+    return [word for word in folded_words if len(word) > 2 and word not in STOPWORDS]
+
+
+@lru_cache(maxsize=65536)
+def _stem_bits(token: str) -> np.ndarray:
+    """Contribution ±1 d'un radical à chacun des 64 bits de l'empreinte"""
+    value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    return np.unpackbits(np.frombuffer(value.to_bytes(8, 'little'), dtype=np.uint8), bitorder='little').astype(np.int16) * 2 - 1
+
+
+def simhash(tokens: Sequence[str]) -> int:
+    """Empreinte simhash 64 bits d'un ensemble de radicaux (0 si vide)"""
+    unique = set(tokens)
+    if not unique:
+        return 0
+    total = np.sum([_stem_bits(token) for token in unique], axis=0)
+    return int.from_bytes(np.packbits(total > 0, bitorder='little').tobytes(), 'little')
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class NormalizedQuestion:
+    """Formes d'une question partagées par tous les consommateurs (lecture seule)"""
+    __slots__ = ('text', 'folded', 'words', 'stems', 'tokens', 'canonical', 'simhash')
+
+    def __init__(self, text: str):
+        self.text = ' '.join(text.split())
+        self.folded = fold(self.text)
+        self.words: Tuple[str, ...] = tuple(_WORD_RE.findall(self.folded))
+        self.stems: Tuple[str, ...] = tuple(stem(word) for word in self.words)
+        self.tokens: Tuple[str, ...] = tuple(content_words(self.words))
+        # Clé de cache : casse, accents, ponctuation et espaces sans effet
+        self.canonical = ' '.join(self.words)
+        self.simhash = simhash([stem(token) for token in self.tokens])
+
+    def near_duplicate(self, other: 'NormalizedQuestion', max_bits: int = NEAR_DUPLICATE_BITS) -> bool:
+        """Même question aux retouches près (mots ajoutés, retirés ou changés)"""
+        if not self.tokens or not other.tokens:
+            return self.canonical == other.canonical
+        return hamming(self.simhash, other.simhash) <= max_bits
+
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize(text: str) -> NormalizedQuestion:
+    """Question normalisée, calculée une fois puis partagée"""
+    return NormalizedQuestion(text or '')
+
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description="Normalisation des questions")
+    parser.add_argument('question', nargs='?')
+    parser.add_argument('--compare', metavar='AUTRE', help="distance des empreintes avec une autre question")
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--corpus', default='classification_corpus.jsonl')
+    parser.add_argument('--min-rate', type=float, default=10000.0)
+    args = parser.parse_args()
+
+    if args.question:
+        normalized = normalize(args.question)
+        for field in ('folded', 'canonical', 'stems', 'tokens'):
+            print(f"{field:<10}: {getattr(normalized, field)}")
+        print(f"{'simhash':<10}: {normalized.simhash:016x}")
+        if args.compare:
+            other = normalize(args.compare)
+            print(f"distance  : {hamming(normalized.simhash, other.simhash)} bits "
+                  f"({'presque identiques' if normalized.near_duplicate(other) else 'différentes'})")
+    if args.bench:
+        with open(args.corpus, encoding='utf-8') as f:
+            questions = [json.loads(line)['question'] for line in f if line.strip()]
+        # Variantes distinctes : le cache de normalize ne sert pas, seul le calcul est mesuré
+        variants = [f"{question} (cas {i})" for i in range(200) for question in questions]
+        start = time.perf_counter()
+        for variant in variants:
+            NormalizedQuestion(variant)
+        rate = len(variants) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(200):
+            for question in questions:
+                normalize(question)
+        cached = 200 * len(questions) / (time.perf_counter() - start)
+        print(f"{rate:,.0f} questions/s (sans cache), {cached:,.0f} questions/s (réutilisation dans la requête)")
+        if rate < args.min_rate:
+            print(f"Débit inférieur au seuil de {args.min_rate:,.0f} questions/s")
+            sys.exit(1)
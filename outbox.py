@@ -0,0 +1,276 @@
+"""
+Boîte d'envoi durable des emails (SQLite en mode WAL).
+
+Les messages (formulaire de contact, journal des questions) sont écrits dans
+la table `outbox` puis acquittés aussitôt ; un thread de livraison les envoie
+par SMTP, avec reprises espacées (OUTBOX_RETRY_DELAY x 2^tentatives) jusqu'à
+OUTBOX_MAX_ATTEMPTS. Un serveur de messagerie lent ne bloque donc plus la page.
+
+Chaque message porte une clé d'idempotence : un double clic ou un nouvel envoi
+du même formulaire retrouve le message déjà enregistré au lieu d'en créer un
+second. La référence renvoyée à l'utilisateur permet de suivre la livraison.
+
+Plusieurs processus peuvent partager le fichier : un message est réservé dans
+une transaction BEGIN IMMEDIATE (« sending », bail de OUTBOX_LEASE secondes
+porté par next_attempt) et n'est envoyé que par le processus qui l'a réservé.
+Un message resté « sending » au-delà de son bail (processus arrêté en cours
+d'envoi) est repris par un autre worker : la livraison est « au moins une fois ».
+
+Usage :
+    python outbox.py --status REFERENCE     # état d'un message
+    python outbox.py --list                 # derniers messages
+    python outbox.py --retry-failed         # remet en file les messages en échec
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import health
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_DB = os.getenv('OUTBOX_DB', 'outbox.sqlite3')
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', '30'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '300'))  # secondes, au-delà d'un envoi SMTP
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reference TEXT NOT NULL UNIQUE,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt);
+"""
+
+# Statuts : pending (en file), sending (en cours, jusqu'à next_attempt), sent (livré), failed (abandonné)
+STATUS_LABELS = {
+    'pending': "en attente d'envoi",
+    'sending': "en cours d'envoi",
+    'sent': "envoyé",
+    'failed': "non envoyé",
+}
+
+Sender = Callable[[str, str, str], None]
+
+
+def idempotency_key(*parts: str) -> str:
+    """Clé stable d'un contenu (espaces et casse normalisés)"""
+    normalized = "\x1f".join(" ".join(str(part).split()).lower() for part in parts)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class Outbox:
+    """File d'envoi persistante et son thread de livraison"""
+
+    def __init__(self, path: str = OUTBOX_DB, sender: Optional[Sender] = None):
+        self.path = path
+        self.sender = sender
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.executescript(SCHEMA)
+        with self._conn:
+            # Envois interrompus (bail expiré) : remis en file ; ceux d'un autre processus vivant sont laissés
+            now = time.time()
+            recovered = self._conn.execute(
+                "UPDATE outbox SET status = 'pending', next_attempt = ? WHERE status = 'sending' AND next_attempt <= ?",
+                (now, now)
+            ).rowcount
+        if recovered:
+            logger.warning(f"{recovered} message(s) interrompu(s) remis en file")
+        self._wake = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def enqueue(self, key: str, kind: str, to_email: str, subject: str, body: str) -> Tuple[str, bool]:
+        """
+        Enregistre un message, sauf si sa clé d'idempotence est déjà connue
+
+        Returns:
+            (référence, créé) ; créé vaut False pour un doublon
+        """
+        now = time.time()
+        reference = key[:12]
+        with self._lock, self._conn:
+            created = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (reference, idempotency_key, kind, to_email, subject, body, status, "
+                "next_attempt, created) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)",
+                (reference, key, kind, to_email, subject, body, now, now)
+            ).rowcount == 1
+        if created:
+            self._wake.set()
+        else:
+            logger.info(f"Message {reference} déjà en boîte d'envoi, doublon ignoré")
+        return reference, created
+
+    def status(self, reference: str) -> Optional[Dict[str, Any]]:
+        """État de livraison d'un message, None si la référence est inconnue"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reference, kind, status, attempts, last_error, created, sent_at FROM outbox WHERE reference = ?",
+                (reference,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('reference', 'kind', 'status', 'attempts', 'last_error', 'created', 'sent_at'), row))
+
+    def depth(self) -> Dict[str, Any]:
+        """Messages par statut (indicateur de préparation)"""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox WHERE status != 'sent' GROUP BY status"))
+        return {'pending': counts.get('pending', 0) + counts.get('sending', 0), 'failed': counts.get('failed', 0)}
+
+    def retry_failed(self) -> int:
+        with self._lock, self._conn:
+            count = self._conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt = ? WHERE status = 'failed'", (time.time(),)
+            ).rowcount
+        self._wake.set()
+        return count
+
+    def _claim(self) -> Optional[Tuple[int, str, str, str, str, int]]:
+        """
+        Réserve le prochain message dû (en file, ou « sending » au bail expiré)
+
+        BEGIN IMMEDIATE prend le verrou d'écriture avant la lecture et la mise à
+        jour conditionnelle vérifie le statut lu : deux workers, même dans deux
+        processus, ne réservent jamais le même message.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT id, reference, to_email, subject, body, attempts, status FROM outbox "
+                "WHERE status IN ('pending', 'sending') AND next_attempt <= ? ORDER BY next_attempt LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = self._conn.execute(
+                "UPDATE outbox SET status = 'sending', next_attempt = ? WHERE id = ? AND status = ? AND next_attempt <= ?",
+                (now + OUTBOX_LEASE, row[0], row[6], now)
+            ).rowcount == 1
+        if not claimed:
+            return None
+        if row[6] == 'sending':
+            logger.warning(f"Message {row[1]} repris après expiration de son bail d'envoi")
+        return row[:6]
+
+    def _finish(self, message_id: int, attempts: int, error: Optional[str]):
+        now = time.time()
+        with self._lock, self._conn:
+            if error is None:
+                self._conn.execute("UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL "
+                                   "WHERE id = ? AND status = 'sending'", (attempts, now, message_id))
+            else:
+                status = 'failed' if attempts >= OUTBOX_MAX_ATTEMPTS else 'pending'
+                self._conn.execute("UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ? "
+                                   "WHERE id = ? AND status = 'sending'",
+                                   (status, attempts, now + OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), error[:500], message_id))
+
+    def deliver_due(self) -> int:
+        """Envoie les messages dus, renvoie le nombre de messages livrés"""
+        delivered = 0
+        while True:
+            row = self._claim()
+            if row is None:
+                return delivered
+            message_id, reference, to_email, subject, body, attempts = row
+            try:
+                self.sender(to_email, subject, body)
+            except Exception as e:
+                self._finish(message_id, attempts + 1, f"{type(e).__name__}: {e}")
+                logger.error(f"Envoi du message {reference} en échec (tentative {attempts + 1}) : {e}")
+            else:
+                self._finish(message_id, attempts + 1, None)
+                delivered += 1
+                logger.info(f"Message {reference} envoyé à {to_email}")
+
+    def _deliver_loop(self, interval: float):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.deliver_due()
+            except sqlite3.Error as e:
+                logger.error(f"Boîte d'envoi illisible : {e}")
+
+    def start(self, interval: float = OUTBOX_POLL_INTERVAL):
+        with self._lock:
+            if self._worker is None and self.sender is not None:
+                self._worker = threading.Thread(target=self._deliver_loop, args=(interval,), name='outbox-delivery',
+                                                daemon=True)
+                self._worker.start()
+                self._wake.set()
+
+
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox(sender: Sender) -> Outbox:
+    """
+    Boîte d'envoi unique par processus, livraison démarrée et profondeur exposée par /ready
+
+    Le premier appel fixe la fonction d'envoi (to_email, subject, body).
+    """
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                outbox = Outbox(sender=sender)
+                outbox.start()
+                health.register_check('outbox_queue_depth', outbox.depth)
+                _outbox = outbox
+    return _outbox
+
+
+if __name__ == "__main__":
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Boîte d'envoi des emails")
+    parser.add_argument('--db', default=OUTBOX_DB)
+    parser.add_argument('--status', metavar='REFERENCE')
+    parser.add_argument('--list', action='store_true')
+    parser.add_argument('--retry-failed', action='store_true')
+    args = parser.parse_args()
+
+    outbox = Outbox(args.db)
+    if args.status:
+        message = outbox.status(args.status)
+        if message is None:
+            raise SystemExit(f"Référence inconnue : {args.status}")
+        sent = datetime.fromtimestamp(message['sent_at']).isoformat(timespec='seconds') if message['sent_at'] else '-'
+        print(f"{message['reference']} ({message['kind']}) : {STATUS_LABELS[message['status']]}, "
+              f"{message['attempts']} tentative(s), envoyé {sent}"
+              + (f", dernière erreur : {message['last_error']}" if message['last_error'] else ""))
+    elif args.retry_failed:
+        print(f"{outbox.retry_failed()} message(s) remis en file")
+    else:
+        rows: List[Tuple] = outbox._conn.execute(
+            "SELECT reference, kind, status, attempts, created FROM outbox ORDER BY id DESC LIMIT 20").fetchall()
+        for reference, kind, status, attempts, created in rows:
+            print(f"{datetime.fromtimestamp(created).isoformat(timespec='seconds')}  {reference}  {kind:<8} "
+                  f"{STATUS_LABELS[status]:<20} {attempts} tentative(s)")
+        print(f"En file : {outbox.depth()}")
@@ -0,0 +1,242 @@
+"""
+Filtre local des questions, appliqué avant toute limite et tout appel API.
+
+Contrôles, du moins coûteux au plus coûteux :
+- longueur (PREFILTER_MIN_CHARS à PREFILTER_MAX_CHARS) ;
+- exemple du champ recopié, même retouché (empreintes simhash proches) ;
+- jeu de caractères : caractères de contrôle, proportion de lettres, écriture
+  latine ;
+- contenu indésirable : caractère répété, liens, mots démesurés, frappe au
+  hasard (trop peu de voyelles) ;
+- langue : mots-outils français contre anglais ;
+- vocabulaire juridique : automate d'Aho-Corasick du catalogue (keyword_index).
+  Une question courte sans aucun terme juridique est refusée ; une question
+  plus longue passe au modèle, le lexique ne couvrant pas toutes les situations ;
+- doublons : un même client (adresse IP) ayant déjà obtenu PREFILTER_DUP_MAX
+  estimations pour exactement les mêmes entrées (texte canonique, type de
+  client, urgence) en PREFILTER_DUP_WINDOW secondes est refusé, toutes
+  répliques confondues (état partagé). Seules les estimations produites sont
+  comptées (record_submission) : un essai refusé par les limites ou interrompu
+  par une erreur ne compte pas. 0 désactive le contrôle.
+
+Une question refusée ne consomme ni la limite globale ni la limite de session.
+La question est normalisée une fois (normalization) ; le classement réutilise
+ensuite ce même résultat.
+
+Usage :
+    python prefilter.py "Bonjour, comment allez-vous ?"    # verdict d'une question
+    python prefilter.py --bench                            # débit, faux refus sur le corpus
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import health
+from keyword_index import get_keyword_index
+from normalization import normalize
+from shared_state import StateBackendError, get_state_backend
+
+logger = logging.getLogger(__name__)
+
+PREFILTER_MIN_CHARS = int(os.getenv('PREFILTER_MIN_CHARS', '15'))
+PREFILTER_MAX_CHARS = int(os.getenv('PREFILTER_MAX_CHARS', '2000'))
+PREFILTER_MIN_WORDS_UNMATCHED = int(os.getenv('PREFILTER_MIN_WORDS_UNMATCHED', '8'))
+PREFILTER_DUP_MAX = int(os.getenv('PREFILTER_DUP_MAX', '3'))
+PREFILTER_DUP_WINDOW = int(os.getenv('PREFILTER_DUP_WINDOW', '3600'))
+
+_REPEAT_RE = re.compile(r"(\S)\1{5,}")
+_URL_RE = re.compile(r"https?://|www\.", re.IGNORECASE)
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_LETTER_RE = re.compile(r"[^\W\d_]")
+_NON_LATIN_RE = re.compile(r"[^\W\d_A-Za-z\u00C0-\u024F]")
+_SPACE_RE = re.compile(r"\s")
+_LONG_WORD_RE = re.compile(r"\S{41,}")
+_WORD_CHAR_RE = re.compile(r"[a-z]")
+_VOWEL_RE = re.compile(r"[aeiouy]")
+
+FRENCH_WORDS = frozenset("""
+le la les un une des du de et ou mais donc que qui quoi quel quelle je tu il elle nous vous ils elles on mon ma mes
+ton ta tes son sa ses notre votre leur leurs ce cet cette ces dans sur sous avec sans pour par pas ne plus est suis
+sont ai avons avez ont etre avoir fait faire veut veux peut puis dois doit comment pourquoi depuis apres avant chez
+au aux en y si tres aussi bien lui moi
+""".split())
+ENGLISH_WORDS = frozenset("""
+the and or but what which who is are was were be have has had do does did my your his her our their this that these
+those with without for from into about how why when where can could would should will not you it they we
+""".split())
+
+MESSAGES = {
+    'vide': "Veuillez décrire votre cas avant de demander une estimation. N'utilisez pas l'exemple fourni tel quel.",
+    'exemple': "Veuillez décrire votre cas avant de demander une estimation. N'utilisez pas l'exemple fourni tel quel.",
+    'trop_court': "Votre description est trop courte : précisez votre situation en quelques phrases.",
+    'trop_long': f"Votre description dépasse {PREFILTER_MAX_CHARS} caractères : merci de la résumer.",
+    'caracteres': "Votre message n'a pas pu être analysé. Décrivez votre situation juridique en quelques phrases.",
+    'indesirable': "Votre message n'a pas pu être analysé. Décrivez votre situation juridique en quelques phrases.",
+    'langue': "Merci de décrire votre situation en français.",
+    'hors_sujet': ("Votre question ne semble pas relever du droit. Décrivez la situation juridique "
+                   "pour laquelle vous souhaitez l'aide d'un avocat."),
+    'doublon': ("Vous avez déjà obtenu plusieurs estimations pour cette même demande. "
+                "Merci de la reformuler ou de nous contacter directement."),
+}
+
+
+class Verdict:
+    """Décision du filtre et termes juridiques reconnus"""
+    __slots__ = ('accepted', 'reason', 'terms')
+
+    def __init__(self, accepted: bool, reason: str = '', terms: Optional[List[str]] = None):
+        self.accepted = accepted
+        self.reason = reason
+        self.terms = terms or []
+
+    @property
+    def message(self) -> str:
+        return MESSAGES.get(self.reason, '')
+
+
+_rejections: Counter = Counter()
+_rejections_lock = threading.Lock()
+
+
+def rejection_stats() -> Dict[str, int]:
+    """Refus par motif depuis le démarrage (indicateur de préparation)"""
+    with _rejections_lock:
+        return dict(_rejections)
+
+
+health.register_check('prefilter_rejections', rejection_stats)
+
+
+def _reject(reason: str, terms: Optional[List[str]] = None) -> Verdict:
+    with _rejections_lock:
+        _rejections[reason] += 1
+    return Verdict(False, reason, terms)
+
+
+def _content_reason(question: str, folded: str) -> str:
+    """Motif de refus lié à la forme du texte, '' s'il est acceptable"""
+    if _CONTROL_RE.search(question):
+        return 'caracteres'
+    letters = len(_LETTER_RE.findall(question))
+    if letters < (len(question) - len(_SPACE_RE.findall(question))) * 0.5:
+        return 'caracteres'
+    if len(_NON_LATIN_RE.findall(question)) > letters * 0.2:
+        return 'langue'
+    if _REPEAT_RE.search(question) or len(_URL_RE.findall(question)) >= 2:
+        return 'indesirable'
+    if _LONG_WORD_RE.search(folded):
+        return 'indesirable'
+    folded_letters = len(_WORD_CHAR_RE.findall(folded))
+    if folded_letters and len(_VOWEL_RE.findall(folded)) < folded_letters * 0.2:
+        return 'indesirable'
+    return ''
+
+
+def _submission_key(submission: str) -> str:
+    return f"dup:{hashlib.sha256(submission.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _submission_count(submission: str) -> int:
+    """Estimations déjà produites pour cette soumission (0 si l'état partagé est indisponible)"""
+    try:
+        return int(get_state_backend().get(_submission_key(submission)) or 0)
+    except StateBackendError as e:
+        logger.warning(f"Contrôle des doublons indisponible : {e}")
+        return 0
+
+
+def record_submission(submission: str):
+    """Compte une estimation produite pour cette soumission (client et entrées exactes)"""
+    if not PREFILTER_DUP_MAX or not submission:
+        return
+    try:
+        get_state_backend().incr(_submission_key(submission), ttl=PREFILTER_DUP_WINDOW)
+    except StateBackendError as e:
+        logger.warning(f"Contrôle des doublons indisponible : {e}")
+
+
+def prefilter_question(question: str, catalog: Any, placeholder: str = '', submission: str = '') -> Verdict:
+    """
+    Filtre une question avant l'analyse
+
+    Args:
+        question: Texte saisi
+        catalog: Version du catalogue (vocabulaire juridique)
+        placeholder: Exemple affiché dans le champ, refusé même recopié puis retouché
+        submission: Client et entrées exactes de la demande (contrôle des doublons, '' pour l'ignorer)
+
+    Returns:
+        Verdict: accepté, ou refusé avec son motif et le message à afficher
+    """
+    normalized = normalize(question)
+    if not normalized.text:
+        return _reject('vide')
+    if len(normalized.text) < PREFILTER_MIN_CHARS:
+        return _reject('trop_court')
+    if len(normalized.text) > PREFILTER_MAX_CHARS:
+        return _reject('trop_long')
+    if placeholder and normalized.near_duplicate(normalize(placeholder)):
+        return _reject('exemple')
+
+    reason = _content_reason(normalized.text, normalized.folded)
+    if reason:
+        return _reject(reason)
+
+    words = normalized.words
+    french = sum(word in FRENCH_WORDS for word in words)
+    english = sum(word in ENGLISH_WORDS for word in words)
+    if english >= 2 and english > french:
+        return _reject('langue')
+
+    terms = get_keyword_index(catalog).match(normalized.stems)
+    if not terms:
+        if len(words) >= 4 and not french:
+            return _reject('langue')
+        if len(words) < PREFILTER_MIN_WORDS_UNMATCHED:
+            return _reject('hors_sujet')
+
+    if PREFILTER_DUP_MAX and submission and _submission_count(submission) >= PREFILTER_DUP_MAX:
+        return _reject('doublon', terms)
+    return Verdict(True, '', terms)
+
+
+if __name__ == "__main__":
+    import json
+
+    from catalog_manager import get_catalog_manager
+
+    parser = argparse.ArgumentParser(description="Filtre local des questions")
+    parser.add_argument('question', nargs='?')
+    parser.add_argument('--bench', action='store_true')
+    parser.add_argument('--corpus', default='classification_corpus.jsonl')
+    args = parser.parse_args()
+
+    catalog = get_catalog_manager().current()
+    if args.question:
+        verdict = prefilter_question(args.question, catalog)
+        print(f"{'accepté' if verdict.accepted else 'refusé (' + verdict.reason + ')'} ; termes : {verdict.terms}")
+    if args.bench:
+        PREFILTER_DUP_MAX = 0
+        with open(args.corpus, encoding='utf-8') as f:
+            questions = [json.loads(line)['question'] for line in f if line.strip()]
+        junk = ["Bonjour comment allez vous ?", "asdfghjkl qwerty zxcvbnm", "aaaaaaaaaaaaaaaaaaaaaaaa",
+                "What is the best way to cook pasta at home?", "Achetez maintenant http://x.example http://y.example",
+                "Quelle est la recette de la tarte aux pommes ?", "1234567890 1234567890 !!!!", "Привет, как дела у тебя сегодня?"]
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for question in questions + junk:
+                prefilter_question(question, catalog)
+        elapsed = time.perf_counter() - start
+        false_rejects = [question for question in questions if not prefilter_question(question, catalog).accepted]
+        rejected = {question: prefilter_question(question, catalog).reason for question in junk}
+        print(f"{elapsed / (rounds * (len(questions) + len(junk))) * 1e6:.1f} µs/question, "
+              f"{len(false_rejects)}/{len(questions)} questions du corpus refusées")
+        for question, reason in rejected.items():
+            print(f"  {reason or 'accepté':<12} {question}")
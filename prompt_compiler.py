@@ -0,0 +1,377 @@
+"""
+Compilation des prompts de classification.
+
+Le prompt d'origine envoie toutes les clés du catalogue, la description
+complète du client et l'intégralité des consignes du chatbot (y compris une
+consigne de format contredite par le format JSON demandé). Le compilateur :
+
+    - remplace les clés par des identifiants courts et stables (hachage de
+      domaine.prestation), suivis de la clé, et les retraduit à la lecture
+      de la réponse via l'index du catalogue (une réponse donnant la clé
+      plutôt que l'identifiant est aussi reconnue) ;
+    - réduit la description du client à son profil (Pro/Entreprise/PME/Services) ;
+    - compacte les consignes (espaces, paragraphes contradictoires ou redondants) ;
+    - tient le prompt sous PROMPT_TOKEN_BUDGET jetons en écartant les domaines
+      les plus éloignés de la question (index TF-IDF et indices de mots-clés).
+      Avec le catalogue complet, identifiants compris, le prompt compilé est
+      aussi long que celui d'origine : c'est ce budget qui le réduit.
+
+Le modèle ne peut choisir qu'une prestation proposée : --stats vérifie hors
+ligne que la prestation attendue de chaque question du corpus reste proposée
+sous le budget (sortie en erreur sinon), --bench mesure la précision réelle.
+
+Les jetons sont comptés avec tiktoken s'il est installé et que son encodage
+est chargé, sinon estimés. L'encodage est chargé au démarrage dans un thread
+(load_tokenizer_async), jamais sur le chemin d'une requête ; tiktoken le
+télécharge au premier chargement, sauf s'il est déjà dans TIKTOKEN_CACHE_DIR
+(à renseigner dans l'image pour un démarrage sans réseau).
+
+Le compilateur est désactivé par défaut (PROMPT_COMPILER=1 pour l'activer) :
+le budget de 1000 jetons n'a été réglé qu'avec l'estimation, et la précision
+doit être comparée au prompt d'origine (--bench, API réelle) avant d'en faire
+le défaut.
+
+Usage :
+    python prompt_compiler.py --stats                    # jetons et couverture par budget (hors ligne)
+    python prompt_compiler.py --bench classification_corpus.jsonl
+                                                         # précision d'origine / compilée (API)
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalog_manager import CatalogVersion
+from keyword_index import get_keyword_index
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+PROMPT_COMPILER = os.getenv('PROMPT_COMPILER', '0') == '1'
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1000'))
+PROMPT_TOKENIZER = os.getenv('PROMPT_TOKENIZER', 'o200k_base')
+MIN_DOMAINS = 3
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def load_tokenizer() -> bool:
+    """Charge l'encodage tiktoken une fois par processus (peut le télécharger) ; False si indisponible"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+            except Exception as e:
+                logger.info(f"Tokeniseur {PROMPT_TOKENIZER} indisponible ({type(e).__name__}), estimation utilisée")
+            _encoding_loaded = True
+    return _encoding is not None
+
+
+def load_tokenizer_async():
+    """Charge l'encodage en arrière-plan : l'estimation sert jusqu'à la fin du chargement"""
+    if not _encoding_loaded:
+        threading.Thread(target=load_tokenizer, name='tokenizer-load', daemon=True).start()
+
+
+def count_tokens(text: str) -> int:
+    """Jetons du texte : tiktoken si l'encodage est chargé, sinon estimation (mots longs découpés par 6 caractères)"""
+    encoding = _encoding
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(1 + len(piece) // 6 for piece in re.findall(r"\w+|[^\w\s]", text))
+
+
+def legacy_classification_prompt(prestations: Dict[str, Any], question: str, client_type: str, urgency: str) -> str:
+    """Prompt de classification d'origine (PROMPT_COMPILER=0 et référence du banc d'essai)"""
+    options = [f"{domaine}: {', '.join(prestations_domaine['prestations'].keys())}" for domaine, prestations_domaine in prestations.items()]
+    return f"""Analysez la question suivante et déterminez si elle concerne un problème juridique. Si c'est le cas, identifiez le domaine juridique et la prestation la plus pertinente.
+
+Question : {question}
+Type de client : {client_type}
+Degré d'urgence : {urgency}
+
+Options de domaines et prestations :
+{' '.join(options)}
+
+Répondez au format JSON strict suivant :
+{{
+    "est_juridique": true/false,
+    "domaine": "nom du domaine juridique",
+    "prestation": "nom de la prestation (pas le label)",
+    "explication": "Brève explication de votre analyse",
+    "indice_confiance": 0.0 à 1.0,
+    "prestations_complementaires": [
+        {{"domaine": "nom du domaine", "prestation": "nom de la prestation", "probabilite": 0.0 à 1.0}}
+    ]
+}}
+
+Les prestations complémentaires (3 au maximum, liste vide si aucune) sont celles dont le client aura probablement besoin en plus de la prestation principale, avec la probabilité qu'elles soient nécessaires.
+"""
+
+
+def compact_client(client_type: str) -> str:
+    """« Professionnel - Entreprise (PME (10 à 250 salariés)) - Secteur Services » -> « Pro/Entreprise/PME/Services »"""
+    client_type = re.sub(r"\s*\((?:moins de|\d)[^()]*\)", "", client_type)
+    parts = [part.strip() for part in re.split(r"\s+-\s+|[()]", client_type) if part.strip()]
+    parts = [re.sub(r"^Secteur\s+", "", part) for part in parts]
+    if parts and parts[0] == "Professionnel":
+        parts[0] = "Pro"
+    return "/".join(parts)
+
+
+def compact_instructions(text: str) -> str:
+    """
+    Consignes sans indentation, sans consigne de format (le format JSON est imposé
+    par le prompt) et sans paragraphe dont les mots sont déjà presque tous présents
+    """
+    paragraphs = [" ".join(line.strip() for line in block.splitlines()).strip().strip('"').strip()
+                  for block in re.split(r"\n\s*\n", text)]
+    kept: List[str] = []
+    seen: set = set()
+    for paragraph in paragraphs:
+        if not paragraph or re.search(r"format de r[ée]ponse", paragraph, re.IGNORECASE):
+            continue
+        words = set(tokenize(paragraph))
+        if kept and words and len(words & seen) / len(words) >= 0.6:
+            continue
+        # Numérotation d'origine inutile une fois les paragraphes filtrés
+        kept.append(re.sub(r"^\d+\.\s*", "- ", paragraph))
+        seen |= words
+    return "\n".join(kept)
+
+
+def short_ids(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    """
+    Identifiants numériques dérivés du hachage de « domaine.prestation »
+
+    Un nombre de trois chiffres compte pour un seul jeton. Le nombre de chiffres
+    laisse au moins quatre emplacements par clé ; une collision est résolue par
+    sondage linéaire dans l'ordre des clés, si bien qu'un identifiant ne change
+    que si une clé ajoutée au catalogue entre en collision avec lui.
+    """
+    width = max(3, len(str(4 * len(keys))))
+    slots = 10 ** width
+    taken: Dict[int, Tuple[str, str]] = {}
+    for key in sorted(keys):
+        slot = int.from_bytes(hashlib.blake2b(f"{key[0]}.{key[1]}".encode('utf-8'), digest_size=8).digest(), 'big') % slots
+        while slot in taken:
+            slot = (slot + 1) % slots
+        taken[slot] = key
+    return {key: str(slot).zfill(width) for slot, key in taken.items()}
+
+
+class PromptCompiler:
+    """Prompts compilés pour une version du catalogue"""
+
+    def __init__(self, catalog: CatalogVersion, budget: int = PROMPT_TOKEN_BUDGET):
+        self.fingerprint = catalog.fingerprint
+        self.budget = budget
+        self.retrieval_index = catalog.retrieval_index
+        self.keyword_index = get_keyword_index(catalog)
+        self.ids = short_ids([(domaine, key) for domaine, info in catalog.prestations.items() for key in info.get('prestations', {})])
+        self.keys = {short_id: key for key, short_id in self.ids.items()}
+        self.domains_by_key: Dict[str, List[str]] = {}
+        for domaine, key in self.ids:
+            self.domains_by_key.setdefault(key, []).append(domaine)
+        self.system_prompt = compact_instructions(catalog.instructions)
+        self.width = len(next(iter(self.keys), ''))
+        # Une ligne par domaine, précompilée : « domaine: id prestation, id prestation »
+        self.domain_lines = {
+            domaine: f"{domaine}: " + ", ".join(f"{self.ids[(domaine, key)]} {key}" for key in info['prestations'])
+            for domaine, info in catalog.prestations.items() if info.get('prestations')
+        }
+
+    def _user_prompt(self, question: str, client_type: str, urgency: str, domains: List[str]) -> str:
+        options = "\n".join(self.domain_lines[domaine] for domaine in domains)
+        return f"""Question : {question}
+Client : {compact_client(client_type)}
+Urgence : {urgency}
+
+Est-ce une question juridique ? Si oui, choisissez la prestation la plus pertinente parmi (identifiant prestation, par domaine) :
+{options}
+
+JSON strict :
+{{"est_juridique": true/false, "prestation": "identifiant", "indice_confiance": 0.0-1.0, "prestations_complementaires": [{{"prestation": "identifiant", "probabilite": 0.0-1.0}}]}}
+Complémentaires : 3 au maximum (liste vide si aucune), celles dont le client aura probablement besoin en plus, avec la probabilité qu'elles soient nécessaires."""
+
+    def classification_messages(self, question: str, client_type: str, urgency: str) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Messages de classification sous le budget de jetons
+
+        Returns:
+            (messages, nombre de jetons)
+        """
+        domains = list(self.domain_lines)
+        user_prompt = self._user_prompt(question, client_type, urgency, domains)
+        tokens = count_tokens(self.system_prompt) + count_tokens(user_prompt)
+        if tokens > self.budget:
+            # Domaines classés par leur meilleure similarité avec la question et par les indices de
+            # mots-clés (ramenés entre 0 et 1), les plus éloignés écartés
+            best: Dict[str, float] = {}
+            for (domaine, _), score in zip(self.retrieval_index.entries, self.retrieval_index.scores(question)):
+                best[domaine] = max(best.get(domaine, 0.0), float(score))
+            hints = self.keyword_index.hints(question).domains
+            for domaine, score in hints:
+                best[domaine] = best.get(domaine, 0.0) + score / hints[0][1]
+            ranked = sorted(domains, key=lambda domaine: best.get(domaine, 0.0), reverse=True)
+            while tokens > self.budget and len(ranked) > MIN_DOMAINS:
+                ranked.pop()
+                user_prompt = self._user_prompt(question, client_type, urgency, ranked)
+                tokens = count_tokens(self.system_prompt) + count_tokens(user_prompt)
+            logger.info(f"Prompt réduit à {len(ranked)} domaines ({tokens} jetons, budget {self.budget})")
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        return messages, tokens
+
+    def decode(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Retraduit les identifiants de la réponse en (domaine, prestation) du catalogue"""
+        def resolve(answer: Any, domaine: Any = None) -> Tuple[str, str]:
+            text = str(answer or '').strip()
+            short_id, _, name = text.partition(' ')
+            if short_id.isdigit():
+                key = self.keys.get(short_id.zfill(self.width))
+                if key:
+                    return key
+            else:
+                name = text
+            # Clé de prestation (éventuellement « domaine.prestation ») au lieu de l'identifiant
+            name, domaine = name.strip(), str(domaine or '')
+            if '.' in name:
+                domaine, _, name = name.partition('.')
+            if (domaine, name) in self.ids:
+                return domaine, name
+            domains = self.domains_by_key.get(name, [])
+            if len(domains) == 1:
+                return domains[0], name
+            # Réponse inconnue : conservée telle quelle, la classification sera hors catalogue
+            return '', text
+
+        decoded = dict(result)
+        decoded['domaine'], decoded['prestation'] = resolve(result.get('prestation'), result.get('domaine'))
+        complements = []
+        for complement in result.get('prestations_complementaires') or []:
+            if isinstance(complement, dict):
+                domaine, prestation = resolve(complement.get('prestation'), complement.get('domaine'))
+                complements.append({**complement, 'domaine': domaine, 'prestation': prestation})
+        decoded['prestations_complementaires'] = complements
+        return decoded
+
+
+_compiler: Optional[PromptCompiler] = None
+_compiler_lock = threading.Lock()
+
+
+def get_prompt_compiler(catalog: CatalogVersion) -> PromptCompiler:
+    """Compilateur de la version du catalogue, recompilé quand son empreinte change"""
+    global _compiler
+    compiler = _compiler
+    if compiler is None or compiler.fingerprint != catalog.fingerprint:
+        with _compiler_lock:
+            if _compiler is None or _compiler.fingerprint != catalog.fingerprint:
+                _compiler = PromptCompiler(catalog)
+            compiler = _compiler
+    return compiler
+
+
+def _load_corpus(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _coverage(compiler: PromptCompiler, corpus: List[Dict[str, Any]]) -> Tuple[float, int]:
+    """(jetons moyens, questions dont la prestation attendue reste proposée au modèle)"""
+    tokens, covered = 0, 0
+    for row in corpus:
+        messages, count = compiler.classification_messages(row['question'], row['client_type'], row['urgency'])
+        tokens += count
+        covered += f" {compiler.ids[(row['domaine'], row['prestation'])]} " in messages[1]['content']
+    return tokens / len(corpus), covered
+
+
+def _stats(catalog: CatalogVersion, compiler: PromptCompiler, corpus: List[Dict[str, Any]]) -> bool:
+    legacy_system = count_tokens(catalog.instructions)
+    legacy = sum(legacy_system + count_tokens(legacy_classification_prompt(catalog.prestations, row['question'], row['client_type'], row['urgency']))
+                 for row in corpus) / len(corpus)
+    tokenizer = PROMPT_TOKENIZER if _encoding is not None else "estimation, TIKTOKEN_CACHE_DIR pour le décompte réel"
+    print(f"Jetons ({tokenizer}), moyenne sur {len(corpus)} questions")
+    print(f"  consignes système    : {legacy_system} -> {count_tokens(compiler.system_prompt)}")
+    print(f"  prompt d'origine     : {legacy:.0f}")
+    _, full_coverage = _coverage(PromptCompiler(catalog, budget=10 ** 9), corpus)
+    print("  budget   jetons  réduction  prestation attendue proposée")
+    for budget in sorted({1400, 1200, 1000, 800, compiler.budget}, reverse=True):
+        tokens, covered = _coverage(compiler if budget == compiler.budget else PromptCompiler(catalog, budget=budget), corpus)
+        marker = " <- budget retenu" if budget == compiler.budget else ""
+        print(f"  {budget:>6} {tokens:>8.0f} {1 - tokens / legacy:>10.0%}  {covered}/{len(corpus)}{marker}")
+        if budget == compiler.budget:
+            ok = covered >= full_coverage
+    print(f"  sans budget : {full_coverage}/{len(corpus)} ; " + ("aucune prestation attendue écartée" if ok else
+          "le budget écarte des prestations attendues"))
+    return ok
+
+
+def _bench(catalog: CatalogVersion, compiler: PromptCompiler, corpus: List[Dict[str, Any]], model: str, tolerance: float) -> bool:
+    from openai import OpenAI
+    client = OpenAI(api_key=os.environ['OPENAI_API_KEY'], base_url=os.getenv('OPENAI_BASE_URL') or None)
+
+    def classify(messages: List[Dict[str, str]], compiled: bool) -> Tuple[str, str]:
+        response = client.chat.completions.create(model=model, messages=messages, temperature=0.0, max_tokens=500)
+        try:
+            result = json.loads(response.choices[0].message.content)
+            if compiled:
+                result = compiler.decode(result)
+            return result.get('domaine', ''), result.get('prestation', '')
+        except (ValueError, AttributeError):
+            return '', ''
+
+    scores = {'origine': 0, 'compilé': 0}
+    for row in corpus:
+        expected = (row['domaine'], row['prestation'])
+        legacy_messages = [
+            {"role": "system", "content": catalog.instructions},
+            {"role": "user", "content": legacy_classification_prompt(catalog.prestations, row['question'], row['client_type'], row['urgency'])},
+        ]
+        compiled_messages, _ = compiler.classification_messages(row['question'], row['client_type'], row['urgency'])
+        legacy_answer = classify(legacy_messages, compiled=False)
+        compiled_answer = classify(compiled_messages, compiled=True)
+        scores['origine'] += legacy_answer == expected
+        scores['compilé'] += compiled_answer == expected
+        if legacy_answer != compiled_answer:
+            print(f"  écart : {row['question'][:60]}... origine {'.'.join(legacy_answer)} / compilé {'.'.join(compiled_answer)}")
+
+    legacy_accuracy = scores['origine'] / len(corpus)
+    compiled_accuracy = scores['compilé'] / len(corpus)
+    print(f"Précision ({model}, {len(corpus)} questions) : origine {legacy_accuracy:.1%}, compilé {compiled_accuracy:.1%}")
+    return compiled_accuracy >= legacy_accuracy - tolerance
+
+
+if __name__ == "__main__":
+    from catalog_manager import CatalogManager
+
+    parser = argparse.ArgumentParser(description="Compilation des prompts de classification")
+    parser.add_argument('--stats', action='store_true', help="Compare la taille des prompts (sans appel API)")
+    parser.add_argument('--bench', metavar='CORPUS', help="Compare la précision des deux prompts sur un corpus annoté")
+    parser.add_argument('--corpus', default='classification_corpus.jsonl')
+    parser.add_argument('--budget', type=int, default=PROMPT_TOKEN_BUDGET)
+    parser.add_argument('--model', default=os.getenv('OPENAI_FAST_MODEL', 'gpt-4o-mini'))
+    parser.add_argument('--tolerance', type=float, default=0.0, help="Baisse de précision admise (0.02 = 2 points)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    load_tokenizer()
+    catalog = CatalogManager(poll_interval=0).current()
+    compiler = PromptCompiler(catalog, budget=args.budget)
+    if args.bench:
+        ok = _bench(catalog, compiler, _load_corpus(args.bench), args.model, args.tolerance)
+        sys.exit(0 if ok else 1)
+    sys.exit(0 if _stats(catalog, compiler, _load_corpus(args.corpus)) else 1)
@@ -0,0 +1,73 @@
+"""
+Index de recherche local sur les définitions du catalogue.
+
+Vecteurs TF-IDF (label + définition) de chaque prestation, construits une fois
+par version du catalogue. Permet de mesurer la proximité entre une question et
+une prestation, sans appel réseau.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from normalization import content_words, normalize, words
+
+
+def tokenize(text: str) -> List[str]:
+    """Mots pleins repliés d'un texte"""
+    return content_words(words(text))
+
+
+class DefinitionIndex:
+    """Vecteurs TF-IDF normalisés de toutes les prestations du catalogue"""
+
+    def __init__(self, prestations: Dict[str, Any]):
+        self.entries: List[Tuple[str, str]] = []
+        documents = []
+        for domaine, domaine_info in prestations.items():
+            for key, info in domaine_info.get('prestations', {}).items():
+                self.entries.append((domaine, key))
+                documents.append(tokenize(f"{info.get('label', '')} {info.get('definition', '')}"))
+        self.positions = {entry: i for i, entry in enumerate(self.entries)}
+
+        self.vocabulary = {token: i for i, token in enumerate(sorted({token for doc in documents for token in doc}))}
+        counts = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, doc in enumerate(documents):
+            for token, count in Counter(doc).items():
+                counts[row, self.vocabulary[token]] = count
+
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1.0).astype(np.float32)
+        vectors = counts * self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms == 0, 1.0, norms)
+
+    def vectorize(self, text: str) -> np.ndarray:
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        # Question normalisée une fois par requête, partagée avec les autres consommateurs
+        for token, count in Counter(normalize(text).tokens).items():
+            column = self.vocabulary.get(token)
+            if column is not None:
+                vector[column] = count * self.idf[column]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def similarity_matrix(self) -> np.ndarray:
+        return self.vectors @ self.vectors.T
+
+    def scores(self, text: str) -> np.ndarray:
+        """Similarité cosinus de la question avec chaque prestation"""
+        return self.vectors @ self.vectorize(text)
+
+    def score(self, text: str, domaine: str, prestation: str) -> float:
+        """Similarité entre une question et une prestation donnée (0 si inconnue)"""
+        position = self.positions.get((domaine, prestation))
+        if position is None:
+            return 0.0
+        return float(self.vectors[position] @ self.vectorize(text))
+
+    def top(self, text: str, k: int = 5) -> List[Tuple[str, str, float]]:
+        """Les k prestations les plus proches de la question"""
+        scores = self.scores(text)
+        best = np.argsort(-scores)[:k]
+        return [(*self.entries[i], float(scores[i])) for i in best]
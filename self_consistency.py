@@ -0,0 +1,107 @@
+"""
+Vote par auto-cohérence sur la classification (domaine, prestation).
+
+Plutôt qu'un tirage unique, N classifications sont échantillonnées puis
+départagées à la majorité ; la part d'échantillons d'accord avec la réponse
+retenue (l'accord) alimente la calibration de l'indice de confiance.
+
+Deux modes (SELF_CONSISTENCY_MODE) :
+    - parallel : N appels concurrents sur un pool borné partagé par le
+      processus ; le vote s'arrête dès qu'un quorum (majorité stricte) est
+      atteint, les appels restants sont abandonnés ;
+    - n : une seule requête demandant N complétions (paramètre `n` de l'API),
+      moins coûteuse en jetons de prompt mais sans arrêt anticipé.
+
+SELF_CONSISTENCY_SAMPLES=1 (défaut) désactive le vote.
+"""
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SELF_CONSISTENCY_SAMPLES = int(os.getenv('SELF_CONSISTENCY_SAMPLES', '1'))
+SELF_CONSISTENCY_MODE = os.getenv('SELF_CONSISTENCY_MODE', 'parallel')
+SELF_CONSISTENCY_WORKERS = int(os.getenv('SELF_CONSISTENCY_WORKERS', '8'))
+SELF_CONSISTENCY_TEMPERATURE = float(os.getenv('SELF_CONSISTENCY_TEMPERATURE', '0.7'))
+
+# Pool unique : borne le nombre d'appels concurrents pour l'ensemble des sessions
+_executor = ThreadPoolExecutor(max_workers=SELF_CONSISTENCY_WORKERS, thread_name_prefix='self-consistency')
+
+
+def quorum(samples: int) -> int:
+    """Majorité stricte"""
+    return samples // 2 + 1
+
+
+class Vote:
+    """Résultat d'un vote : réponse retenue et échantillons qui l'ont choisie"""
+    __slots__ = ('key', 'winners', 'samples', 'agreement', 'early_exit')
+
+    def __init__(self, key: Optional[Hashable], winners: List[Dict[str, Any]], samples: int, early_exit: bool = False):
+        self.key = key
+        self.winners = winners
+        self.samples = samples
+        # Rapporté aux échantillons reçus : après un arrêt au quorum, 3 sur 3 valent un accord total
+        self.agreement = len(winners) / samples if samples else 0.0
+        self.early_exit = early_exit
+
+
+def majority(results: List[Dict[str, Any]], key: Callable[[Dict[str, Any]], Optional[Hashable]]) -> Vote:
+    """Vote majoritaire ; en cas d'égalité, la réponse obtenue la première l'emporte"""
+    keys = [key(result) for result in results]
+    counts = Counter(k for k in keys if k is not None)
+    if not counts:
+        return Vote(None, [], len(results))
+    winner = max(counts, key=lambda k: (counts[k], -keys.index(k)))
+    return Vote(winner, [r for r, k in zip(results, keys) if k == winner], len(results))
+
+
+def vote_parallel(sample: Callable[[], Optional[Dict[str, Any]]], key: Callable[[Dict[str, Any]], Optional[Hashable]],
+                  samples: int, timeout: float = 25.0) -> Vote:
+    """
+    Lance `samples` appels concurrents et s'arrête dès qu'une réponse atteint le quorum
+
+    `sample` renvoie une classification analysée, ou None si l'appel a échoué.
+    """
+    needed = quorum(samples)
+    # Chaque appel hérite du contexte (identifiant de requête, span parent)
+    futures: List[Future] = [
+        _executor.submit(contextvars.copy_context().run, sample) for _ in range(samples)
+    ]
+    results: List[Dict[str, Any]] = []
+    counts: Counter = Counter()
+    pending = set(futures)
+    deadline = time.monotonic() + timeout
+    early_exit = False
+    while pending:
+        done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            logger.warning(f"Vote interrompu après {timeout} s : {len(results)}/{samples} échantillons reçus")
+            break
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Échantillon de classification en échec : {e}")
+                continue
+            if result is None:
+                continue
+            results.append(result)
+            k = key(result)
+            if k is not None:
+                counts[k] += 1
+        if counts and counts.most_common(1)[0][1] >= needed:
+            early_exit = bool(pending)
+            break
+
+    # Les appels non démarrés sont annulés, ceux en cours terminent sans être attendus
+    for future in pending:
+        future.cancel()
+    vote = majority(results, key)
+    vote.early_exit = early_exit
+    return vote
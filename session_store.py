@@ -0,0 +1,191 @@
+"""
+État des sessions tenu hors de st.session_state.
+
+Chaque session navigateur ne conserve dans st.session_state que son
+identifiant ; son état (dernière estimation affichée, dernier message de
+contact) est un enregistrement compact à __slots__ du magasin du processus.
+Le captcha du formulaire de contact est sans état (antispam). Les limites de débit, communes aux répliques, sont tenues par
+l'état partagé (shared_state).
+
+Un thread purge les sessions inactives depuis SESSION_IDLE_TIMEOUT secondes
+(onglets fermés, sondes de disponibilité). La jauge mémoire (sessions
+actives, pic, octets estimés par session) est exposée par le serveur de santé
+pour dimensionner les conteneurs.
+"""
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import health
+from shared_state import StateBackendError, get_state_backend
+
+logger = logging.getLogger(__name__)
+
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', '1800'))
+SESSION_REAP_INTERVAL = float(os.getenv('SESSION_REAP_INTERVAL', '60'))
+
+
+class SessionRecord:
+    """État d'une session navigateur"""
+    __slots__ = ('session_id', 'created', 'last_seen', 'last_estimate', 'last_contact')
+
+    def __init__(self, session_id: str, now: float):
+        self.session_id = session_id
+        self.created = now
+        self.last_seen = now
+        # (empreinte des entrées, résultat affiché) de la dernière estimation, réaffichée aux reruns
+        self.last_estimate: Optional[Tuple[str, Dict[str, Any]]] = None
+        # Référence du dernier message de contact déposé dans la boîte d'envoi
+        self.last_contact: Optional[str] = None
+
+
+def _deep_size(value: Any, seen: set) -> int:
+    """Octets d'une valeur et de ses conteneurs imbriqués (dict, list, tuple, set), chacun compté une fois"""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(item, seen) for item in value)
+    return size
+
+
+def _record_size(record: SessionRecord) -> int:
+    """Octets occupés par un enregistrement et ce qu'il référence, devis et explications compris"""
+    seen: set = set()
+    return sum(_deep_size(value, seen) for value in
+               (record, record.session_id, record.created, record.last_seen, record.last_estimate, record.last_contact)
+               if value is not None)
+
+
+class SessionStore:
+    """Enregistrements de session du processus, purgés après inactivité"""
+
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, SessionRecord] = {}
+        self._lock = threading.Lock()
+        self._peak = 0
+        self._reaped = 0
+        self._reaper: Optional[threading.Thread] = None
+
+    @staticmethod
+    def new_session_id() -> str:
+        return secrets.token_hex(8)
+
+    def get(self, session_id: str) -> SessionRecord:
+        """Enregistrement de la session (créé au besoin), marqué comme actif"""
+        now = time.time()
+        record = self._sessions.get(session_id)
+        if record is None:
+            with self._lock:
+                record = self._sessions.get(session_id)
+                if record is None:
+                    record = SessionRecord(session_id, now)
+                    self._sessions[session_id] = record
+                    self._peak = max(self._peak, len(self._sessions))
+        record.last_seen = now
+        return record
+
+    @staticmethod
+    def check_global(max_requests: int, reset_interval: float) -> Tuple[bool, float]:
+        """
+        Compteur de requêtes commun à toutes les sessions et répliques, par fenêtre fixe
+
+        Un backend injoignable laisse passer la requête (la limite est une protection
+        de coût, pas de sécurité).
+
+        Returns:
+            (peut_continuer, secondes avant remise à zéro)
+        """
+        now = time.time()
+        window = int(now // reset_interval)
+        remaining = (window + 1) * reset_interval - now
+        try:
+            count = get_state_backend().incr(f"global:{window}", ttl=remaining + 1)
+        except StateBackendError as e:
+            logger.error(f"Limite globale non vérifiée : {e}")
+            return True, remaining
+        return count <= max_requests, remaining
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """Supprime les sessions inactives, renvoie leur nombre"""
+        cutoff = (now or time.time()) - self.idle_timeout
+        with self._lock:
+            idle = [session_id for session_id, record in self._sessions.items() if record.last_seen < cutoff]
+            for session_id in idle:
+                del self._sessions[session_id]
+            self._reaped += len(idle)
+        if idle:
+            logger.info(f"{len(idle)} sessions inactives purgées, {len(self._sessions)} actives")
+        return len(idle)
+
+    def _reap_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Purge des sessions en échec : {e}")
+
+    def start(self, interval: float = SESSION_REAP_INTERVAL):
+        with self._lock:
+            if self._reaper is None and interval > 0:
+                self._reaper = threading.Thread(target=self._reap_loop, args=(interval,), name='session-reaper', daemon=True)
+                self._reaper.start()
+
+    def memory_gauge(self) -> Dict[str, Any]:
+        """Sessions actives, pic, et empreinte mémoire estimée"""
+        with self._lock:
+            records = list(self._sessions.values())
+            peak, reaped = self._peak, self._reaped
+        total = sys.getsizeof(self._sessions) + sum(_record_size(record) for record in records)
+        per_session = total / len(records) if records else _record_size(SessionRecord('0' * 16, 0.0))
+        return {
+            'active_sessions': len(records),
+            'peak_sessions': peak,
+            'reaped_sessions': reaped,
+            'bytes': total,
+            'bytes_per_session': round(per_session),
+            'peak_bytes_estimate': round(per_session * peak),
+        }
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Magasin unique par processus, purge démarrée et jauge exposée par /ready"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = SessionStore()
+                store.start()
+                health.register_check('sessions', store.memory_gauge)
+                _store = store
+    return _store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Empreinte mémoire des sessions")
+    parser.add_argument('--sessions', type=int, default=10000)
+    args = parser.parse_args()
+
+    store = SessionStore()
+    now = time.time()
+    for _ in range(args.sessions):
+        store.get(store.new_session_id())
+    gauge = store.memory_gauge()
+    print(f"{gauge['active_sessions']} sessions : {gauge['bytes'] / 1024:.0f} Kio, "
+          f"{gauge['bytes_per_session']} octets par session")
+    print(f"purge après inactivité : {store.reap(now + SESSION_IDLE_TIMEOUT + 1)} sessions supprimées")
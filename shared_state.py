@@ -0,0 +1,588 @@
+"""
+État partagé entre les répliques : limites de débit, compteurs et caches.
+
+Derrière un répartiteur de charge, chaque réplique Streamlit tenait ses propres
+compteurs ; l'état qui doit être commun passe désormais par un backend choisi
+par STATE_BACKEND_URL :
+
+    memory://                       dans le processus (défaut, une seule réplique)
+    sqlite:///state.sqlite3         fichier SQLite sur un volume partagé (chemin
+    sqlite:////data/state.sqlite3   relatif ou absolu ; le mode WAL suppose des
+                                    répliques sur le même hôte)
+    redis://host:6379/0             serveur parlant le protocole Redis (RESP),
+                                    Redis ou mini_redis.py pour les essais
+
+Les opérations sont regroupées par lots (batch()) : un seul aller-retour réseau
+en Redis (pipelining), une seule transaction en SQLite. Les valeurs sont
+sérialisées en JSON hors mémoire.
+
+Les appelants traitent StateBackendError comme une indisponibilité passagère :
+les limites laissent passer, les caches répondent « absent ».
+
+Usage :
+    python shared_state.py --check redis://127.0.0.1:6390   # cohérence entre deux « répliques »
+    python shared_state.py --bench sqlite:///bench-state.sqlite3
+"""
+import abc
+import argparse
+import json
+import logging
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import health
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND_URL = os.getenv('STATE_BACKEND_URL', 'memory://')
+STATE_MEMORY_MAX_ENTRIES = int(os.getenv('STATE_MEMORY_MAX_ENTRIES', '100000'))
+STATE_REDIS_TIMEOUT = float(os.getenv('STATE_REDIS_TIMEOUT', '2'))
+STATE_REDIS_POOL_SIZE = int(os.getenv('STATE_REDIS_POOL_SIZE', '8'))
+STATE_PROBE_TTL = 30  # secondes entre deux sondes du backend
+SQLITE_PURGE_EVERY = 1000  # écritures entre deux purges des clés expirées
+
+# Opération d'un lot : ('get', clé) | ('set', clé, valeur, ttl) | ('incr', clé, pas, ttl) | ('delete', clé)
+Op = Tuple[Any, ...]
+
+
+class StateBackendError(RuntimeError):
+    """Backend injoignable ou réponse invalide"""
+
+
+class Batch:
+    """Opérations exécutées ensemble, résultats dans l'ordre des appels"""
+
+    def __init__(self, backend: 'StateBackend'):
+        self.backend = backend
+        self.ops: List[Op] = []
+
+    def get(self, key: str) -> 'Batch':
+        self.ops.append(('get', key))
+        return self
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> 'Batch':
+        self.ops.append(('set', key, value, ttl))
+        return self
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> 'Batch':
+        """Incrémente un compteur ; `ttl` ne s'applique qu'à sa création (fenêtre fixe)"""
+        self.ops.append(('incr', key, amount, ttl))
+        return self
+
+    def delete(self, key: str) -> 'Batch':
+        self.ops.append(('delete', key))
+        return self
+
+    def execute(self) -> List[Any]:
+        return self.backend.execute(self.ops) if self.ops else []
+
+
+class StateBackend(abc.ABC):
+    """Interface commune des backends (une méthode manquante échoue à l'instanciation)"""
+
+    name = 'abstract'
+
+    @abc.abstractmethod
+    def execute(self, ops: List[Op]) -> List[Any]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def hit_window(self, key: str, window: float, limit: int, now: Optional[float] = None) -> Tuple[bool, int, float]:
+        """
+        Fenêtre glissante : enregistre un passage s'il reste de la place
+
+        Returns:
+            (accepté, passages dans la fenêtre, horodatage du plus ancien)
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def ping(self) -> bool:
+        raise NotImplementedError
+
+    def batch(self) -> Batch:
+        return Batch(self)
+
+    def get(self, key: str) -> Any:
+        return self.execute([('get', key)])[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.execute([('set', key, value, ttl)])
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return self.execute([('incr', key, amount, ttl)])[0]
+
+    def delete(self, key: str):
+        self.execute([('delete', key)])
+
+    def get_many(self, keys: List[str]) -> List[Any]:
+        return self.execute([('get', key) for key in keys])
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        self.execute([('set', key, value, ttl) for key, value in items.items()])
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Dictionnaire du processus, borné (LRU) et à expiration paresseuse"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries: int = STATE_MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float) -> Optional[Tuple[Any, Optional[float]]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _store(self, key: str, value: Any, expires: Optional[float]):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def execute(self, ops: List[Op]) -> List[Any]:
+        now = time.time()
+        results = []
+        with self._lock:
+            for op in ops:
+                kind, key = op[0], op[1]
+                entry = self._live(key, now)
+                if kind == 'get':
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                    results.append(entry[0] if entry is not None else None)
+                elif kind == 'set':
+                    self._store(key, op[2], now + op[3] if op[3] else None)
+                    results.append(True)
+                elif kind == 'incr':
+                    value = (entry[0] if entry is not None else 0) + op[2]
+                    self._store(key, value, entry[1] if entry is not None else (now + op[3] if op[3] else None))
+                    results.append(value)
+                elif kind == 'delete':
+                    results.append(self._entries.pop(key, None) is not None)
+                else:
+                    raise StateBackendError(f"Opération inconnue : {kind}")
+        return results
+
+    def hit_window(self, key: str, window: float, limit: int, now: Optional[float] = None) -> Tuple[bool, int, float]:
+        now = now or time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            hits = [ts for ts in entry[0] if ts > now - window] if entry is not None else []
+            accepted = len(hits) < limit
+            if accepted:
+                hits.append(now)
+            self._store(key, hits, now + window)
+            return accepted, len(hits), hits[0] if hits else now
+
+    def ping(self) -> bool:
+        return True
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_state_expires ON state(expires);
+
+CREATE TABLE IF NOT EXISTS state_windows (
+    key TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_state_windows ON state_windows(key, ts);
+"""
+
+
+class SQLiteBackend(StateBackend):
+    """Fichier SQLite partagé : une connexion par thread, un lot par transaction"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().executescript(SQLITE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, func) -> Any:
+        """Exécute func(conn) dans une transaction d'écriture (verrou pris dès le début)"""
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            raise StateBackendError(f"SQLite {self.path} : {e}") from e
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            self.purge()
+        return result
+
+    def execute(self, ops: List[Op]) -> List[Any]:
+        now = time.time()
+
+        def run(conn: sqlite3.Connection) -> List[Any]:
+            results = []
+            for op in ops:
+                kind, key = op[0], op[1]
+                if kind == 'get':
+                    row = conn.execute("SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                                       (key, now)).fetchone()
+                    results.append(json.loads(row[0]) if row else None)
+                elif kind == 'set':
+                    conn.execute("INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, json.dumps(op[2]), now + op[3] if op[3] else None))
+                    results.append(True)
+                elif kind == 'incr':
+                    row = conn.execute("SELECT value, expires FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                                       (key, now)).fetchone()
+                    value = (json.loads(row[0]) if row else 0) + op[2]
+                    expires = row[1] if row else (now + op[3] if op[3] else None)
+                    conn.execute("INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+                                 (key, json.dumps(value), expires))
+                    results.append(value)
+                elif kind == 'delete':
+                    results.append(conn.execute("DELETE FROM state WHERE key = ?", (key,)).rowcount > 0)
+                else:
+                    raise StateBackendError(f"Opération inconnue : {kind}")
+            return results
+
+        return self._transaction(run)
+
+    def hit_window(self, key: str, window: float, limit: int, now: Optional[float] = None) -> Tuple[bool, int, float]:
+        now = now or time.time()
+
+        def run(conn: sqlite3.Connection) -> Tuple[bool, int, float]:
+            conn.execute("DELETE FROM state_windows WHERE key = ? AND ts <= ?", (key, now - window))
+            count, oldest = conn.execute("SELECT COUNT(*), MIN(ts) FROM state_windows WHERE key = ?", (key,)).fetchone()
+            if count >= limit:
+                return False, count, oldest
+            conn.execute("INSERT INTO state_windows (key, ts) VALUES (?, ?)", (key, now))
+            return True, count + 1, oldest if oldest is not None else now
+
+        return self._transaction(run)
+
+    def purge(self):
+        """Supprime les clés expirées et les passages de plus d'une journée"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?", (now,))
+            conn.execute("DELETE FROM state_windows WHERE ts <= ?", (now - 86400,))
+        except sqlite3.Error as e:
+            logger.warning(f"Purge de l'état partagé en échec : {e}")
+
+    def ping(self) -> bool:
+        try:
+            return self._connect().execute("SELECT 1").fetchone() == (1,)
+        except sqlite3.Error as e:
+            raise StateBackendError(f"SQLite {self.path} : {e}") from e
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisReplyError(Exception):
+    """Réponse d'erreur (-ERR ...) du serveur"""
+
+
+def encode_command(*args: Any) -> bytes:
+    """Commande RESP : tableau de chaînes binaires"""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+
+def read_reply(stream) -> Any:
+    """Lit une réponse RESP ; les erreurs sont renvoyées (pas levées) pour garder le flux aligné"""
+    line = stream.readline()
+    if not line.endswith(b'\r\n'):
+        raise StateBackendError("Connexion fermée par le serveur")
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b'+':
+        return payload.decode('utf-8')
+    if prefix == b'-':
+        return RedisReplyError(payload.decode('utf-8'))
+    if prefix == b':':
+        return int(payload)
+    if prefix == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if prefix == b'*':
+        length = int(payload)
+        return None if length < 0 else [read_reply(stream) for _ in range(length)]
+    raise StateBackendError(f"Réponse RESP invalide : {line[:50]!r}")
+
+
+class _RedisConnection:
+    def __init__(self, host: str, port: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile('rb')
+
+    def pipeline(self, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        """Envoie toutes les commandes puis lit toutes les réponses (un aller-retour)"""
+        self.sock.sendall(b''.join(encode_command(*command) for command in commands))
+        return [read_reply(self.stream) for _ in commands]
+
+    def close(self):
+        try:
+            self.stream.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBackend(StateBackend):
+    """Client RESP minimal : connexions réutilisées, lots envoyés en pipeline"""
+
+    name = 'redis'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0, password: Optional[str] = None,
+                 timeout: float = STATE_REDIS_TIMEOUT, pool_size: int = STATE_REDIS_POOL_SIZE):
+        self.host, self.port, self.db, self.password = host, port, db, password
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._pool: List[_RedisConnection] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> _RedisConnection:
+        with self._lock:
+            if self._pool:
+                return self._pool.pop()
+        conn = _RedisConnection(self.host, self.port, self.timeout)
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        for reply in conn.pipeline(setup) if setup else []:
+            if isinstance(reply, RedisReplyError):
+                conn.close()
+                raise StateBackendError(f"Redis {self.host}:{self.port} : {reply}")
+        return conn
+
+    def _release(self, conn: _RedisConnection):
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+        conn.close()
+
+    def pipeline(self, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        """Exécute les commandes en un aller-retour ; la connexion est jetée en cas d'erreur réseau"""
+        try:
+            conn = self._acquire()
+        except OSError as e:
+            raise StateBackendError(f"Redis {self.host}:{self.port} injoignable : {e}") from e
+        try:
+            replies = conn.pipeline(commands)
+        except (OSError, StateBackendError) as e:
+            conn.close()
+            raise StateBackendError(f"Redis {self.host}:{self.port} : {e}") from e
+        self._release(conn)
+        for reply in replies:
+            if isinstance(reply, RedisReplyError):
+                raise StateBackendError(f"Redis : {reply}")
+        return replies
+
+    def execute(self, ops: List[Op]) -> List[Any]:
+        commands: List[Tuple[Any, ...]] = []
+        # Index de la réponse qui porte le résultat de chaque opération
+        positions: List[int] = []
+        for op in ops:
+            kind, key = op[0], op[1]
+            if kind == 'get':
+                commands.append(('GET', key))
+            elif kind == 'set':
+                ttl = op[3]
+                commands.append(('SET', key, json.dumps(op[2])) + (('PX', max(1, int(ttl * 1000))) if ttl else ()))
+            elif kind == 'incr':
+                if op[3]:
+                    # Crée le compteur avec son expiration s'il n'existe pas, sans toucher à celle d'un compteur existant
+                    commands.append(('SET', key, 0, 'PX', max(1, int(op[3] * 1000)), 'NX'))
+                commands.append(('INCRBY', key, op[2]))
+            elif kind == 'delete':
+                commands.append(('DEL', key))
+            else:
+                raise StateBackendError(f"Opération inconnue : {kind}")
+            positions.append(len(commands) - 1)
+
+        replies = self.pipeline(commands)
+        results = []
+        for op, position in zip(ops, positions):
+            reply = replies[position]
+            if op[0] == 'get':
+                results.append(json.loads(reply) if reply is not None else None)
+            elif op[0] == 'set':
+                results.append(reply == 'OK')
+            elif op[0] == 'incr':
+                results.append(reply)
+            else:
+                results.append(reply > 0)
+        return results
+
+    def hit_window(self, key: str, window: float, limit: int, now: Optional[float] = None) -> Tuple[bool, int, float]:
+        now = now or time.time()
+        member = f"{now:.6f}:{secrets.token_hex(4)}"
+        # Ajout puis comptage dans une transaction : un passage refusé est retiré ensuite
+        replies = self.pipeline([
+            ('MULTI',),
+            ('ZREMRANGEBYSCORE', key, '-inf', repr(now - window)),
+            ('ZADD', key, repr(now), member),
+            ('ZCARD', key),
+            ('ZRANGE', key, 0, 0, 'WITHSCORES'),
+            ('PEXPIRE', key, max(1, int(window * 1000))),
+            ('EXEC',),
+        ])
+        results = replies[-1]
+        if results is None or any(isinstance(reply, RedisReplyError) for reply in results):
+            raise StateBackendError(f"Redis : transaction refusée {results!r}")
+        _, count, oldest, _ = results[1:]
+        if count > limit:
+            self.pipeline([('ZREM', key, member)])
+            return False, count - 1, float(oldest[1])
+        return True, count, float(oldest[1])
+
+    def ping(self) -> bool:
+        return self.pipeline([('PING',)])[0] == 'PONG'
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+
+
+def backend_from_url(url: str) -> StateBackend:
+    """memory://, sqlite:///chemin ou redis://[:mot_de_passe@]hôte:port/base"""
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryBackend()
+    if parsed.scheme == 'sqlite':
+        path = (parsed.netloc + parsed.path)[1:] if parsed.path.startswith('/') else parsed.netloc + parsed.path
+        return SQLiteBackend(path or 'state.sqlite3')
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.strip('/') or 0)
+        password = unquote(parsed.password) if parsed.password else None
+        return RedisBackend(parsed.hostname or '127.0.0.1', parsed.port or 6379, db, password)
+    raise ValueError(f"STATE_BACKEND_URL non reconnue : {url}")
+
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_state_backend() -> StateBackend:
+    """Backend unique par processus, joignabilité exposée par /ready"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = backend_from_url(STATE_BACKEND_URL)
+                health.register_check('state_backend', health.CachedProbe(backend.ping, STATE_PROBE_TTL))
+                logger.info(f"État partagé : backend {backend.name}")
+                _backend = backend
+    return _backend
+
+
+def _check(url: str) -> bool:
+    """Deux instances du même backend (deux « répliques ») voient les mêmes compteurs et limites"""
+    first = backend_from_url(url)
+    # Le backend mémoire n'est partagé qu'au sein du processus
+    second = first if urlparse(url).scheme == 'memory' else backend_from_url(url)
+    prefix = f"check:{secrets.token_hex(4)}"
+    ok = True
+
+    def expect(label: str, value: Any, expected: Any):
+        nonlocal ok
+        ok &= value == expected
+        print(f"  {'ok ' if value == expected else 'ÉCHEC'} {label} : {value!r} (attendu {expected!r})")
+
+    expect("compteur partagé", [first.incr(f"{prefix}:n", ttl=60), second.incr(f"{prefix}:n", ttl=60)], [1, 2])
+    first.set_many({f"{prefix}:a": {'x': 1}, f"{prefix}:b": [1, 2]}, ttl=60)
+    expect("lecture groupée", second.get_many([f"{prefix}:a", f"{prefix}:b", f"{prefix}:c"]), [{'x': 1}, [1, 2], None])
+    expect("lot", second.batch().incr(f"{prefix}:n").get(f"{prefix}:a").delete(f"{prefix}:a").execute(), [3, {'x': 1}, True])
+    hits = [backend.hit_window(f"{prefix}:w", 60, 3)[0] for backend in (first, second, first, second)]
+    expect("fenêtre glissante (3 passages)", hits, [True, True, True, False])
+    first.set(f"{prefix}:t", 1, ttl=0.05)
+    time.sleep(0.1)
+    expect("expiration", second.get(f"{prefix}:t"), None)
+    first.close()
+    second.close()
+    return ok
+
+
+def _bench(url: str, operations: int):
+    backend = backend_from_url(url)
+    keys = [f"bench:{i}" for i in range(100)]
+    start = time.perf_counter()
+    for i in range(operations):
+        backend.incr(keys[i % 100], ttl=60)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(0, operations, 100):
+        batch = backend.batch()
+        for key in keys:
+            batch.incr(key, ttl=60)
+        batch.execute()
+    batched = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(operations // 10):
+        backend.hit_window(f"bench:window:{i % 100}", 60, 1000)
+    window = time.perf_counter() - start
+    print(f"{backend.name} : {operations / single:,.0f} incr/s unitaires, {operations / batched:,.0f} incr/s par lots de 100, "
+          f"{operations // 10 / window:,.0f} hit_window/s")
+    backend.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backends d'état partagé")
+    parser.add_argument('--check', metavar='URL', help="Vérifie le partage entre deux instances du backend")
+    parser.add_argument('--bench', metavar='URL', help="Débit des opérations unitaires et par lots")
+    parser.add_argument('--operations', type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.check:
+        print(f"Vérification de {args.check}")
+        raise SystemExit(0 if _check(args.check) else 1)
+    _bench(args.bench or STATE_BACKEND_URL, args.operations)
@@ -0,0 +1,80 @@
+"""
+Contrôle du budget de temps d'import au démarrage.
+
+Importe un module dans un interpréteur neuf avec `-X importtime`, totalise le
+temps cumulé et échoue si le budget est dépassé ou si une dépendance lourde
+(openai, smtplib, email.mime) est chargée dès l'import.
+
+Usage :
+    python startup_budget.py                 # vérifie app.py
+    python startup_budget.py --budget-ms 800 --module app
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Modules qui ne doivent être importés qu'au premier usage
+LAZY_MODULES = ('openai', 'smtplib', 'email.mime')
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module: str) -> Dict[str, int]:
+    """
+    Retourne le temps cumulé (µs) de chaque module importé par `module`
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Import de {module} impossible :\n{proc.stderr[-2000:]}")
+
+    timings = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            timings[match.group(4)] = int(match.group(2))
+    return timings
+
+
+def check_budget(module: str, budget_ms: float) -> Tuple[bool, List[str]]:
+    """
+    Vérifie le budget d'import et l'absence de dépendances lourdes
+
+    Returns:
+        (respecté, messages)
+    """
+    timings = measure_imports(module)
+    messages = []
+    total_ms = timings.get(module, 0) / 1000
+    ok = total_ms <= budget_ms
+    messages.append(f"import {module} : {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+
+    eager = sorted(name for name in timings if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY_MODULES))
+    if eager:
+        ok = False
+        messages.append(f"Modules importés trop tôt : {', '.join(eager)}")
+
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[1:6]
+    messages.extend(f"  {name:<40} {us / 1000:8.1f} ms" for name, us in slowest)
+    return ok, messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Budget de temps d'import au démarrage")
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', '1500')))
+    args = parser.parse_args()
+
+    ok, messages = check_budget(args.module, args.budget_ms)
+    print("\n".join(messages))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,268 @@
+"""
+Traçage des étapes d'une estimation (spans compatibles OpenTelemetry).
+
+Chaque étape (animation, analyse, analyse détaillée, calcul, envoi SMTP) est
+enveloppée dans un span portant ses attributs (domaine, tokens, cache, escalades).
+Le span parent est propagé par contextvar, y compris vers les threads lancés
+par timeout_handler qui copient le contexte.
+
+Lorsque le span racine se termine, la trace complète est :
+    - conservée en mémoire (dernières traces) pour la vue cascade en DEBUG ;
+    - exportée en arrière-plan vers TRACE_FILE (lignes JSON au format OTLP)
+      et/ou vers un collecteur OTLP/HTTP (OTEL_EXPORTER_OTLP_ENDPOINT).
+Un span encore ouvert à la fin de sa trace, ou ouvert après (thread abandonné
+par timeout_handler, analyse détaillée, préchargement), est exporté seul à sa
+fin, sans être retenu.
+
+Usage du collecteur de substitution (tests locaux) :
+    python tracing.py --collector 4318 --output traces-collector.jsonl
+"""
+import argparse
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'estimaone')
+MAX_RECENT_TRACES = 50
+
+
+class Span:
+    """Étape chronométrée d'une trace"""
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes', 'status')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes)
+        self.status = 'OK'
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Représentation OTLP/JSON du span"""
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or self.start_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': 1 if self.status == 'OK' else 2},
+        }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    """Enveloppe OTLP/JSON (ExportTraceServiceRequest) pour une liste de spans"""
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'estimaone.tracing'}, 'spans': [span.to_otlp() for span in spans]}],
+        }]
+    }
+
+
+class FileSpanExporter:
+    """Écrit chaque trace terminée sous forme d'une ligne JSON OTLP"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(otlp_payload(spans), ensure_ascii=False) + '\n')
+
+
+class OTLPHttpExporter:
+    """Envoie les traces à un collecteur OTLP/HTTP (encodage JSON)"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.timeout = timeout
+
+    def export(self, spans: List[Span]):
+        body = json.dumps(otlp_payload(spans)).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+class Tracer:
+    """Crée les spans, regroupe les traces et les exporte hors du thread de la requête"""
+
+    def __init__(self, exporters: List[Any]):
+        self.exporters = exporters
+        self._lock = threading.Lock()
+        self._open: Dict[str, List[Span]] = {}
+        self._recent: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._queue: queue.Queue = queue.Queue(maxsize=1000)
+        if exporters:
+            threading.Thread(target=self._export_loop, name='trace-exporter', daemon=True).start()
+
+    @classmethod
+    def from_env(cls) -> 'Tracer':
+        exporters = []
+        if os.getenv('TRACE_FILE'):
+            exporters.append(FileSpanExporter(os.environ['TRACE_FILE']))
+        if os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'):
+            exporters.append(OTLPHttpExporter(os.environ['OTEL_EXPORTER_OTLP_ENDPOINT']))
+        return cls(exporters)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        with self._lock:
+            # Trace déjà terminée (thread abandonné par timeout_handler, tâche de fond) :
+            # le span tardif n'est pas enregistré, il sera exporté seul
+            spans = self._open.get(trace_id) if parent else self._open.setdefault(trace_id, [])
+            if spans is not None:
+                spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'ERROR'
+            span.set_attribute('error', repr(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            with self._lock:
+                # Fin et test sous le verrou : un span est exporté soit avec sa trace, soit seul
+                span.end_ns = time.time_ns()
+                late = parent is not None and trace_id not in self._open
+            if parent is None:
+                self._finish_trace(trace_id)
+            elif late:
+                # Terminé après sa racine (étape en timeout, analyse en arrière-plan) : exporté seul
+                self._finish_late_span(span)
+
+    def _finish_trace(self, trace_id: str):
+        with self._lock:
+            spans = self._open.pop(trace_id, [])
+            # Les spans encore ouverts (étape en timeout) seront exportés seuls à leur fin
+            finished = [span for span in spans if span.end_ns is not None]
+            self._recent[trace_id] = spans
+            while len(self._recent) > MAX_RECENT_TRACES:
+                self._recent.popitem(last=False)
+        if self.exporters:
+            try:
+                self._queue.put_nowait(finished)
+            except queue.Full:
+                logger.warning("File d'export des traces pleine, trace ignorée")
+
+    def _finish_late_span(self, span: Span):
+        with self._lock:
+            recent = self._recent.get(span.trace_id)
+            if recent is not None and span not in recent:
+                recent.append(span)
+        if self.exporters:
+            try:
+                self._queue.put_nowait([span])
+            except queue.Full:
+                logger.warning("File d'export des traces pleine, span ignoré")
+
+    def _export_loop(self):
+        while True:
+            spans = self._queue.get()
+            for exporter in self.exporters:
+                try:
+                    exporter.export(spans)
+                except Exception as e:
+                    logger.warning(f"Export des traces en échec ({type(exporter).__name__}) : {e}")
+
+    def get_trace(self, trace_id: str) -> List[Span]:
+        with self._lock:
+            return list(self._recent.get(trace_id, []))
+
+
+def current_span() -> Optional[Span]:
+    """Span actif dans le contexte courant"""
+    return _current_span.get()
+
+
+def set_span_attributes(**attributes: Any):
+    """Ajoute des attributs au span actif (sans effet hors trace)"""
+    span = _current_span.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+tracer = Tracer.from_env()
+
+
+def traced(name: Optional[str] = None, **attributes: Any):
+    """Décorateur : exécute la fonction dans un span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name or func.__name__, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    output_path = 'traces-collector.jsonl'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        with open(self.output_path, 'ab') as f:
+            f.write(body.rstrip(b'\n') + b'\n')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collecteur OTLP/HTTP de substitution")
+    parser.add_argument('--collector', type=int, default=4318, help="Port d'écoute")
+    parser.add_argument('--output', default='traces-collector.jsonl')
+    args = parser.parse_args()
+
+    _CollectorHandler.output_path = args.output
+    print(f"Collecteur OTLP en écoute sur http://localhost:{args.collector}/v1/traces -> {args.output}")
+    ThreadingHTTPServer(('0.0.0.0', args.collector), _CollectorHandler).serve_forever()